@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import platform
+import sys
+
+import torch
+
+from benchmark.suites import suites
+from utils.common import set_threads
+
+parser = argparse.ArgumentParser(description='Benchmark the sketch, train and inference hot paths on CPU',
+                                 prog='python -m benchmark')
+
+parser.add_argument(
+    '--suites',
+    type=str,
+    nargs='+',
+    default=list(suites),
+    choices=list(suites),
+    help='The suites to run. default:all')
+
+parser.add_argument(
+    '--repeat',
+    type=int,
+    default=5,
+    help='Report the median of this many runs of each case. default:5')
+
+parser.add_argument(
+    '--threads',
+    type=int,
+    default=1,
+    help='The number of torch threads, fixed for repeatable results. default:1')
+
+parser.add_argument(
+    '--cpu_cores',
+    type=str,
+    default=None,
+    help='Pin the benchmark to these CPU cores, the scaling suite goes up to their number, e.g. 0-7. default:None')
+
+parser.add_argument(
+    '--quick',
+    action='store_true',
+    help='Only run a few small cases of each suite.')
+
+parser.add_argument(
+    '--output',
+    type=str,
+    default='benchmark_results.json',
+    help='Where to write the results. default:benchmark_results.json')
+
+parser.add_argument(
+    '--baseline',
+    type=str,
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json'),
+    help='Compare the results against this file if it exists. default:benchmark/baseline.json')
+
+parser.add_argument(
+    '--save_baseline',
+    action='store_true',
+    help='Write the results as the new baseline instead of comparing against it.')
+
+parser.add_argument(
+    '--tolerance',
+    type=float,
+    default=0.2,
+    help='A case regresses if it is slower than the baseline by more than this proportion. default:0.2')
+
+args = parser.parse_args()
+
+def compare(results, baseline):
+    """Cases slower than the baseline by more than the tolerance, as (name, time, baseline time)"""
+    if baseline['environment'] != results['environment']:
+        print('Warning: the baseline was measured in a different environment {}'.format(baseline['environment']))
+    regressions = []
+    for name, result in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        base = baseline['cases'][name]['time']
+        ratio = result['time'] / base
+        flag = ''
+        if ratio > 1 + args.tolerance:
+            regressions.append((name, result['time'], base))
+            flag = 'REGRESSION'
+        elif ratio < 1 - args.tolerance:
+            flag = 'improved'
+        print('%-60s %12.3fms %12.3fms %8.2fx %s' % (name, result['time'] * 1000, base * 1000, ratio, flag))
+    return regressions
+
+def main():
+    set_threads(args.threads, cores=args.cpu_cores)
+    results = {'environment': {'torch': torch.__version__, 'python': platform.python_version(),
+                               'machine': platform.machine(), 'processor': platform.processor(),
+                               'threads': args.threads, 'cpu_cores': args.cpu_cores, 'quick': args.quick},
+               'cases': {}}
+    for suite in args.suites:
+        print('==> {}'.format(suite))
+        for name, result in suites[suite](args.repeat, args.quick):
+            results['cases'][name] = result
+            print('%-60s %12.3fms%s' % (name, result['time'] * 1000, '   %6.2fx speedup %6.1f%% efficiency' % (
+                result['speedup'], 100 * result['efficiency']) if 'speedup' in result else ''))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline written to {}'.format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save_baseline to create one'.format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print('%-60s %14s %14s %9s' % ('Case', 'Current', 'Baseline', 'Ratio'))
+    regressions = compare(results, baseline)
+    if regressions:
+        print('{} case(s) regressed by more than {:.0f}%'.format(len(regressions), 100 * args.tolerance))
+        sys.exit(1)
+    print('No regression')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import os
+import tempfile
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+
+import utils.sketch as sketch
+from utils.common import available_cores
+from utils.registry import registry
+
+# The conv weights of the sketched architectures, in (filters, channels, kh, kw)
+sketch_shapes = [(16, 16, 3, 3), (64, 64, 3, 3), (128, 128, 3, 3), (256, 256, 3, 3), (512, 512, 3, 3),
+                 (256, 64, 1, 1), (1024, 256, 1, 1), (512, 2048, 1, 1)]
+sketch_rates = [0.3, 0.5, 0.7]
+quick_archs = [('resnet', 'cifar10', 'resnet56')]
+checkpoint_archs = [('resnet', 'cifar10', 'resnet56'), ('resnet', 'imagenet', 'resnet50')]
+
+
+def measure(func, repeat, warmup=1):
+    """Median and min wall time of func over repeat runs, after warmup runs"""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    times.sort()
+    return {'time': times[len(times) // 2], 'min_time': times[0]}
+
+def get_archs(keys):
+    """(name, Arch) of the registry keys, e.g. resnet/cifar10/resnet56"""
+    return [('/'.join(k for k in key if k is not None), registry[key]) for key in keys]
+
+def all_archs(quick):
+    return get_archs(quick_archs if quick else sorted(registry, key=lambda key: (key[0], key[1], key[2] or '')))
+
+def build(arch, sketch_rate=None):
+    torch.manual_seed(0)
+    return arch.build(sketch_rate)
+
+def bench_sketch_matrix(repeat, quick):
+    for shape in sketch_shapes[:3] if quick else sketch_shapes:
+        weight = torch.randn(*shape, generator=torch.Generator().manual_seed(0))
+        for dim in (0, 1):
+            for rate in sketch_rates:
+                l = max(1, int(shape[dim] * rate))
+                result = measure(lambda: sketch.sketch_matrix(weight, l, dim), repeat)
+                yield 'sketch_matrix/{}/dim{}/l{}'.format('x'.join(str(d) for d in shape), dim, l), result
+
+def bench_sketch_model(repeat, quick):
+    for name, arch in all_archs(quick):
+        ori = build(arch).state_dict()
+        model = build(arch, [0.5] * arch.num_rates(1))
+        result = measure(lambda: sketch.sketch_state_dict(arch, model, ori), max(1, repeat // 2))
+        yield 'sketch_model/' + name, result
+
+def bench_step(repeat, quick):
+    """Forward + backward + SGD step of each architecture sketched at 0.5, and an inference forward"""
+    for name, arch in all_archs(quick):
+        model = build(arch, [0.5] * arch.num_rates(1))
+        batch_size = 32 if arch.input_size == 32 else 8
+        inputs = torch.randn(batch_size, 3, arch.input_size, arch.input_size,
+                             generator=torch.Generator().manual_seed(0))
+        targets = torch.zeros(batch_size, dtype=torch.long)
+        loss_func = nn.CrossEntropyLoss()
+        optimizer = optim.SGD(model.parameters(), lr=1e-3, momentum=0.9)
+
+        def train_step():
+            optimizer.zero_grad()
+            loss_func(model(inputs), targets).backward()
+            optimizer.step()
+
+        def forward():
+            with torch.no_grad():
+                model(inputs)
+
+        model.train()
+        yield 'train_step/{}/b{}'.format(name, batch_size), measure(train_step, repeat)
+        model.eval()
+        yield 'forward/{}/b{}'.format(name, batch_size), measure(forward, repeat)
+
+def bench_loader(repeat, quick):
+    """Seconds per batch of the CIFAR-10 training transforms on synthetic images"""
+    transform = transforms.Compose([
+        transforms.RandomCrop(32, padding=4),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+    ])
+    dataset = datasets.FakeData(size=2048, image_size=(3, 32, 32), num_classes=10, transform=transform,
+                                random_offset=0)
+    for num_workers in (0,) if quick else (0, 2):
+        loader = DataLoader(dataset, batch_size=128, shuffle=False, num_workers=num_workers)
+
+        def epoch():
+            for _ in loader:
+                pass
+
+        result = measure(epoch, max(1, repeat // 2))
+        yield 'loader/cifar10/b128/w{}'.format(num_workers), {k: v / len(loader) for k, v in result.items()}
+
+def bench_checkpoint(repeat, quick):
+    for name, arch in get_archs(quick_archs if quick else checkpoint_archs):
+        state = {'state_dict': build(arch).state_dict()}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.pt')
+            yield 'checkpoint_save/' + name, measure(lambda: torch.save(state, path), repeat)
+            yield 'checkpoint_load/' + name, measure(lambda: torch.load(path, map_location='cpu'), repeat)
+
+def thread_counts(quick):
+    """1, 2, 4, ... up to the available cores, and all of them"""
+    num_cores = len(available_cores())
+    counts = [1, 2] if quick else [2 ** i for i in range(num_cores.bit_length()) if 2 ** i < num_cores]
+    return sorted(set(min(count, num_cores) for count in counts + [num_cores]))
+
+def bench_scaling(repeat, quick):
+    """Sketch and inference time from 1 to all cores, with the speedup and parallel efficiency over 1 thread"""
+    shape = (128, 128, 3, 3) if quick else (512, 512, 3, 3)
+    weight = torch.randn(*shape, generator=torch.Generator().manual_seed(0))
+    arch = registry[quick_archs[0]]
+    model = build(arch, [0.5] * arch.num_rates(1)).eval()
+    inputs = torch.randn(64, 3, arch.input_size, arch.input_size, generator=torch.Generator().manual_seed(0))
+
+    def forward():
+        with torch.no_grad():
+            model(inputs)
+
+    cases = [('sketch_matrix/{}/l{}'.format('x'.join(str(d) for d in shape), shape[0] // 2),
+              lambda: sketch.sketch_matrix(weight, shape[0] // 2, 0)),
+             ('forward/{}/b64'.format(quick_archs[0][2]), forward)]
+    num_threads = torch.get_num_threads()
+    try:
+        for name, func in cases:
+            base_time = None
+            for threads in thread_counts(quick):
+                torch.set_num_threads(threads)
+                result = measure(func, repeat)
+                base_time = base_time or result['time']
+                result['speedup'] = base_time / result['time']
+                result['efficiency'] = result['speedup'] / threads
+                yield 'scaling/{}/t{}'.format(name, threads), result
+    finally:
+        torch.set_num_threads(num_threads)
+
+suites = {
+    'sketch_matrix': bench_sketch_matrix,
+    'sketch_model': bench_sketch_model,
+    'step': bench_step,
+    'loader': bench_loader,
+    'checkpoint': bench_checkpoint,
+    'scaling': bench_scaling,
+}
@@ -1,9 +1,17 @@
 from torchvision.datasets import CIFAR10
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 import torchvision.transforms as transforms
+from data.subset import stratified_indices
+
+class IndexedCIFAR10(CIFAR10):
+    """CIFAR10 that also returns the index of each sample, e.g. to look up cached teacher logits"""
+
+    def __getitem__(self, index):
+        img, target = super(IndexedCIFAR10, self).__getitem__(index)
+        return img, target, index
 
 class Data:
-    def __init__(self, args):
+    def __init__(self, args, indexed=False, val_samples=0, eval_samples=0):
         pin_memory = True
 
         transform_train = transforms.Compose([
@@ -18,14 +26,39 @@ class Data:
             transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
         ])
 
-        trainset = CIFAR10(root=args.data_path, train=True, download=True, transform=transform_train)
+        dataset = IndexedCIFAR10 if indexed else CIFAR10
+        trainset = dataset(root=args.data_path, train=True, download=True, transform=transform_train)
+
+        if val_samples > 0:
+            # A fixed class-balanced split of the training images, held out of training and seen with
+            # the test transforms, so that early stopping never looks at the test set
+            val_indices = stratified_indices(trainset.targets, val_samples)
+            valset = CIFAR10(root=args.data_path, train=True, download=False, transform=transform_test)
+            self.valLoader = DataLoader(
+                Subset(valset, val_indices), batch_size=args.eval_batch_size, shuffle=False,
+                num_workers=2, pin_memory=pin_memory)
+            held_out = set(val_indices)
+            trainset = Subset(trainset, [i for i in range(len(trainset)) if i not in held_out])
 
         self.trainLoader = DataLoader(
             trainset, batch_size=args.train_batch_size, shuffle=True,
             num_workers=2, pin_memory=pin_memory
         )
 
+        if indexed:
+            # The un-augmented training set, in order
+            centerset = IndexedCIFAR10(root=args.data_path, train=True, download=False, transform=transform_test)
+            self.centerLoader = DataLoader(
+                centerset, batch_size=args.eval_batch_size, shuffle=False,
+                num_workers=2, pin_memory=pin_memory)
+
         testset = CIFAR10(root=args.data_path, train=False, download=False, transform=transform_test)
         self.testLoader = DataLoader(
             testset, batch_size=args.eval_batch_size, shuffle=False,
-            num_workers=2, pin_memory=pin_memory)
\ No newline at end of file
+            num_workers=2, pin_memory=pin_memory)
+
+        if eval_samples > 0:
+            # A fixed class-balanced subset of the test set, its accuracy estimates the test accuracy
+            self.fastLoader = DataLoader(
+                Subset(testset, stratified_indices(testset.targets, eval_samples)), batch_size=args.eval_batch_size,
+                shuffle=False, num_workers=2, pin_memory=pin_memory)
@@ -1,3 +1,4 @@
+import os
 import time
 import torch.utils.data
 import nvidia.dali.ops as ops
@@ -9,10 +10,13 @@ from nvidia.dali.plugin.pytorch import DALIClassificationIterator, DALIGenericIt
 
 
 class HybridTrainPipe(Pipeline):
-    def __init__(self, batch_size, num_threads, device_id, data_dir, crop, dali_cpu=False, local_rank=0, world_size=1):
+    def __init__(self, batch_size, num_threads, device_id, data_dir, crop, dali_cpu=False, local_rank=0, world_size=1,
+                 file_list=None):
         super(HybridTrainPipe, self).__init__(batch_size, num_threads, device_id, seed=12 + device_id)
         dali_device = "gpu"
-        self.input = ops.FileReader(file_root=data_dir, shard_id=local_rank, num_shards=world_size, random_shuffle=True)
+        reader_args = {'file_list': file_list} if file_list is not None else {}
+        self.input = ops.FileReader(file_root=data_dir, shard_id=local_rank, num_shards=world_size, random_shuffle=True,
+                                    **reader_args)
         self.decode = ops.ImageDecoder(device="mixed", output_type=types.RGB)
         self.res = ops.RandomResizedCrop(device="gpu", size=crop, random_area=[0.08, 1.25])
         self.cmnp = ops.CropMirrorNormalize(device="gpu",
@@ -34,10 +38,12 @@ class HybridTrainPipe(Pipeline):
 
 
 class HybridValPipe(Pipeline):
-    def __init__(self, batch_size, num_threads, device_id, data_dir, crop, size, local_rank=0, world_size=1):
+    def __init__(self, batch_size, num_threads, device_id, data_dir, crop, size, local_rank=0, world_size=1,
+                 file_list=None):
         super(HybridValPipe, self).__init__(batch_size, num_threads, device_id, seed=12 + device_id)
+        reader_args = {'file_list': file_list} if file_list is not None else {}
         self.input = ops.FileReader(file_root=data_dir, shard_id=local_rank, num_shards=world_size,
-                                    random_shuffle=False)
+                                    random_shuffle=False, **reader_args)
         self.decode = ops.ImageDecoder(device="mixed", output_type=types.RGB)
         self.res = ops.Resize(device="gpu", resize_shorter=size, interp_type=types.INTERP_TRIANGULAR)
         self.cmnp = ops.CropMirrorNormalize(device="gpu",
@@ -56,13 +62,25 @@ class HybridValPipe(Pipeline):
         return [output, self.labels]
 
 
+def indexed_file_list(image_dir, path):
+    """Write a DALI file_list of the training images labelled with their index, returns the class of each"""
+    root = image_dir + '/ILSVRC2012_img_train'
+    dataset = datasets.ImageFolder(root)
+    with open(path, 'w') as f:
+        for index, (file, _) in enumerate(dataset.samples):
+            f.write('{} {}\n'.format(os.path.relpath(file, root), index))
+    return dataset.targets
+
+
 def get_imagenet_iter_dali(type, image_dir, batch_size, num_threads, device_id, num_gpus, crop, val_size=256,
                            world_size=1,
-                           local_rank=0):
+                           local_rank=0, file_list=None):
+    # With a file_list from indexed_file_list, the labels of 'train' and of 'center' (the training images with
+    # the validation transforms, in order) are sample indices
     if type == 'train':
         pip_train = HybridTrainPipe(batch_size=batch_size, num_threads=num_threads, device_id=device_id,
                                     data_dir=image_dir + '/ILSVRC2012_img_train',
-                                    crop=crop, world_size=world_size, local_rank=local_rank)
+                                    crop=crop, world_size=world_size, local_rank=local_rank, file_list=file_list)
         pip_train.build()
         dali_iter_train = DALIClassificationIterator(pip_train, size=pip_train.epoch_size("Reader") // world_size)
         return dali_iter_train
@@ -73,6 +91,13 @@ def get_imagenet_iter_dali(type, image_dir, batch_size, num_threads, device_id,
         pip_val.build()
         dali_iter_val = DALIClassificationIterator(pip_val, size=pip_val.epoch_size("Reader") // world_size)
         return dali_iter_val
+    elif type == 'center':
+        pip_center = HybridValPipe(batch_size=batch_size, num_threads=num_threads, device_id=device_id,
+                                   data_dir=image_dir + '/ILSVRC2012_img_train',
+                                   crop=crop, size=val_size, world_size=world_size, local_rank=local_rank,
+                                   file_list=file_list)
+        pip_center.build()
+        return DALIClassificationIterator(pip_center, size=pip_center.epoch_size("Reader") // world_size)
 
 
 def get_imagenet_iter_torch(type, image_dir, batch_size, num_threads, device_id, num_gpus, crop, val_size=256,
@@ -0,0 +1,22 @@
+import random
+from torch.utils.data import DataLoader, Subset
+
+
+def stratified_indices(targets, num_samples, seed=0):
+    """A deterministic subset with the same number of samples of each class (up to rounding)"""
+    by_class = {}
+    for index, target in enumerate(targets):
+        by_class.setdefault(int(target), []).append(index)
+    rng = random.Random(seed)
+    per_class = max(1, num_samples // len(by_class))
+    indices = []
+    for target in sorted(by_class):
+        class_indices = by_class[target]
+        rng.shuffle(class_indices)
+        indices += class_indices[:per_class]
+    return sorted(indices)
+
+def subset_loader(dataset, num_samples, batch_size, num_workers=2, seed=0):
+    """Loader of a stratified deterministic subset of a dataset with a targets attribute (CIFAR10, ImageFolder)"""
+    subset = Subset(dataset, stratified_indices(dataset.targets, num_samples, seed))
+    return DataLoader(subset, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=True)
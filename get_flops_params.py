@@ -1,22 +1,23 @@
 import torch
 import argparse
 import utils.common as utils
-from importlib import import_module
-from thop import profile
+from utils import cost
+from utils.channel import get_channel_round
+from utils.registry import get_arch
 
 parser = argparse.ArgumentParser(description='Get Model Flops and Params')
 
 parser.add_argument(
     '--input_image_size',
     type=int,
-    default=32,
-    help='The input_image_size. default:32')
+    default=None,
+    help='The input_image_size, for both counters. default:None, the size the model is trained at')
 
 parser.add_argument(
     '--arch',
     type=str,
     default='resnet',
-    choices=('resnet','googlenet'),
+    choices=('resnet','googlenet','vgg','mobilenet_v2'),
     help='The architecture to prune. default:resnet')
 
 parser.add_argument(
@@ -40,40 +41,78 @@ parser.add_argument(
     help='The proportion of each layer reserved after sketching convolution layer. default:None'
 )
 
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--counter',
+    type=str,
+    default='analytic',
+    choices=('analytic', 'thop'),
+    help='Count analytically from the architecture, or with a thop forward pass. default:analytic'
+)
+
+parser.add_argument(
+    '--per_layer',
+    action='store_true',
+    help='Print the FLOPs, params and activation memory of each layer.'
+)
+
 args = parser.parse_args()
 
 device = torch.device("cpu")
+arch = get_arch(args.arch, args.cfg, args.data_set)
+input_size = arch.input_size if args.input_image_size is None else args.input_image_size
 
-print('==> Building model..')
-sketch_rate = utils.get_sketch_rate(args.sketch_rate)
-if args.arch == 'resnet':
-    if args.data_set == 'imagenet':
-        orimodel = import_module(f'model.{args.arch}_imagenet')\
-                    .resnet(args.cfg).to(device)
-        model = import_module(f'model.{args.arch}_imagenet')\
-                    .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=1).to(device)
-    else:
-        orimodel = import_module(f'model.{args.arch}').resnet(args.cfg).to(device)
-        model = import_module(f'model.{args.arch}')\
-                    .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=1).to(device)
-elif args.arch == 'googlenet':
-    orimodel = import_module(f'model.{args.arch}').googlenet().to(device)
-    model = import_module(f'model.{args.arch}').googlenet(sketch_rate).to(device)
-else:
-    raise('arch not exist!')
-
-input = torch.randn(1, 3, args.input_image_size, args.input_image_size)
+def print_layers(layers):
+    print('%-36s %-14s %12s %10s %12s' % ('Layer', 'Shape', 'FLOPS', 'Params', 'Activation'))
+    for layer in layers:
+        if layer.type == 'bn':
+            continue
+        flops, params, activation = cost.layer_cost(layer)
+        shape = '%dx%dx%d' % (layer.in_channels, layer.out_channels, layer.kernel_size)
+        print('%-36s %-14s %12d %10d %10.2fKB' % (layer.name, shape, flops, params, activation / 1024.))
+
+def get_flops_params(sketch_rate=None, channel_round=None):
+    if args.counter == 'thop':
+        from thop import profile
+        input = torch.randn(1, 3, input_size, input_size)
+        return profile(arch.build(sketch_rate, channel_round=channel_round).to(device), inputs=(input, ))
+
+    layers = arch.get_layers(sketch_rate, channel_round=channel_round, input_size=input_size)
+    if args.per_layer:
+        print_layers(layers)
+    flops, params, activation = cost.get_cost(layers)
+    print('Activation: %.2fMB'%(activation / 1024. ** 2))
+    return flops, params
+
+sketch_rate = utils.get_sketch_rate(args.sketch_rate) if args.sketch_rate is not None else None
+channel_round = get_channel_round(args.channel_round)
 
 print('--------------UnPruned Model--------------')
-oriflops, oriparams = profile(orimodel, inputs=(input, ))
+oriflops, oriparams = get_flops_params()
 print('Params: %.2f'%(oriparams))
 print('FLOPS: %.2f'%(oriflops))
 
 print('--------------Pruned Model--------------')
-flops, params = profile(model, inputs=(input, ))
+flops, params = get_flops_params(sketch_rate, channel_round)
 print('Params: %.2f'%(params))
 print('FLOPS: %.2f'%(flops))
 
 print('--------------Retention Ratio--------------')
 print('Params Retention Ratio: %d/%d (%.2f%%)' % (params, oriparams, 100. * params / oriparams))
-print('FLOPS Retention Ratio: %d/%d (%.2f%%)' % (flops, oriflops, 100. * flops / oriflops))
\ No newline at end of file
+print('FLOPS Retention Ratio: %d/%d (%.2f%%)' % (flops, oriflops, 100. * flops / oriflops))
+
+print('--------------Channel Rounding--------------')
+policies = ['none', '8', '16', '32']
+if args.channel_round is not None and args.channel_round not in policies:
+    policies.append(args.channel_round)
+print('%-12s %14s %14s %10s' % ('Policy', 'Params', 'FLOPS', 'Speedup'))
+for policy in policies:
+    policy_flops, policy_params = cost.profile(arch, sketch_rate, channel_round=get_channel_round(policy),
+                                                 input_size=input_size)
+    print('%-12s %14d %14d %9.2fx' % (policy, policy_params, policy_flops, oriflops / policy_flops))
@@ -0,0 +1,260 @@
+import torch
+import torch.nn as nn
+import argparse
+import json
+import time
+import utils.common as utils
+import utils.shrink as shrink
+from utils import cost
+from utils.channel import get_channel_round
+from utils.profiler import LayerTimer
+from utils.registry import get_arch
+
+parser = argparse.ArgumentParser(description='Get Model Latency on CPU')
+
+parser.add_argument(
+    '--input_image_size',
+    type=int,
+    default=None,
+    help='The input_image_size. default:32 for cifar10, 224 for imagenet')
+
+parser.add_argument(
+    '--arch',
+    type=str,
+    default='resnet',
+    choices=('resnet','googlenet','vgg','mobilenet_v2'),
+    help='The architecture to prune. default:resnet')
+
+parser.add_argument(
+    '--data_set',
+    type=str,
+    default='cifar10',
+    help='Select dataset to Test. default:cifar10',
+)
+
+parser.add_argument(
+    '--cfg',
+    type=str,
+    default='resnet56',
+    help='Detail architecuture of model. default:resnet56'
+)
+
+parser.add_argument(
+    '--sketch_rate',
+    type=str,
+    default=None,
+    help='The proportion of each layer reserved after sketching convolution layer. default:None'
+)
+
+parser.add_argument(
+    '--start_conv',
+    type=int,
+    default=1,
+    help='The index of Conv to start sketch, index starts from 0. default:1'
+)
+
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--build_lut',
+    type=str,
+    default=None,
+    help='Time the widths around each sketched width and write them to this channel_round lookup table. default:None'
+)
+
+parser.add_argument(
+    '--batch_sizes',
+    type=int,
+    nargs='+',
+    default=[1, 8, 32],
+    help='The batch sizes to time. default:1 8 32')
+
+parser.add_argument(
+    '--num_threads',
+    type=int,
+    nargs='+',
+    default=[1, torch.get_num_threads()],
+    help='The numbers of intra-op threads to time. default:1 and all cores')
+
+parser.add_argument(
+    '--warmup',
+    type=int,
+    default=10,
+    help='The number of untimed warm-up iterations. default:10')
+
+parser.add_argument(
+    '--iterations',
+    type=int,
+    default=50,
+    help='The number of timed iterations. default:50')
+
+parser.add_argument(
+    '--output',
+    type=str,
+    default=None,
+    help='Write the measurements to this JSON file. default:None')
+
+args = parser.parse_args()
+
+device = torch.device('cpu')
+arch = get_arch(args.arch, args.cfg, args.data_set)
+input_image_size = args.input_image_size or (224 if args.data_set == 'imagenet' else 32)
+
+def build_model(sketch_rate=None, channel_round=None):
+    return arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+
+def measure(model, batch_size, layer_timer=None):
+    """Median forward wall time in seconds, and the average time of each layer"""
+    input = torch.randn(batch_size, 3, input_image_size, input_image_size)
+    times = []
+    with torch.no_grad():
+        for _ in range(args.warmup):
+            model(input)
+        if layer_timer is not None:
+            layer_timer.reset()
+        for _ in range(args.iterations):
+            start_time = time.perf_counter()
+            model(input)
+            times.append(time.perf_counter() - start_time)
+    layer_times = layer_timer.average() if layer_timer is not None else None
+    return sorted(times)[len(times) // 2], layer_times
+
+def conv_inputs(model):
+    """The input height and width of each convolution of model, from one forward pass"""
+    sizes = {}
+    def hook(name):
+        def record(module, input, output):
+            sizes[name] = tuple(input[0].size()[2:])
+        return record
+    handles = [module.register_forward_hook(hook(name)) for name, module in model.named_modules()
+               if isinstance(module, nn.Conv2d)]
+    with torch.no_grad():
+        model(torch.randn(1, 3, input_image_size, input_image_size))
+    for handle in handles:
+        handle.remove()
+    return sizes
+
+def like(conv, in_channels, out_channels, groups=1):
+    """A convolution with the kernel, stride, padding and bias of conv"""
+    return nn.Conv2d(in_channels, out_channels, conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                     dilation=conv.dilation, groups=groups, bias=conv.bias is not None)
+
+def build_lut(sketch_rate):
+    """Time each sketched conv and the convs that follow its filters at the widths within 1/8 of the sketched width.
+
+    The convs are timed at the input size and stride they have in the model:
+    the sketched conv, the depthwise conv coupled to it if any (e.g. in a
+    MobileNetV2 block) and the conv that consumes its filters. The table is
+    keyed by the original width, as the models round with it. Layers of the
+    same original width share an entry, each width keeps the mean latency of
+    the layers that measured it.
+    """
+    orimodules = dict(build_model().named_modules())
+    model = build_model(sketch_rate).eval()
+    modules = dict(model.named_modules())
+    sizes = conv_inputs(model)
+    # The layer whose input channels are the filters of each sketched conv
+    consumers = {producer.conv: consumer.conv for producer, consumer in shrink.channel_pairs(arch)}
+    totals, counts = {}, {}
+    with torch.no_grad():
+        for layer in [layer for unit in arch.units for layer in unit.layers if layer.filter]:
+            conv, oriconv = modules[layer.conv], orimodules[layer.conv]
+            if conv.out_channels == oriconv.out_channels:
+                continue
+            coupled = modules[layer.coupled.conv] if layer.coupled is not None else None
+            consumer = modules[consumers[layer.conv]] if layer.conv in consumers else None
+            input = torch.randn(args.batch_sizes[0], conv.in_channels, *sizes[layer.conv])
+            tolerance = max(1, conv.out_channels // 8)
+            total = totals.setdefault(str(oriconv.out_channels), {})
+            count = counts.setdefault(str(oriconv.out_channels), {})
+            for width in range(max(1, conv.out_channels - tolerance), conv.out_channels + tolerance + 1):
+                convs = [like(conv, conv.in_channels, width)]
+                if coupled is not None:
+                    convs.append(like(coupled, width, width, groups=width))
+                if consumer is not None:
+                    convs.append(like(consumer, width, consumer.out_channels))
+                block = nn.Sequential(*convs).eval()
+                for _ in range(args.warmup):
+                    block(input)
+                start_time = time.perf_counter()
+                for _ in range(args.iterations):
+                    block(input)
+                total[str(width)] = total.get(str(width), 0.0) + (time.perf_counter() - start_time) / args.iterations
+                count[str(width)] = count.get(str(width), 0) + 1
+    lut = {channels: {width: total[width] / counts[channels][width] for width in total}
+           for channels, total in totals.items()}
+    with open(args.build_lut, 'w') as f:
+        json.dump(lut, f, indent=2)
+    print('Lookup table written to {}, use it with --channel_round lut:{}'.format(args.build_lut, args.build_lut))
+
+def main():
+    sketch_rate = utils.get_sketch_rate(args.sketch_rate) if args.sketch_rate is not None else None
+    channel_round = get_channel_round(args.channel_round)
+    if args.build_lut is not None:
+        torch.set_num_threads(args.num_threads[-1])
+        build_lut(sketch_rate)
+        return
+
+    orimodel = build_model().eval()
+    model = build_model(sketch_rate, channel_round).eval()
+
+    orilayers = {layer.name: cost.layer_cost(layer)[0] for layer in arch.get_layers()}
+    layers = {layer.name: cost.layer_cost(layer)[0]
+              for layer in arch.get_layers(sketch_rate, args.start_conv, channel_round)}
+    flops_ratio = sum(layers.values()) / sum(orilayers.values())
+
+    ori_timer = LayerTimer(orimodel)
+    timer = LayerTimer(model)
+
+    results = []
+    print('%-8s %-8s %12s %12s %10s %10s' % ('Batch', 'Threads', 'UnPruned', 'Pruned', 'Speedup', 'FLOPS'))
+    for num_threads in args.num_threads:
+        torch.set_num_threads(num_threads)
+        for batch_size in args.batch_sizes:
+            orilatency, orilayer_times = measure(orimodel, batch_size, ori_timer)
+            latency, layer_times = measure(model, batch_size, timer)
+            print('%-8d %-8d %10.2fms %10.2fms %9.2fx %9.2fx' % (
+                batch_size, num_threads, orilatency * 1000, latency * 1000,
+                orilatency / latency, 1. / flops_ratio))
+            results.append({'batch_size': batch_size, 'num_threads': num_threads,
+                            'unpruned_latency': orilatency, 'pruned_latency': latency,
+                            'unpruned_layer_times': orilayer_times, 'pruned_layer_times': layer_times})
+
+    # Per-layer breakdown of the last setting, the hooks add a little overhead to each layer
+    print('--------------Per Layer (batch %d, %d threads)--------------' % (batch_size, num_threads))
+    print('%-36s %12s %12s %10s %10s' % ('Layer', 'UnPruned', 'Pruned', 'Speedup', 'FLOPS'))
+    for name, oritime in orilayer_times.items():
+        layer_time = layer_times[name]
+        layer_flops_ratio = orilayers[name] / layers[name] if layers[name] else float('inf')
+        # Mark the layers where pruning buys much less time than FLOPs
+        mark = ' *' if oritime / layer_time < 0.8 * layer_flops_ratio else ''
+        print('%-36s %10.3fms %10.3fms %9.2fx %9.2fx%s' % (
+            name, oritime * 1000, layer_time * 1000, oritime / layer_time, layer_flops_ratio, mark))
+    print('* speedup is less than 80% of the FLOPS reduction')
+
+    print('--------------Channel Rounding (batch %d, %d threads)--------------' % (batch_size, num_threads))
+    ori_timer.remove()
+    orilatency, _ = measure(orimodel, batch_size)
+    policies = ['none', '8', '16', '32']
+    if args.channel_round is not None and args.channel_round not in policies:
+        policies.append(args.channel_round)
+    print('%-12s %12s %10s %10s' % ('Policy', 'Pruned', 'Speedup', 'FLOPS'))
+    for policy in policies:
+        policy_round = get_channel_round(policy)
+        policy_latency, _ = measure(build_model(sketch_rate, policy_round).eval(), batch_size)
+        policy_flops, _ = cost.profile(arch, sketch_rate, args.start_conv, policy_round)
+        print('%-12s %10.2fms %9.2fx %9.2fx' % (policy, policy_latency * 1000, orilatency / policy_latency,
+                                                sum(orilayers.values()) / policy_flops))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'arch': args.arch, 'cfg': args.cfg, 'sketch_rate': args.sketch_rate,
+                       'flops_ratio': flops_ratio, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
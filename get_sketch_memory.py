@@ -0,0 +1,90 @@
+import torch
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import numpy as np
+import utils.sketch as sketch
+
+parser = argparse.ArgumentParser(description='Get Peak Memory of Streaming Sketch')
+
+parser.add_argument(
+    '--rows',
+    type=int,
+    nargs='+',
+    default=[8192, 32768, 131072],
+    help='The numbers of rows n of the sketched matrices. default:8192 32768 131072')
+
+parser.add_argument(
+    '--cols',
+    type=int,
+    default=512,
+    help='The number of columns m of the sketched matrices. default:512')
+
+parser.add_argument(
+    '--l',
+    type=int,
+    default=64,
+    help='The number of rows of the sketch. default:64')
+
+parser.add_argument(
+    '--chunk_rows',
+    type=int,
+    default=1024,
+    help='The number of rows read from the memory map at a time. default:1024')
+
+parser.add_argument(
+    '--job_dir',
+    type=str,
+    default='experiments/',
+    help='The directory where the memory-mapped matrices are written. default:./experiments')
+
+args = parser.parse_args()
+
+def write_matrix(path, n, m):
+    """A random n x m float32 matrix written in chunks, without holding it in memory"""
+    A = np.memmap(path, dtype='float32', mode='w+', shape=(n, m))
+    for start in range(0, n, args.chunk_rows):
+        end = min(start + args.chunk_rows, n)
+        A[start:end] = np.random.randn(end - start, m).astype('float32')
+    A.flush()
+    del A
+
+def run(mode, path, n, queue):
+    """Sketch in a fresh process, so that its peak RSS only counts this sketch"""
+    torch.set_num_threads(1)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.perf_counter()
+    if mode == 'stream':
+        sketch.sketch_stream(sketch.memmap_chunks(path, (n, args.cols), chunk_rows=args.chunk_rows),
+                             args.l, args.cols, n)
+    else:
+        A = torch.from_numpy(np.fromfile(path, dtype='float32').reshape(n, args.cols))
+        sketch.sketch_matrix(A.view(n, args.cols, 1, 1), args.l, dim=0)
+    elapsed = time.perf_counter() - start_time
+    # ru_maxrss is in KB on Linux
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, base, elapsed))
+
+def main():
+    if not os.path.exists(args.job_dir):
+        os.makedirs(args.job_dir)
+    context = multiprocessing.get_context('spawn')
+    print('%-10s %-8s %12s %12s %12s %10s' % ('Rows', 'Mode', 'Matrix', 'Peak RSS', 'Increase', 'Time'))
+    for n in args.rows:
+        path = os.path.join(args.job_dir, 'sketch_memory_{}x{}.bin'.format(n, args.cols))
+        write_matrix(path, n, args.cols)
+        for mode in ('stream', 'dense'):
+            queue = context.Queue()
+            process = context.Process(target=run, args=(mode, path, n, queue))
+            process.start()
+            peak, base, elapsed = queue.get()
+            process.join()
+            print('%-10d %-8s %10.2fMB %10.2fMB %10.2fMB %9.2fs' % (
+                n, mode, n * args.cols * 4 / 1024. ** 2, peak / 1024., (peak - base) / 1024., elapsed))
+        os.remove(path)
+    print('The sketch itself takes %.2fMB, the streaming peak should not grow with the rows'
+          % (args.l * args.cols * 4 / 1024. ** 2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import torch
+import argparse
+import time
+import utils.common as utils
+import utils.sketch as sketch
+from utils.channel import get_channel_round
+from utils.fidelity import sketch_fidelity
+from utils.registry import get_arch
+
+parser = argparse.ArgumentParser(description='Compare fp32 and fp64 Sketch on CPU')
+
+parser.add_argument(
+    '--arch',
+    type=str,
+    default='resnet',
+    choices=('resnet','googlenet','vgg','mobilenet_v2'),
+    help='The architecture to prune. default:resnet')
+
+parser.add_argument(
+    '--data_set',
+    type=str,
+    default='cifar10',
+    help='Select dataset to Test. default:cifar10',
+)
+
+parser.add_argument(
+    '--cfg',
+    type=str,
+    default='resnet56',
+    help='Detail architecuture of model. default:resnet56'
+)
+
+parser.add_argument(
+    '--sketch_model',
+    type=str,
+    default=None,
+    help='Sketch the weights of this model, randomly initialized weights otherwise. default:None'
+)
+
+parser.add_argument(
+    '--sketch_rate',
+    type=str,
+    default=None,
+    help='The proportion of each layer reserved after sketching convolution layer. default:[0.5]*num_rates'
+)
+
+parser.add_argument(
+    '--start_conv',
+    type=int,
+    default=1,
+    help='The index of Conv to start sketch, index starts from 0. default:1'
+)
+
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--repeat',
+    type=int,
+    default=3,
+    help='Time each sketch as the best of this many runs. default:3')
+
+args = parser.parse_args()
+
+device = torch.device('cpu')
+arch = get_arch(args.arch, args.cfg, args.data_set)
+
+def best_time(func):
+    times = []
+    for _ in range(args.repeat):
+        start_time = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+def main():
+    sketch_rate = utils.get_sketch_rate(args.sketch_rate) if args.sketch_rate is not None \
+        else [0.5] * arch.num_rates(args.start_conv)
+    origin_model = arch.build().to(device)
+    if args.sketch_model is not None:
+        ckpt = torch.load(args.sketch_model, map_location=device)
+        origin_model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    oristate_dict = origin_model.state_dict()
+    state_dict = arch.build(sketch_rate, start_conv=args.start_conv,
+                            channel_round=get_channel_round(args.channel_round)).state_dict()
+
+    print('%-36s %-5s %-12s %10s %10s %12s %12s %10s' % (
+        'Layer', 'Dim', 'Shape', 'fp32', 'fp64', 'Error fp32', 'Error fp64', 'Bound'))
+    total = {torch.float32: 0.0, torch.float64: 0.0}
+    worst = {torch.float32: 0.0, torch.float64: 0.0}
+    for unit in arch.units:
+        for layer in unit.layers:
+            weight = oristate_dict[layer.conv + '.weight']
+            size = state_dict[layer.conv + '.weight'].size()
+            for dim, flag in ((0, layer.filter), (1, layer.channel)):
+                l = size[dim]
+                # Only the matrices that Frequent Directions actually shrinks
+                if not flag or l >= weight.size(dim) or l >= weight.transpose(0, dim)[0].numel():
+                    continue
+                A = weight.transpose(0, dim).reshape(weight.size(dim), -1)
+                line = []
+                for dtype in (torch.float32, torch.float64):
+                    elapsed, B = best_time(lambda: sketch.sketch_matrix(weight, l, dim, dtype=dtype))
+                    cov_error, _ = sketch_fidelity(A, B.transpose(0, dim).reshape(l, -1))
+                    total[dtype] += elapsed
+                    worst[dtype] = max(worst[dtype], cov_error)
+                    line.append((elapsed, cov_error))
+                print('%-36s %-5d %-12s %8.2fms %8.2fms %12.6f %12.6f %10.6f' % (
+                    layer.conv, dim, 'x'.join(str(d) for d in A.size()) + '->' + str(l),
+                    line[0][0] * 1000, line[1][0] * 1000, line[0][1], line[1][1], 2.0 / l))
+
+    print('--------------Total--------------')
+    print('fp32: %.2fs, max covariance error %.6f' % (total[torch.float32], worst[torch.float32]))
+    print('fp64: %.2fs, max covariance error %.6f' % (total[torch.float64], worst[torch.float64]))
+    print('fp64 costs %.2fx the time of fp32' % (total[torch.float64] / total[torch.float32]))
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,16 @@
 import torch
 import torch.nn as nn
+from utils.channel import pruned_width
 
 class Inception(nn.Module):
-    def __init__(self, in_planes, n1x1, n3x3red, n3x3, n5x5red, n5x5, pool_planes, sketch_rate, tmp_name):
+    def __init__(self, in_planes, n1x1, n3x3red, n3x3, n5x5red, n5x5, pool_planes, sketch_rate, tmp_name,
+                 channel_round=None):
         super(Inception, self).__init__()
         self.sketch_rate = sketch_rate
         self.tmp_name=tmp_name
+        n3x3red_sketch = pruned_width(n3x3red, self.sketch_rate, channel_round)
+        n5x5red_sketch = pruned_width(n5x5red, self.sketch_rate, channel_round)
+        n5x5_sketch = pruned_width(n5x5, self.sketch_rate, channel_round)
 
         self.n1x1 = n1x1
         self.n3x3 = n3x3
@@ -25,14 +30,14 @@ class Inception(nn.Module):
 
         # 1x1 conv -> 3x3 conv branch
         if self.n3x3:
-            conv3x3_1=nn.Conv2d(in_planes, int(n3x3red * self.sketch_rate), kernel_size=1)
-            conv3x3_2=nn.Conv2d(int(n3x3red * self.sketch_rate), n3x3, kernel_size=3, padding=1)
+            conv3x3_1=nn.Conv2d(in_planes, n3x3red_sketch, kernel_size=1)
+            conv3x3_2=nn.Conv2d(n3x3red_sketch, n3x3, kernel_size=3, padding=1)
             conv3x3_1.tmp_name = self.tmp_name
             conv3x3_2.tmp_name = self.tmp_name
 
             self.branch3x3 = nn.Sequential(
                 conv3x3_1,
-                nn.BatchNorm2d(int(n3x3red * self.sketch_rate)),
+                nn.BatchNorm2d(n3x3red_sketch),
                 nn.ReLU(True),
                 conv3x3_2,
                 nn.BatchNorm2d(n3x3),
@@ -41,19 +46,19 @@ class Inception(nn.Module):
 
         # 1x1 conv -> 5x5 conv branch
         if self.n5x5 > 0:
-            conv5x5_1 = nn.Conv2d(in_planes, int(n5x5red * self.sketch_rate), kernel_size=1)
-            conv5x5_2 = nn.Conv2d(int(n5x5red * self.sketch_rate), int(n5x5 * self.sketch_rate), kernel_size=3, padding=1)
-            conv5x5_3 = nn.Conv2d(int(n5x5 * self.sketch_rate), n5x5, kernel_size=3, padding=1)
+            conv5x5_1 = nn.Conv2d(in_planes, n5x5red_sketch, kernel_size=1)
+            conv5x5_2 = nn.Conv2d(n5x5red_sketch, n5x5_sketch, kernel_size=3, padding=1)
+            conv5x5_3 = nn.Conv2d(n5x5_sketch, n5x5, kernel_size=3, padding=1)
             conv5x5_1.tmp_name = self.tmp_name
             conv5x5_2.tmp_name = self.tmp_name
             conv5x5_3.tmp_name = self.tmp_name
 
             self.branch5x5 = nn.Sequential(
                 conv5x5_1,
-                nn.BatchNorm2d(int(n5x5red * self.sketch_rate)),
+                nn.BatchNorm2d(n5x5red_sketch),
                 nn.ReLU(True),
                 conv5x5_2,
-                nn.BatchNorm2d(int(n5x5 * self.sketch_rate)),
+                nn.BatchNorm2d(n5x5_sketch),
                 nn.ReLU(True),
                 conv5x5_3,
                 nn.BatchNorm2d(n5x5),
@@ -89,7 +94,7 @@ class Inception(nn.Module):
 
 
 class GoogLeNet(nn.Module):
-    def __init__(self, block=Inception, filters=None, sketch_rate=None):
+    def __init__(self, block=Inception, filters=None, sketch_rate=None, channel_round=None):
         super(GoogLeNet, self).__init__()
 
         if sketch_rate is None:
@@ -119,20 +124,20 @@ class GoogLeNet(nn.Module):
 
         self.filters=filters
 
-        self.inception_a3 = block(192, filters[0][0],  96, filters[0][1], 16, filters[0][2], filters[0][3], self.sketch_rate[0], 'a3')
-        self.inception_b3 = block(sum(filters[0]), filters[1][0], 128, filters[1][1], 32, filters[1][2], filters[1][3], self.sketch_rate[1], 'a4')
+        self.inception_a3 = block(192, filters[0][0],  96, filters[0][1], 16, filters[0][2], filters[0][3], self.sketch_rate[0], 'a3', channel_round)
+        self.inception_b3 = block(sum(filters[0]), filters[1][0], 128, filters[1][1], 32, filters[1][2], filters[1][3], self.sketch_rate[1], 'a4', channel_round)
 
         self.maxpool1 = nn.MaxPool2d(3, stride=2, padding=1)
         self.maxpool2 = nn.MaxPool2d(3, stride=2, padding=1)
 
-        self.inception_a4 = block(sum(filters[1]), filters[2][0],  96, filters[2][1], 16, filters[2][2], filters[2][3], self.sketch_rate[2], 'a4')
-        self.inception_b4 = block(sum(filters[2]), filters[3][0], 112, filters[3][1], 24, filters[3][2], filters[3][3], self.sketch_rate[3], 'b4')
-        self.inception_c4 = block(sum(filters[3]), filters[4][0], 128, filters[4][1], 24, filters[4][2], filters[4][3], self.sketch_rate[4], 'c4')
-        self.inception_d4 = block(sum(filters[4]), filters[5][0], 144, filters[5][1], 32, filters[5][2], filters[5][3], self.sketch_rate[5], 'd4')
-        self.inception_e4 = block(sum(filters[5]), filters[6][0], 160, filters[6][1], 32, filters[6][2], filters[6][3], self.sketch_rate[6], 'e4')
+        self.inception_a4 = block(sum(filters[1]), filters[2][0],  96, filters[2][1], 16, filters[2][2], filters[2][3], self.sketch_rate[2], 'a4', channel_round)
+        self.inception_b4 = block(sum(filters[2]), filters[3][0], 112, filters[3][1], 24, filters[3][2], filters[3][3], self.sketch_rate[3], 'b4', channel_round)
+        self.inception_c4 = block(sum(filters[3]), filters[4][0], 128, filters[4][1], 24, filters[4][2], filters[4][3], self.sketch_rate[4], 'c4', channel_round)
+        self.inception_d4 = block(sum(filters[4]), filters[5][0], 144, filters[5][1], 32, filters[5][2], filters[5][3], self.sketch_rate[5], 'd4', channel_round)
+        self.inception_e4 = block(sum(filters[5]), filters[6][0], 160, filters[6][1], 32, filters[6][2], filters[6][3], self.sketch_rate[6], 'e4', channel_round)
 
-        self.inception_a5 = block(sum(filters[6]), filters[7][0], 160, filters[7][1], 32, filters[7][2], filters[7][3], self.sketch_rate[7], 'a5')
-        self.inception_b5 = block(sum(filters[7]), filters[8][0], 192, filters[8][1], 48, filters[8][2], filters[8][3], self.sketch_rate[8], 'b5')
+        self.inception_a5 = block(sum(filters[6]), filters[7][0], 160, filters[7][1], 32, filters[7][2], filters[7][3], self.sketch_rate[7], 'a5', channel_round)
+        self.inception_b5 = block(sum(filters[7]), filters[8][0], 192, filters[8][1], 48, filters[8][2], filters[8][3], self.sketch_rate[8], 'b5', channel_round)
 
         self.avgpool = nn.AvgPool2d(8, stride=1)
         self.linear = nn.Linear(sum(filters[-1]), 10)
@@ -178,5 +183,5 @@ class GoogLeNet(nn.Module):
 
         return out
 
-def googlenet(sketch_rate=None):
-    return GoogLeNet(block=Inception, sketch_rate=sketch_rate)
\ No newline at end of file
+def googlenet(sketch_rate=None, channel_round=None):
+    return GoogLeNet(block=Inception, sketch_rate=sketch_rate, channel_round=channel_round)
\ No newline at end of file
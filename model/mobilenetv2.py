@@ -0,0 +1,91 @@
+import torch.nn as nn
+from utils.channel import pruned_width
+
+# t, c, n, s of torchvision.models.mobilenet_v2, whose state_dicts load directly
+inverted_residual_setting = [
+    [1, 16, 1, 1],
+    [6, 24, 2, 2],
+    [6, 32, 3, 2],
+    [6, 64, 4, 2],
+    [6, 96, 3, 1],
+    [6, 160, 3, 2],
+    [6, 320, 1, 1],
+]
+
+class ConvBNReLU(nn.Sequential):
+    def __init__(self, in_planes, out_planes, kernel_size=3, stride=1, groups=1):
+        padding = (kernel_size - 1) // 2
+        super(ConvBNReLU, self).__init__(
+            nn.Conv2d(in_planes, out_planes, kernel_size, stride, padding, groups=groups, bias=False),
+            nn.BatchNorm2d(out_planes),
+            nn.ReLU6(inplace=True)
+        )
+
+class InvertedResidual(nn.Module):
+    def __init__(self, inp, oup, stride, expand_ratio, sketch_rate=1.0, channel_round=None):
+        super(InvertedResidual, self).__init__()
+        hidden_dim = int(round(inp * expand_ratio))
+        self.use_res_connect = stride == 1 and inp == oup
+
+        layers = []
+        if expand_ratio != 1:
+            # The depthwise convolution follows the expanded filters one to one, both take the sketched width
+            hidden_dim = pruned_width(hidden_dim, sketch_rate, channel_round)
+            layers.append(ConvBNReLU(inp, hidden_dim, kernel_size=1))
+        layers.extend([
+            ConvBNReLU(hidden_dim, hidden_dim, stride=stride, groups=hidden_dim),
+            nn.Conv2d(hidden_dim, oup, 1, 1, 0, bias=False),
+            nn.BatchNorm2d(oup),
+        ])
+        self.conv = nn.Sequential(*layers)
+
+    def forward(self, x):
+        if self.use_res_connect:
+            return x + self.conv(x)
+        else:
+            return self.conv(x)
+
+class MobileNetV2(nn.Module):
+    def __init__(self, num_classes=1000, sketch_rate=None, start_conv=1, channel_round=None):
+        super(MobileNetV2, self).__init__()
+        num_blocks = sum(n for t, c, n, s in inverted_residual_setting)
+        # The first block has no expansion to sketch
+        if sketch_rate is None:
+            self.sketch_rate = [1.0] * (num_blocks - 1)
+        else:
+            self.sketch_rate = sketch_rate
+        self.start_conv = start_conv
+        self.channel_round = channel_round
+        self.current_conv = 0
+
+        input_channel = 32
+        last_channel = 1280
+        features = [ConvBNReLU(3, input_channel, stride=2)]
+        for t, c, n, s in inverted_residual_setting:
+            for i in range(n):
+                stride = s if i == 0 else 1
+                rate = 1.0
+                if t != 1 and self.current_conv >= self.start_conv - 1:
+                    rate = self.sketch_rate[self.current_conv - (self.start_conv - 1)]
+                features.append(InvertedResidual(input_channel, c, stride, expand_ratio=t, sketch_rate=rate,
+                                                 channel_round=channel_round))
+                if t != 1:
+                    self.current_conv += 1
+                input_channel = c
+        features.append(ConvBNReLU(input_channel, last_channel, kernel_size=1))
+        self.features = nn.Sequential(*features)
+
+        self.classifier = nn.Sequential(
+            nn.Dropout(0.2),
+            nn.Linear(last_channel, num_classes),
+        )
+
+    def forward(self, x):
+        x = self.features(x)
+        x = nn.functional.adaptive_avg_pool2d(x, 1).reshape(x.shape[0], -1)
+        x = self.classifier(x)
+        return x
+
+def mobilenet_v2(sketch_rate=None, start_conv=1, num_classes=1000, channel_round=None):
+    return MobileNetV2(num_classes=num_classes, sketch_rate=sketch_rate, start_conv=start_conv,
+                       channel_round=channel_round)
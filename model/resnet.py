@@ -1,5 +1,6 @@
 import torch.nn as nn
 import torch.nn.functional as F
+from utils.channel import pruned_width
 
 norm_mean, norm_var = 0.0, 1.0
 
@@ -18,11 +19,11 @@ class LambdaLayer(nn.Module):
 class ResBasicBlock(nn.Module):
     expansion = 1
 
-    def __init__(self, inplanes, planes, stride=1, sketch_rate=1.0):
+    def __init__(self, inplanes, planes, stride=1, sketch_rate=1.0, channel_round=None):
         super(ResBasicBlock, self).__init__()
         self.inplanes = inplanes
         self.planes = planes
-        middle_planes = int(sketch_rate * planes)
+        middle_planes = pruned_width(planes, sketch_rate, channel_round)
         self.conv1 = conv3x3(inplanes, middle_planes, stride)
         self.bn1 = nn.BatchNorm2d(middle_planes)
         self.relu = nn.ReLU(inplace=True)
@@ -48,7 +49,7 @@ class ResBasicBlock(nn.Module):
         return out
 
 class ResNet(nn.Module):
-    def __init__(self, block, num_layers, sketch_rate=None, start_conv=1, num_classes=10):
+    def __init__(self, block, num_layers, sketch_rate=None, start_conv=1, num_classes=10, channel_round=None):
         super(ResNet, self).__init__()
         assert (num_layers - 2) % 6 == 0, 'depth should be 6n+2'
         n = (num_layers - 2) // 6
@@ -58,6 +59,7 @@ class ResNet(nn.Module):
         else:
             self.sketch_rate = sketch_rate
         self.start_conv =start_conv
+        self.channel_round = channel_round
         self.current_conv = 0
         self.inplanes = 16
         self.conv1 = nn.Conv2d(3, self.inplanes, kernel_size=3, stride=1, padding=1, bias=False)
@@ -86,14 +88,16 @@ class ResNet(nn.Module):
 
         layers.append(block(self.inplanes, planes, stride,
                             sketch_rate=self.sketch_rate[self.current_conv - self.start_conv]
-                            if self.current_conv >= self.start_conv else 1.0))
+                            if self.current_conv >= self.start_conv else 1.0,
+                            channel_round=self.channel_round))
         self.current_conv += 1
 
         self.inplanes = planes * block.expansion
         for i in range(1, blocks):
             layers.append(block(self.inplanes, planes,
                                 sketch_rate=self.sketch_rate[self.current_conv - self.start_conv]
-                                if self.current_conv >= self.start_conv else 1.0))
+                                if self.current_conv >= self.start_conv else 1.0,
+                                channel_round=self.channel_round))
             self.current_conv += 1
 
         return nn.Sequential(*layers)
@@ -1,15 +1,19 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint_sequential
+from utils.channel import pruned_width
 
 
 class BasicBlock(nn.Module):
     expansion = 1
 
-    def __init__(self, in_planes, planes, stride=1, sketch_rate=1):
+    def __init__(self, in_planes, planes, stride=1, sketch_rate=1, channel_round=None):
         super(BasicBlock, self).__init__()
-        self.conv1 = nn.Conv2d(in_planes, int(planes * sketch_rate), kernel_size=3, stride=stride, padding=1, bias=False)
-        self.bn1 = nn.BatchNorm2d(int(planes * sketch_rate))
-        self.conv2 = nn.Conv2d(int(planes * sketch_rate), planes, kernel_size=3, stride=1, padding=1, bias=False)
+        middle_planes = pruned_width(planes, sketch_rate, channel_round)
+        self.conv1 = nn.Conv2d(in_planes, middle_planes, kernel_size=3, stride=stride, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(middle_planes)
+        self.conv2 = nn.Conv2d(middle_planes, planes, kernel_size=3, stride=1, padding=1, bias=False)
         self.bn2 = nn.BatchNorm2d(planes)
 
         self.downsample = nn.Sequential()
@@ -30,13 +34,14 @@ class BasicBlock(nn.Module):
 class Bottleneck(nn.Module):
     expansion = 4
 
-    def __init__(self, in_planes, planes, stride=1, sketch_rate=1):
+    def __init__(self, in_planes, planes, stride=1, sketch_rate=1, channel_round=None):
         super(Bottleneck, self).__init__()
-        self.conv1 = nn.Conv2d(in_planes, int(planes * sketch_rate), kernel_size=1, bias=False)
-        self.bn1 = nn.BatchNorm2d(int(planes * sketch_rate))
-        self.conv2 = nn.Conv2d(int(planes * sketch_rate), int(planes * sketch_rate), kernel_size=3, stride=stride, padding=1, bias=False)
-        self.bn2 = nn.BatchNorm2d(int(planes * sketch_rate))
-        self.conv3 = nn.Conv2d(int(planes * sketch_rate), self.expansion*planes, kernel_size=1, bias=False)
+        middle_planes = pruned_width(planes, sketch_rate, channel_round)
+        self.conv1 = nn.Conv2d(in_planes, middle_planes, kernel_size=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(middle_planes)
+        self.conv2 = nn.Conv2d(middle_planes, middle_planes, kernel_size=3, stride=stride, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(middle_planes)
+        self.conv3 = nn.Conv2d(middle_planes, self.expansion*planes, kernel_size=1, bias=False)
         self.bn3 = nn.BatchNorm2d(self.expansion*planes)
 
         self.downsample = nn.Sequential()
@@ -56,7 +61,7 @@ class Bottleneck(nn.Module):
 
 
 class ResNet(nn.Module):
-    def __init__(self, block, num_blocks, num_classes=10, sketch_rate=None, start_conv=1):
+    def __init__(self, block, num_blocks, num_classes=10, sketch_rate=None, start_conv=1, channel_round=None):
         super(ResNet, self).__init__()
         self.in_planes = 64
         if sketch_rate is None:
@@ -64,7 +69,10 @@ class ResNet(nn.Module):
         else:
             self.sketch_rate = sketch_rate
         self.start_conv = start_conv
+        self.channel_round = channel_round
         self.current_conv = 0
+        # Recompute the activations inside layer1-layer4 in the backward pass instead of storing them
+        self.checkpoint_stages = False
 
         self.conv1 = nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3, bias=False)
         self.bn1 = nn.BatchNorm2d(64)
@@ -85,7 +93,8 @@ class ResNet(nn.Module):
         for stride in strides:
             layers.append(block(self.in_planes, planes, stride,
                                 sketch_rate=self.sketch_rate[self.current_conv - self.start_conv]
-                                if self.current_conv >= self.start_conv else 1.0))
+                                if self.current_conv >= self.start_conv else 1.0,
+                                channel_round=self.channel_round))
             self.current_conv += 1
             self.in_planes = planes * block.expansion
         return nn.Sequential(*layers)
@@ -93,26 +102,33 @@ class ResNet(nn.Module):
     def forward(self, x):
         out = F.relu(self.bn1(self.conv1(x)))
         out = self.maxpool(out)
-        out = self.layer1(out)
-        out = self.layer2(out)
-        out = self.layer3(out)
-        out = self.layer4(out)
+        for stage in (self.layer1, self.layer2, self.layer3, self.layer4):
+            if self.checkpoint_stages and self.training and torch.is_grad_enabled():
+                # One segment per block, only the block inputs are kept
+                out = checkpoint_sequential(stage, len(stage), out, use_reentrant=False)
+            else:
+                out = stage(out)
         out = self.avgpool(out)
         out = out.view(out.size(0), -1)
         out = self.fc(out)
         return out
 
-def resnet(cfg, sketch_rate=None, start_conv=1, num_classes=1000):
+def resnet(cfg, sketch_rate=None, start_conv=1, num_classes=1000, channel_round=None):
     if cfg == 'resnet18':
-        return ResNet(BasicBlock, [2, 2, 2, 2], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv)
+        return ResNet(BasicBlock, [2, 2, 2, 2], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv,
+                      channel_round=channel_round)
     elif cfg == 'resnet34':
-        return ResNet(BasicBlock, [3, 4, 6, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv)
+        return ResNet(BasicBlock, [3, 4, 6, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv,
+                      channel_round=channel_round)
     elif cfg == 'resnet50':
-        return ResNet(Bottleneck, [3, 4, 6, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv)
+        return ResNet(Bottleneck, [3, 4, 6, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv,
+                      channel_round=channel_round)
     elif cfg == 'resnet101':
-        return ResNet(Bottleneck, [3, 4, 23, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv)
+        return ResNet(Bottleneck, [3, 4, 23, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv,
+                      channel_round=channel_round)
     elif cfg == 'resnet152':
-        return ResNet(Bottleneck, [3, 8, 36, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv)
+        return ResNet(Bottleneck, [3, 8, 36, 3], sketch_rate=sketch_rate, num_classes=num_classes, start_conv=start_conv,
+                      channel_round=channel_round)
 
 def ResNet18():
     return ResNet(BasicBlock, [2,2,2,2])
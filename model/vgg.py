@@ -0,0 +1,76 @@
+import torch.nn as nn
+from utils.channel import pruned_width
+
+# The layout of torchvision.models.vgg, so that its state_dicts load directly
+defaultcfg = {
+    'vgg16': [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 'M', 512, 512, 512, 'M', 512, 512, 512, 'M'],
+}
+
+class VGG(nn.Module):
+    def __init__(self, cfg, batch_norm=False, num_classes=1000, imagenet=True, sketch_rate=None, start_conv=1,
+                 channel_round=None):
+        super(VGG, self).__init__()
+        num_convs = len([v for v in cfg if v != 'M'])
+        # The last convolution feeds the classifier, only its channel dimension is sketched
+        if sketch_rate is None:
+            self.sketch_rate = [1.0] * (num_convs - 1)
+        else:
+            self.sketch_rate = sketch_rate
+        self.start_conv = start_conv
+        self.channel_round = channel_round
+        self.current_conv = 0
+
+        self.features = self._make_layers(cfg, batch_norm, num_convs)
+        if imagenet:
+            self.avgpool = nn.AdaptiveAvgPool2d((7, 7))
+            self.classifier = nn.Sequential(
+                nn.Linear(512 * 7 * 7, 4096),
+                nn.ReLU(True),
+                nn.Dropout(),
+                nn.Linear(4096, 4096),
+                nn.ReLU(True),
+                nn.Dropout(),
+                nn.Linear(4096, num_classes),
+            )
+        else:
+            self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
+            self.classifier = nn.Sequential(
+                nn.Linear(512, 512),
+                nn.ReLU(True),
+                nn.Linear(512, num_classes),
+            )
+
+    def _make_layers(self, cfg, batch_norm, num_convs):
+        layers = []
+        in_channels = 3
+        for v in cfg:
+            if v == 'M':
+                layers += [nn.MaxPool2d(kernel_size=2, stride=2)]
+                continue
+            if self.current_conv < num_convs - 1:
+                rate = self.sketch_rate[self.current_conv - (self.start_conv - 1)] \
+                    if self.current_conv >= self.start_conv - 1 else 1.0
+                v = pruned_width(v, rate, self.channel_round)
+            conv2d = nn.Conv2d(in_channels, v, kernel_size=3, padding=1)
+            if batch_norm:
+                layers += [conv2d, nn.BatchNorm2d(v), nn.ReLU(inplace=True)]
+            else:
+                layers += [conv2d, nn.ReLU(inplace=True)]
+            in_channels = v
+            self.current_conv += 1
+        return nn.Sequential(*layers)
+
+    def forward(self, x):
+        x = self.features(x)
+        x = self.avgpool(x)
+        x = x.view(x.size(0), -1)
+        x = self.classifier(x)
+        return x
+
+def vgg(cfg, sketch_rate=None, start_conv=1, num_classes=None, imagenet=True, channel_round=None):
+    if num_classes is None:
+        num_classes = 1000 if imagenet else 10
+    if cfg == 'vgg16':
+        return VGG(defaultcfg['vgg16'], False, num_classes, imagenet, sketch_rate, start_conv, channel_round)
+    elif cfg == 'vgg16_bn':
+        return VGG(defaultcfg['vgg16'], True, num_classes, imagenet, sketch_rate, start_conv, channel_round)
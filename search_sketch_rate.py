@@ -0,0 +1,370 @@
+import torch
+import torch.nn as nn
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+import utils.common as utils
+from utils.channel import get_channel_round
+import utils.cost as cost
+import utils.sketch as sketch
+from utils.registry import get_arch
+
+parser = argparse.ArgumentParser(description='Search Sketch Rate')
+
+parser.add_argument(
+    '--gpus',
+    type=int,
+    nargs='+',
+    default=[0],
+    help='Select gpu_id to use. default:[0]',
+)
+
+parser.add_argument(
+    '--data_set',
+    type=str,
+    default='cifar10',
+    help='Select dataset to search on. default:cifar10',
+)
+
+parser.add_argument(
+    '--data_path',
+    type=str,
+    default='/home/lishaojie/data/cifar10/',
+    help='The dictionary where the input is stored. default:/home/lishaojie/data/cifar10/',
+)
+
+parser.add_argument(
+    '--job_dir',
+    type=str,
+    default='experiments/',
+    help='The directory where the search result and sketch cache will be stored. default:./experiments')
+
+parser.add_argument(
+    '--arch',
+    type=str,
+    default='resnet',
+    choices=('resnet', 'googlenet', 'vgg', 'mobilenet_v2'),
+    help='The architecture to prune. default:resnet')
+
+parser.add_argument(
+    '--cfg',
+    type=str,
+    default='resnet56',
+    help='Detail architecuture of model. default:resnet56'
+)
+
+parser.add_argument(
+    '--sketch_model',
+    type=str,
+    default=None,
+    help='Path to the pretrained model to search on. default:None'
+)
+
+parser.add_argument(
+    '--start_conv',
+    type=int,
+    default=1,
+    help='The index of Conv to start sketch, index starts from 0. default:1'
+)
+
+parser.add_argument(
+    '--weight_norm_method',
+    type=str,
+    default=None,
+    help='Select the weight norm method. default:None Optional:l2'
+)
+
+parser.add_argument(
+    '--sketch_fp64',
+    action='store_true',
+    help='Accumulate the sketch in float64 for numerical stability.'
+)
+
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--flops_target',
+    type=float,
+    default=None,
+    help='The proportion of the original FLOPs to keep, e.g. 0.5. default:None'
+)
+
+parser.add_argument(
+    '--latency_target',
+    type=float,
+    default=None,
+    help='The proportion of the original CPU latency to keep, e.g. 0.5. default:None'
+)
+
+parser.add_argument(
+    '--probe_rates',
+    type=float,
+    nargs='+',
+    default=[0.2, 0.4, 0.6, 0.8],
+    help='The sketch rates each layer is probed at. default:0.2 0.4 0.6 0.8'
+)
+
+parser.add_argument(
+    '--search_samples',
+    type=int,
+    default=1000,
+    help='The number of held-out training images to evaluate probes on. default:1000'
+)
+
+parser.add_argument(
+    '--calib_samples',
+    type=int,
+    default=500,
+    help='The number of held-out training images to recalibrate BN statistics on. default:500'
+)
+
+parser.add_argument(
+    '--eval_batch_size',
+    type=int,
+    default=100,
+    help='Batch size for probe evaluation. default:100')
+
+parser.add_argument(
+    '--workers',
+    type=int,
+    default=4,
+    help='The number of sensitivity probes run in parallel. default:4')
+
+args = parser.parse_args()
+
+device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+input_image_size = 224 if args.data_set == 'imagenet' else 32
+channel_round = get_channel_round(args.channel_round)
+
+if args.flops_target is None and args.latency_target is None:
+    raise ValueError('One of --flops_target and --latency_target should be given!')
+if not os.path.exists(args.job_dir):
+    os.makedirs(args.job_dir)
+
+arch = get_arch(args.arch, args.cfg, args.data_set)
+
+def build_model(sketch_rate=None):
+    return arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round)
+
+def get_held_out_batches():
+    """Deterministic held-out subsets of the training set, with test-time transforms"""
+    if args.data_set == 'imagenet':
+        transform = transforms.Compose([
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ])
+        dataset = datasets.ImageFolder(os.path.join(args.data_path, 'ILSVRC2012_img_train'), transform)
+    else:
+        transform = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+        ])
+        dataset = datasets.CIFAR10(root=args.data_path, train=True, download=True, transform=transform)
+
+    generator = torch.Generator()
+    generator.manual_seed(0)
+    indices = torch.randperm(len(dataset), generator=generator).tolist()
+    eval_indices = indices[:args.search_samples]
+    calib_indices = indices[args.search_samples:args.search_samples + args.calib_samples]
+
+    def load(subset):
+        loader = torch.utils.data.DataLoader(torch.utils.data.Subset(dataset, subset),
+                                             batch_size=args.eval_batch_size, shuffle=False, num_workers=4)
+        return [(inputs.to(device), targets.to(device)) for inputs, targets in loader]
+
+    return load(eval_indices), load(calib_indices)
+
+def recalibrate_bn(model, batches):
+    """Re-estimate BN running statistics, sketched BN layers start from a fresh initialization"""
+    momentum = {}
+    for name, module in model.named_modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.reset_running_stats()
+            momentum[name] = module.momentum
+            module.momentum = None  # cumulative moving average
+
+    model.train()
+    with torch.no_grad():
+        for inputs, _ in batches:
+            model(inputs)
+
+    for name, module in model.named_modules():
+        if name in momentum:
+            module.momentum = momentum[name]
+
+def evaluate(model, batches):
+    model.eval()
+    accuracy = utils.AverageMeter()
+    with torch.no_grad():
+        for inputs, targets in batches:
+            outputs = model(inputs)
+            accuracy.update(utils.accuracy(outputs, targets)[0].item(), inputs.size(0))
+    return accuracy.avg
+
+cost_model = cost.CostModel(arch, args.start_conv, channel_round)
+
+def measure_cost(sketch_rate):
+    if args.flops_target is not None:
+        return cost_model(sketch_rate)[0]
+
+    model = build_model(sketch_rate).eval()
+    input = torch.randn(1, 3, input_image_size, input_image_size)
+    with torch.no_grad():
+        for _ in range(5):
+            model(input)
+        times = []
+        for _ in range(20):
+            start_time = time.time()
+            model(input)
+            times.append(time.time() - start_time)
+    return sorted(times)[len(times) // 2]
+
+class SketchCache():
+    """Sketched tensors of one unit at one set of widths, kept in memory and under job_dir across runs"""
+
+    def __init__(self, oristate_dict):
+        self.oristate_dict = oristate_dict
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+        stat = os.stat(args.sketch_model)
+        key = '{}|{}|{}|{}|{}|{}'.format(os.path.abspath(args.sketch_model), stat.st_mtime,
+                                         args.arch, args.cfg, args.weight_norm_method, args.sketch_fp64)
+        self.cache_dir = os.path.join(args.job_dir, 'sketch_cache', hashlib.md5(key.encode()).hexdigest())
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get(self, unit, state_dict):
+        # Keyed by the widths of the unit, which also follow the rate of the previous unit in a plain chain
+        shapes = '_'.join('x'.join(str(d) for d in state_dict[layer.conv + '.weight'].size())
+                          for layer in unit.layers)
+        key = (unit.name, shapes)
+        with self.lock:
+            if key in self.memory:
+                return self.memory[key]
+            # One lock per key, so that concurrent probes needing the same unit sketch it only once
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.memory:
+                    return self.memory[key]
+            path = os.path.join(self.cache_dir, '{}_{}.pt'.format(unit.name, shapes))
+            if os.path.exists(path):
+                sketched = {k: v.to(device) for k, v in torch.load(path, map_location='cpu').items()}
+            else:
+                sketched = sketch.sketch_unit(unit, self.oristate_dict, state_dict,
+                                              weight_norm_method=args.weight_norm_method,
+                                              dtype=torch.float64 if args.sketch_fp64 else None)
+                # Written aside and renamed, a file at path is always complete
+                torch.save({k: v.cpu() for k, v in sketched.items()}, path + '.tmp')
+                os.replace(path + '.tmp', path)
+
+            with self.lock:
+                self.memory[key] = sketched
+        return sketched
+
+def main():
+    if args.sketch_model is None or not os.path.exists(args.sketch_model):
+        raise ValueError('Sketch model path should be exist!')
+
+    print('==> Preparing data..')
+    eval_batches, calib_batches = get_held_out_batches()
+
+    print('==> Building model..')
+    ckpt = torch.load(args.sketch_model, map_location=device)
+    origin_model = build_model().to(device)
+    origin_model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    origin_acc = evaluate(origin_model, eval_batches)
+    print('Origin Accuracy {:.2f}%'.format(origin_acc))
+
+    oristate_dict = origin_model.state_dict()
+    cache = SketchCache(oristate_dict)
+
+    num_rates = arch.num_rates(args.start_conv)
+
+    def probe(sketch_rate):
+        model = build_model(sketch_rate).to(device)
+        state_dict = model.state_dict()
+        sketched = {}
+        for unit in arch.units:
+            sketched.update(cache.get(unit, state_dict))
+        state_dict.update(sketched)
+        sketch.copy_unsketched(state_dict, oristate_dict, sketched)
+        model.load_state_dict(state_dict)
+
+        recalibrate_bn(model, calib_batches)
+        return evaluate(model, eval_batches)
+
+    print('==> Probing sensitivity..')
+    base_acc = probe([1.0] * num_rates)
+    base_cost = measure_cost([1.0] * num_rates)
+    print('Base Accuracy {:.2f}%'.format(base_acc))
+
+    probes = [(i, rate) for i in range(num_rates) for rate in args.probe_rates]
+    probe_rate = lambda p: [p[1] if j == p[0] else 1.0 for j in range(num_rates)]
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        accs = list(executor.map(lambda p: probe(probe_rate(p)), probes))
+    # Measured serially, concurrent probes would disturb the latency timing
+    costs = [measure_cost(probe_rate(p)) for p in probes]
+    results = list(zip(accs, costs))
+
+    # The cost is taken as additive over units (exact for FLOPs unless the architecture is a plain chain)
+    drop = [{1.0: 0.0} for _ in range(num_rates)]
+    saving = [{1.0: 0.0} for _ in range(num_rates)]
+    for (i, rate), (acc, probe_cost) in zip(probes, results):
+        drop[i][rate] = max(base_acc - acc, 0.0)
+        saving[i][rate] = base_cost - probe_cost
+        print('Layer[{}] Rate {:.2f}\tAccuracy {:.2f}%\tCost {:.2f}%'.format(
+            i, rate, acc, 100. * probe_cost / base_cost))
+
+    target = args.flops_target if args.flops_target is not None else args.latency_target
+    budget = base_cost * (1.0 - target)
+    current = [1.0] * num_rates
+    saved = 0.0
+    while saved < budget:
+        best = None
+        for i in range(num_rates):
+            for rate in drop[i]:
+                gain = saving[i][rate] - saving[i][current[i]]
+                if rate >= current[i] or gain <= 0:
+                    continue
+                score = (drop[i][rate] - drop[i][current[i]]) / gain
+                if best is None or score < best[0]:
+                    best = (score, i, rate, gain)
+        if best is None:
+            print('Target is not reachable with the probe rates, keep the smallest rates.')
+            break
+        _, i, rate, gain = best
+        current[i] = rate
+        saved += gain
+
+    sketch_rate = utils.format_sketch_rate(current)
+    print('Sketch Rate: {}'.format(sketch_rate))
+    print('Predicted Cost Retention Ratio: {:.2f}%'.format(100. * (base_cost - saved) / base_cost))
+
+    with open(os.path.join(args.job_dir, 'sketch_rate.txt'), 'w') as f:
+        f.write(sketch_rate + '\n')
+    with open(os.path.join(args.job_dir, 'sensitivity.json'), 'w') as f:
+        json.dump({'origin_acc': origin_acc, 'base_acc': base_acc, 'base_cost': base_cost,
+                   'probes': [{'layer': i, 'rate': rate, 'acc': acc, 'cost': probe_cost}
+                              for (i, rate), (acc, probe_cost) in zip(probes, results)],
+                   'sketch_rate': sketch_rate}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
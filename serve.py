@@ -0,0 +1,287 @@
+import torch
+import argparse
+import asyncio
+import io
+import json
+import time
+
+import numpy as np
+import torchvision.transforms as transforms
+from PIL import Image
+import utils.common as utils
+from utils.channel import get_channel_round
+import utils.shrink as shrink
+from utils.registry import get_arch
+from utils.serving import DynamicBatcher, optimize_for_inference, share_state_dicts
+
+parser = argparse.ArgumentParser(description='Serve a Sketched Model over HTTP with Dynamic Batching')
+
+parser.add_argument(
+    '--arch',
+    type=str,
+    default='resnet',
+    choices=('resnet', 'googlenet', 'vgg', 'mobilenet_v2'),
+    help='The architecture of the model. default:resnet')
+
+parser.add_argument(
+    '--data_set',
+    type=str,
+    default='imagenet',
+    help='The dataset the model was trained on. default:imagenet',
+)
+
+parser.add_argument(
+    '--cfg',
+    type=str,
+    default='resnet50',
+    help='Detail architecuture of model. default:resnet50'
+)
+
+parser.add_argument(
+    '--sketch_model',
+    type=str,
+    default=None,
+    help='Path to the sketched (and fine-tuned) checkpoint. default:None'
+)
+
+parser.add_argument(
+    '--sketch_rate',
+    type=str,
+    default=None,
+    help='The sketch rate of the checkpoint, the unpruned model if not given. default:None'
+)
+
+parser.add_argument(
+    '--tier',
+    type=str,
+    nargs=3,
+    action='append',
+    default=None,
+    metavar=('NAME', 'SKETCH_RATE', 'SKETCH_MODEL'),
+    help='Serve a variant of the backbone at /predict/NAME, repeat for several tiers. default:None')
+
+parser.add_argument(
+    '--share_path',
+    type=str,
+    default=None,
+    help='Map the tensors of the tiers from this file on CPU, so that server processes share them. default:None')
+
+parser.add_argument(
+    '--start_conv',
+    type=int,
+    default=1,
+    help='The index of Conv to start sketch, index starts from 0. default:1'
+)
+
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--gpus',
+    type=int,
+    nargs='+',
+    default=[0],
+    help='Select gpu_id to use, the first one is used. default:[0]',
+)
+
+parser.add_argument(
+    '--fuse',
+    action='store_true',
+    help='Fold the BN layers into the preceding convolutions.')
+
+parser.add_argument(
+    '--jit',
+    action='store_true',
+    help='Trace and freeze the model with TorchScript.')
+
+parser.add_argument(
+    '--max_batch_size',
+    type=int,
+    default=32,
+    help='The largest batch formed from concurrent requests. default:32')
+
+parser.add_argument(
+    '--max_wait_ms',
+    type=float,
+    default=5.0,
+    help='How long the first request of a batch waits for others, in milliseconds. default:5.0')
+
+parser.add_argument(
+    '--workers',
+    type=int,
+    default=1,
+    help='The number of threads running batches concurrently. default:1')
+
+parser.add_argument(
+    '--num_threads',
+    type=int,
+    default=None,
+    help='The number of intra-op CPU threads of each batch, one per pinned core with --cpu_cores. default:None')
+
+parser.add_argument(
+    '--interop_threads',
+    type=int,
+    default=None,
+    help='The number of inter-op CPU threads. default:None')
+
+parser.add_argument(
+    '--cpu_cores',
+    type=str,
+    default=None,
+    help='Pin the server to these CPU cores, e.g. 0-7. default:None')
+
+parser.add_argument(
+    '--host',
+    type=str,
+    default='127.0.0.1',
+    help='The address to listen on. default:127.0.0.1')
+
+parser.add_argument(
+    '--port',
+    type=int,
+    default=8000,
+    help='The port to listen on. default:8000')
+
+args = parser.parse_args()
+
+device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+utils.set_threads(args.num_threads, args.interop_threads, args.cpu_cores)
+arch = get_arch(args.arch, args.cfg, args.data_set)
+
+if args.data_set == 'imagenet':
+    transform = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+else:
+    transform = transforms.Compose([
+        transforms.Resize(32),
+        transforms.CenterCrop(32),
+        transforms.ToTensor(),
+        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+    ])
+
+def load_model(sketch_rate, sketch_model, device):
+    sketch_rate = utils.get_sketch_rate(sketch_rate) if sketch_rate is not None else None
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=get_channel_round(args.channel_round))
+    if sketch_model is not None:
+        ckpt = torch.load(sketch_model, map_location='cpu')
+        if 'widths' in ckpt:
+            shrink.resize(arch, model, ckpt['widths'])
+        model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    return optimize_for_inference(model, arch.input_size, device, fuse=args.fuse, jit=args.jit)
+
+def load_models():
+    if args.tier is None:
+        return {'default': load_model(args.sketch_rate, args.sketch_model, device)}
+    if args.jit:
+        raise ValueError('--jit freezes the weights into each model, it can not be combined with --tier!')
+    # Tensors that are bit-identical across tiers, e.g. the unsketched ones copied from the original model, are kept once
+    models = {name: load_model(sketch_rate, sketch_model, 'cpu') for name, sketch_rate, sketch_model in args.tier}
+    state_dicts, total_bytes, unique_bytes = share_state_dicts(
+        [model.state_dict() for model in models.values()], device, args.share_path)
+    for model, state_dict in zip(models.values(), state_dicts):
+        model.load_state_dict(state_dict, assign=True)
+    print('{} tiers share {:.1f}MB of tensors out of {:.1f}MB'.format(
+        len(models), (total_bytes - unique_bytes) / 2 ** 20, total_bytes / 2 ** 20))
+    return models
+
+def decode(headers, body):
+    """An encoded image, or a float32 tensor of the normalized (3, H, W) input as application/octet-stream"""
+    if headers.get('content-type', '') == 'application/octet-stream':
+        array = np.frombuffer(body, dtype=np.float32)
+        if array.size != 3 * arch.input_size * arch.input_size:
+            raise ValueError('Expected {} float32 values, got {}'.format(3 * arch.input_size ** 2, array.size))
+        return torch.from_numpy(array.copy()).view(3, arch.input_size, arch.input_size)
+    return transform(Image.open(io.BytesIO(body)).convert('RGB'))
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, headers, body
+
+def response(status, payload):
+    body = json.dumps(payload).encode()
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    return ('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+        status, reason, len(body))).encode() + body
+
+async def handle(batchers, method, path, headers, body):
+    if method == 'GET' and path == '/stats':
+        return response(200, {name: batcher.stats.summary() for name, batcher in batchers.items()})
+    if method == 'GET' and path == '/health':
+        return response(200, {'status': 'ok', 'tiers': list(batchers)})
+    # /predict goes to the first tier, /predict/TIER to that tier and any other path is not found
+    name = next(iter(batchers)) if path == '/predict' else None
+    if path.startswith('/predict/'):
+        name = path[len('/predict/'):]
+    if method != 'POST' or name not in batchers:
+        return response(404, {'error': 'POST /predict[/TIER], GET /stats or GET /health'})
+    batcher = batchers[name]
+    start_time = time.perf_counter()
+    try:
+        # Decoding an image takes milliseconds, off the event loop so that it keeps accepting requests
+        input = await asyncio.get_running_loop().run_in_executor(None, decode, headers, body)
+    except Exception as e:
+        return response(400, {'error': str(e)})
+    try:
+        logits = await batcher.predict(input)
+    except Exception as e:
+        return response(500, {'error': str(e)})
+    probs, classes = torch.softmax(logits, 0).topk(min(5, logits.numel()))
+    return response(200, {'class': int(classes[0]), 'topk': [[int(c), float(p)] for c, p in zip(classes, probs)],
+                          'latency_ms': 1000 * (time.perf_counter() - start_time)})
+
+async def serve():
+    batchers = {}
+    for name, model in load_models().items():
+        batchers[name] = DynamicBatcher(model, device, args.max_batch_size, args.max_wait_ms / 1000., args.workers)
+        batchers[name].start()
+
+    async def connection(reader, writer):
+        # Keep-alive, requests of one connection are answered in order
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                writer.write(await handle(batchers, *request))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(connection, args.host, args.port)
+    print('Serving {} ({}) on http://{}:{} ({}, max batch {}, max wait {}ms, {} workers)'.format(
+        args.cfg if args.cfg else args.arch, ', '.join(batchers), args.host, args.port, device, args.max_batch_size,
+        args.max_wait_ms, args.workers))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for name, batcher in batchers.items():
+            batcher.close()
+            print(name, json.dumps(batcher.stats.summary()))
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
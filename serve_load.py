@@ -0,0 +1,129 @@
+import argparse
+import array
+import asyncio
+import json
+import random
+import time
+
+parser = argparse.ArgumentParser(description='Load Generator for serve.py')
+
+parser.add_argument(
+    '--host',
+    type=str,
+    default='127.0.0.1',
+    help='The address of the server. default:127.0.0.1')
+
+parser.add_argument(
+    '--port',
+    type=int,
+    default=8000,
+    help='The port of the server. default:8000')
+
+parser.add_argument(
+    '--tier',
+    type=str,
+    default=None,
+    help='The tier to send the requests to, the first one if not given. default:None')
+
+parser.add_argument(
+    '--input_image_size',
+    type=int,
+    default=224,
+    help='The input_image_size of the served model. default:224')
+
+parser.add_argument(
+    '--num_requests',
+    type=int,
+    default=2000,
+    help='The number of requests to send. default:2000')
+
+parser.add_argument(
+    '--concurrency',
+    type=int,
+    default=32,
+    help='The number of connections, each with one request in flight. default:32')
+
+parser.add_argument(
+    '--rate',
+    type=float,
+    default=None,
+    help='Send Poisson arrivals at this many requests/s instead of as fast as the connections allow. default:None')
+
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=0,
+    help='Seed of the inputs and arrivals. default:0')
+
+args = parser.parse_args()
+
+async def request(reader, writer, method, path, body=b''):
+    writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/octet-stream\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, path, args.host, len(body)).encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        if key.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def main():
+    rng = random.Random(args.seed)
+    # Normalized float32 (3, H, W) inputs, the client needs no torch or numpy
+    bodies = [array.array('f', (rng.gauss(0., 1.) for _ in range(3 * args.input_image_size ** 2))).tobytes()
+              for _ in range(8)]
+    path = '/predict/' + args.tier if args.tier is not None else '/predict'
+    tickets = asyncio.Queue()
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+        while True:
+            ticket = await tickets.get()
+            if ticket is None:
+                break
+            # With --rate the latency counts from the scheduled arrival, waiting for a free connection included
+            start = scheduled.pop(ticket, time.perf_counter())
+            status, _ = await request(reader, writer, 'POST', path, bodies[ticket % len(bodies)])
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        writer.close()
+
+    scheduled = {}
+    start_time = time.perf_counter()
+    clients = [asyncio.create_task(client()) for _ in range(args.concurrency)]
+    arrivals = random.Random(args.seed)
+    next_arrival = start_time
+    for ticket in range(args.num_requests):
+        if args.rate is not None:
+            next_arrival += arrivals.expovariate(args.rate)
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            scheduled[ticket] = next_arrival
+        await tickets.put(ticket)
+    for _ in clients:
+        await tickets.put(None)
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q / 100. * len(latencies)))] if latencies else 0.0
+    print('Requests {}\tErrors {}\tThroughput {:.1f} req/s'.format(len(latencies), errors, len(latencies) / elapsed))
+    print('Client latency p50 {:.2f}ms\tp90 {:.2f}ms\tp99 {:.2f}ms\tmax {:.2f}ms'.format(
+        1000 * percentile(50), 1000 * percentile(90), 1000 * percentile(99), 1000 * percentile(100)))
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, stats = await request(reader, writer, 'GET', '/stats')
+    writer.close()
+    print('Server {}'.format(json.dumps(stats)))
+
+if __name__ == '__main__':
+    asyncio.run(main())
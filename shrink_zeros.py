@@ -0,0 +1,124 @@
+import torch
+import argparse
+import utils.common as utils
+import utils.shrink as shrink
+from utils import cost
+from utils.channel import get_channel_round
+from utils.registry import get_arch
+
+parser = argparse.ArgumentParser(description='Remove the zero filters and unused channels of a sketched model')
+
+parser.add_argument(
+    '--arch',
+    type=str,
+    default='resnet',
+    choices=('resnet','googlenet','vgg','mobilenet_v2'),
+    help='The architecture of the model. default:resnet')
+
+parser.add_argument(
+    '--data_set',
+    type=str,
+    default='cifar10',
+    help='The dataset the model was trained on. default:cifar10',
+)
+
+parser.add_argument(
+    '--cfg',
+    type=str,
+    default='resnet56',
+    help='Detail architecuture of model. default:resnet56'
+)
+
+parser.add_argument(
+    '--sketch_model',
+    type=str,
+    default=None,
+    help='Path to the sketched (and fine-tuned) checkpoint. default:None'
+)
+
+parser.add_argument(
+    '--sketch_rate',
+    type=str,
+    default=None,
+    help='The sketch rate of the checkpoint, the unpruned model if not given. default:None'
+)
+
+parser.add_argument(
+    '--start_conv',
+    type=int,
+    default=1,
+    help='The index of Conv to start sketch, index starts from 0. default:1'
+)
+
+parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+parser.add_argument(
+    '--tol',
+    type=float,
+    default=1e-3,
+    help='A filter is zero when its norm is at most this proportion of the largest one of its layer. default:1e-3')
+
+parser.add_argument(
+    '--output',
+    type=str,
+    default=None,
+    help='Where to save the shrunk checkpoint, next to --sketch_model as *_shrunk.pt if not given. default:None')
+
+args = parser.parse_args()
+
+device = torch.device('cpu')
+arch = get_arch(args.arch, args.cfg, args.data_set)
+
+def main():
+    if args.sketch_model is None:
+        raise ValueError('--sketch_model is required!')
+    sketch_rate = utils.get_sketch_rate(args.sketch_rate) if args.sketch_rate is not None else None
+    channel_round = get_channel_round(args.channel_round)
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+    ckpt = torch.load(args.sketch_model, map_location=device)
+    if 'widths' in ckpt:
+        shrink.resize(arch, model, ckpt['widths'])
+    model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    model.eval()
+
+    inputs = torch.randn(8, 3, arch.input_size, arch.input_size, generator=torch.Generator().manual_seed(0))
+    with torch.no_grad():
+        outputs = model(inputs)
+    layers = arch.get_layers(sketch_rate, args.start_conv, channel_round)
+    layers = shrink.shrunk_layers(arch, layers, ckpt.get('widths', {}))
+    flops, params, _ = cost.get_cost(layers)
+
+    keep = shrink.removable_channels(arch, model, args.tol)
+    shrink.remove_channels(arch, model, keep)
+    widths = dict(ckpt.get('widths', {}))
+    widths.update(shrink.channel_widths(model, keep))
+    with torch.no_grad():
+        error = (model(inputs) - outputs).abs().max().item()
+    shrunk_flops, shrunk_params, _ = cost.get_cost(shrink.shrunk_layers(arch, layers, widths))
+
+    print('%-36s %10s %10s' % ('Layer', 'Width', 'Removed'))
+    for layer in layers:
+        if layer.name in keep:
+            print('%-36s %10d %10d' % (layer.name, len(keep[layer.name]), layer.out_channels - len(keep[layer.name])))
+    print('--------------Total--------------')
+    print('Removed %d filters from %d layers' % (
+        sum(layer.out_channels - len(keep[layer.name]) for layer in layers if layer.name in keep), len(keep)))
+    print('FLOPS: %.2fM -> %.2fM (%.2f%% saved)' % (flops / 1e6, shrunk_flops / 1e6, 100. * (1 - shrunk_flops / flops)))
+    print('Params: %.2fK -> %.2fK (%.2f%% saved)' % (
+        params / 1e3, shrunk_params / 1e3, 100. * (1 - shrunk_params / params)))
+    print('Max logit change on random inputs: %.6f' % error)
+
+    output = args.output or args.sketch_model.rsplit('.', 1)[0] + '_shrunk.pt'
+    state = {k: v for k, v in ckpt.items() if k not in ('state_dict', 'optimizer', 'scheduler')} \
+        if 'state_dict' in ckpt else {}
+    state.update({'state_dict': model.state_dict(), 'widths': widths})
+    torch.save(state, output)
+    print('Shrunk checkpoint saved to {}'.format(output))
+
+if __name__ == '__main__':
+    main()
@@ -1,290 +1,86 @@
 import torch
 import torch.nn as nn
-import torch.optim as optim
 from utils.options import args
-from model.googlenet import Inception
 import utils.common as utils
+from utils.channel import get_channel_round
+import utils.sketch as sketch
+from utils.fidelity import SketchReport
+from utils.distill import LogitCache
+from utils.registry import get_arch
+from utils.schedule import EarlyStopping
+from utils.finetune import get_optimizer, train
+from utils.telemetry import Telemetry
+from utils.manifest import RunManifest
+from utils.profiler import StepProfiler
 
 import os
 import time
 from data import cifar10
-from importlib import import_module
 
 device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+utils.set_threads(args.num_threads, args.interop_threads, args.cpu_cores)
 checkpoint = utils.checkpoint(args)
 logger = utils.get_logger(os.path.join(args.job_dir + 'logger.log'))
+manifest = RunManifest(os.path.join(args.job_dir, 'manifest.json'), args)
 loss_func = nn.CrossEntropyLoss()
 
 # Data
 print('==> Preparing data..')
-loader = cifar10.Data(args)
-
-def weight_norm(weight, weight_norm_method=None):
-
-    if weight_norm_method == 'l2':
-        norm_func = lambda x: torch.sqrt(torch.sum(x.pow(2)))
-    else:
-        norm_func = lambda x: 1.0
-
-    weight /= norm_func(weight)
-
-    return weight
-
-def sketch_matrix(weight, l, dim, weight_norm_method=None):
-
-    A = weight.clone()
-    if weight.dim() == 4:  #Convolution layer
-        A = A.view(A.size(dim), -1)
-
-    B = torch.zeros(l, A.size(1))
-    ind = int(l / 2)
-    [n, _] = A.size()  # n: number of samples m: dimension
-    numNonzeroRows = torch.nonzero(torch.sum(B.mul(B), 1) > 0).size(0) # number of non - zero rows
-
-    for i in range(n):
-        if numNonzeroRows < l:
-            B[numNonzeroRows, :] = A[i, :]
-        else:
-            if n - i < l // 2:
-                break
-            u, sigma, _ = torch.svd(B.t())
-            sigmaSquare = sigma.mul(sigma)
-            sigmaSquareDiag = torch.diag(sigmaSquare)
-            theta = sigmaSquareDiag[ind]
-            sigmaSquare = sigmaSquareDiag - torch.eye(l) * torch.sum(theta)
-            sigmaHat = torch.sqrt(torch.where(sigmaSquare > 0,
-                                              sigmaSquare, torch.zeros(sigmaSquare.size())))
-            B = sigmaHat.mm(u.t())
-            numNonzeroRows = ind
-            B[numNonzeroRows, :] = A[i, :]
-
-        numNonzeroRows = numNonzeroRows + 1
-
-    if dim == 0:
-        return weight_norm(B.view(l, weight.size(1), weight.size(2), weight.size(3)), weight_norm_method)
-    elif dim == 1:
-        return weight_norm(B.view(weight.size(0), l, weight.size(2), weight.size(3)), weight_norm_method)
-
-def load_resnet_sketch_model(model):
-    cfg = {'resnet56': [9, 9, 9],
-           'resnet110': [18, 18, 18],
-           }
-
+if args.eval_every > 0 and args.val_samples <= 0:
+    raise ValueError('--eval_every needs --val_samples training images held out for early stopping!')
+# Fixed class-balanced split of the training set for early stopping, and subset of the test set for fast evaluation
+loader = cifar10.Data(args, indexed=args.distill, val_samples=args.val_samples,
+                      eval_samples=args.eval_samples if args.fast_eval else 0)
+arch = get_arch(args.arch, args.cfg, args.data_set)
+valLoader = getattr(loader, 'valLoader', None)
+fastLoader = getattr(loader, 'fastLoader', None)
+if valLoader is not None:
+    logger.info('Held out {} training images for validation, training on the other {}'.format(
+        len(valLoader.dataset), len(loader.trainLoader.dataset)))
+
+def load_sketch_model(model):
     if args.sketch_model is None or not os.path.exists(args.sketch_model):
         raise ('Sketch model path should be exist!')
     ckpt = torch.load(args.sketch_model, map_location=device)
-    origin_model = import_module(f'model.{args.arch}').resnet(args.cfg).to(device)
+    origin_model = arch.build().to(device)
     origin_model.load_state_dict(ckpt['state_dict'])
-    logger.info('==>Before Sketch')
-    test(origin_model, loader.testLoader)
-
-    oristate_dict = origin_model.state_dict()
-
-    state_dict = model.state_dict()
-    is_preserve = False #Whether the previous layer retains the original weight dimension, no sketch
-
-    current_cfg = cfg[args.cfg]
-
-    all_sketch_conv_weight = []
-    all_sketch_bn_weight = []
-
-    for layer, num in enumerate(current_cfg):
-        layer_name = 'layer' + str(layer + 1) + '.'
-        for i in range(num):
-            for j in range(2):
-                #Block the first convolution layer, only sketching the first dimension
-                #Block the last convolution layer, only Skitch on the channel dimension
-                conv_name = layer_name + str(i) + '.conv' + str(j + 1)
-                conv_weight_name = conv_name + '.weight'
-                all_sketch_conv_weight.append(conv_weight_name) #Record the weight of the sketch
-                oriweight = oristate_dict[conv_weight_name]
-                l = state_dict[conv_weight_name].size(0)
-
-                if l < oriweight.size(1) * oriweight.size(2) * oriweight.size(3) and j == 0:
-                    bn_weight_name = layer_name + str(i) + '.bn' + str(j + 1) + '.weight'
-                    all_sketch_bn_weight.append(bn_weight_name)
-
-                    sketch_filter = sketch_matrix(oriweight, l, dim=0,
-                                                    weight_norm_method=args.weight_norm_method)
-
-                    if is_preserve or j == 0:
-                        state_dict[conv_weight_name] = sketch_filter
-                    else:
-                        l = state_dict[conv_weight_name].size(1)
-                        sketch_channel = sketch_matrix(sketch_filter, l, dim=1,
-                                                       weight_norm_method=args.weight_norm_method)
-                        state_dict[conv_weight_name] = sketch_channel
-                    is_preserve = False
-                else:
-                    if j == 1: #Block the last volume layer only sketch the channel dimension
-                        l = state_dict[conv_weight_name].size(1)
-                        sketch_channel = sketch_matrix(oriweight, l, dim=1,
-                                                       weight_norm_method=args.weight_norm_method)
-                        state_dict[conv_weight_name] = sketch_channel
-                    else:
-                        state_dict[conv_weight_name] = oriweight
-                        is_preserve = True
-
-    for name, module in model.named_modules():
-        if isinstance(module, nn.Conv2d):
-            conv_name = name + '.weight'
-            if conv_name not in all_sketch_conv_weight:
-                state_dict[conv_name] = oristate_dict[conv_name]
-
-        elif isinstance(module, nn.BatchNorm2d):
-            bn_weight_name = name + '.weight'
-            bn_bias_name = name + '.bias'
-            bn_mean_name = name + '.running_mean'
-            bn_var_name = name + '.running_var'
-            if bn_weight_name not in all_sketch_bn_weight:
-                state_dict[bn_weight_name] = oristate_dict[bn_weight_name]
-                state_dict[bn_bias_name] = oristate_dict[bn_bias_name]
-                state_dict[bn_mean_name] = oristate_dict[bn_mean_name]
-                state_dict[bn_var_name] = oristate_dict[bn_var_name]
-
-        elif isinstance(module, nn.Linear):
-            state_dict[name + '.weight'] = oristate_dict[name + '.weight']
-            state_dict[name + '.bias'] = oristate_dict[name + '.bias']
-
-    model.load_state_dict(state_dict)
-    logger.info('==>After Sketch')
-    test(model, loader.testLoader)
+    # An incremental sketch starts from a model whose accuracy is known
+    if args.resketch_from is None:
+        logger.info('==>Before Sketch')
+        if args.fast_eval:
+            fast_test(origin_model)
+        else:
+            test(origin_model, loader.testLoader)
 
-def load_googlenet_sketch_model(model):
-    if args.sketch_model is None or not os.path.exists(args.sketch_model):
-        raise ('Sketch model path should be exist!')
-    ckpt = torch.load(args.sketch_model, map_location=device)
-    origin_model = import_module(f'model.{args.arch}').googlenet().to(device)
-    origin_model.load_state_dict(ckpt['state_dict'])
-    logger.info('==>Before Sketch')
-    test(origin_model, loader.testLoader)
     oristate_dict = origin_model.state_dict()
-
-    state_dict = model.state_dict()
-    all_sketch_conv_name = []
-    all_sketch_bn_name = []
-
-    for name, module in origin_model.named_modules():
-
-        if isinstance(module, Inception):
-
-            sketch_filter_channel_index = ['.branch5x5.3']  # the index of sketch filter and channel weight
-            sketch_channel_index = ['.branch3x3.3', '.branch5x5.6']  # the index of sketch channel weight
-            sketch_filter_index = ['.branch3x3.0', '.branch5x5.0']  # the index of sketch filter weight
-            sketch_bn_index = ['.branch3x3.1', '.branch5x5.1', '.branch5x5.4'] #the index of sketch bn weight
-
-            for bn_index in sketch_bn_index:
-                all_sketch_bn_name.append(name + bn_index)
-
-            for weight_index in sketch_filter_channel_index:
-
-                conv_name = name + weight_index + '.weight'
-                all_sketch_conv_name.append(name + weight_index)
-
-                oriweight = oristate_dict[conv_name]
-                l = state_dict[conv_name].size(0)
-
-                sketch_filter = sketch_matrix(oriweight, l, dim=0,
-                                              weight_norm_method=args.weight_norm_method)
-                l = state_dict[conv_name].size(1)
-                sketch_channel = sketch_matrix(sketch_filter, l, dim=1,
-                                               weight_norm_method=args.weight_norm_method)
-                state_dict[conv_name] = sketch_channel
-
-            for weight_index in sketch_channel_index:
-
-                conv_name = name + weight_index + '.weight'
-                all_sketch_conv_name.append(name + weight_index)
-                oriweight = oristate_dict[conv_name]
-
-                l = state_dict[conv_name].size(1)
-                sketch_channel = sketch_matrix(oriweight, l, dim=1,
-                                               weight_norm_method=args.weight_norm_method)
-                state_dict[conv_name] = sketch_channel
-
-            for weight_index in sketch_filter_index:
-
-                conv_name = name + weight_index + '.weight'
-                all_sketch_conv_name.append(name + weight_index)
-                oriweight = oristate_dict[conv_name]
-
-                l = state_dict[conv_name].size(0)
-                sketch_filter = sketch_matrix(oriweight, l, dim=0,
-                                               weight_norm_method=args.weight_norm_method)
-                state_dict[conv_name] = sketch_filter
-
-    for name, module in model.named_modules(): #Reassign non sketch weights to the new network
-
-        if isinstance(module, nn.Conv2d):
-
-            if name not in all_sketch_conv_name:
-                state_dict[name + '.weight'] = oristate_dict[name + '.weight']
-                state_dict[name + '.bias'] = oristate_dict[name + '.bias']
-
-        elif isinstance(module, nn.BatchNorm2d):
-
-            if name not in all_sketch_bn_name:
-                state_dict[name + '.weight'] = oristate_dict[name + '.weight']
-                state_dict[name + '.bias'] = oristate_dict[name + '.bias']
-                state_dict[name + '.running_mean'] = oristate_dict[name + '.running_mean']
-                state_dict[name + '.running_var'] = oristate_dict[name + '.running_var']
-
-        elif isinstance(module, nn.Linear):
-            state_dict[name + '.weight'] = oristate_dict[name + '.weight']
-            state_dict[name + '.bias'] = oristate_dict[name + '.bias']
+    report = SketchReport() if not args.no_sketch_report else None
+    dtype = torch.float64 if args.sketch_fp64 else None
+    if args.resketch_from is not None:
+        prev_ckpt = torch.load(args.resketch_from, map_location=device)
+        metadata = prev_ckpt.get('sketch_metadata')
+        utils.check_resketch(metadata, utils.sketch_metadata(args))
+        # The units whose rate changed, even when the rounded widths did not
+        changed = sketch.changed_units(arch, metadata['sketch_rate'], utils.get_sketch_rate(args.sketch_rate),
+                                       args.start_conv)
+        state_dict, resketched = sketch.resketch_state_dict(arch, model, oristate_dict, prev_ckpt['state_dict'],
+                                                            weight_norm_method=args.weight_norm_method,
+                                                            report=report, dtype=dtype, changed=changed)
+        logger.info('==>Re-sketched {} of {} units from {}: {}'.format(
+            len(resketched), len(arch.units), args.resketch_from, ' '.join(resketched)))
+    else:
+        state_dict = sketch.sketch_state_dict(arch, model, oristate_dict,
+                                              weight_norm_method=args.weight_norm_method, report=report, dtype=dtype)
+    if report is not None:
+        report.write(os.path.join(args.job_dir, 'sketch_report'))
+        logger.info(report.summary())
 
     model.load_state_dict(state_dict)
     logger.info('==>After Sketch')
-    test(model, loader.testLoader)
-
-def train(model, optimizer, trainLoader, args, epoch, topk=(1,)):
-
-    model.train()
-    losses = utils.AverageMeter()
-    accuracy = utils.AverageMeter()
-    top5_accuracy = utils.AverageMeter()
-    print_freq = len(trainLoader.dataset) // args.train_batch_size // 10
-    start_time = time.time()
-    for batch, (inputs, targets) in enumerate(trainLoader):
-
-        inputs, targets = inputs.to(device), targets.to(device)
-        optimizer.zero_grad()
-        output = model(inputs)
-        loss = loss_func(output, targets)
-        loss.backward()
-        losses.update(loss.item(), inputs.size(0))
-        optimizer.step()
-
-        prec1 = utils.accuracy(output, targets, topk=topk)
-        accuracy.update(prec1[0], inputs.size(0))
-        if len(topk) == 2:
-            top5_accuracy.update(prec1[1], inputs.size(0))
-
-        if batch % print_freq == 0 and batch != 0:
-            current_time = time.time()
-            cost_time = current_time - start_time
-            if len(topk) == 1:
-                logger.info(
-                    'Epoch[{}] ({}/{}):\t'
-                    'Loss {:.4f}\t'
-                    'Accuracy {:.2f}%\t\t'
-                    'Time {:.2f}s'.format(
-                        epoch, batch * args.train_batch_size, len(trainLoader.dataset),
-                        float(losses.avg), float(accuracy.avg), cost_time
-                    )
-                )
-            else:
-                logger.info(
-                    'Epoch[{}] ({}/{}):\t'
-                    'Loss {:.4f}\t'
-                    'Top1 {:.2f}%\t'
-                    'Top5 {:.2f}%\t'
-                    'Time {:.2f}s'.format(
-                        epoch, batch * args.train_batch_size, len(trainLoader.dataset),
-                        float(losses.avg), float(accuracy.avg), float(top5_accuracy.avg), cost_time
-                    )
-                )
-            start_time = current_time
+    if args.fast_eval:
+        fast_test(model)
+    else:
+        test(model, loader.testLoader)
+    return origin_model
 
 def test(model, testLoader, topk=(1,)):
     model.eval()
@@ -322,6 +118,23 @@ def test(model, testLoader, topk=(1,)):
     else:
         return top5_accuracy.avg
 
+def fast_test(model, best_acc=None, topk=(1,)):
+    """Accuracy on the test subset, escalated to the full test set when its interval reaches best_acc.
+
+    Returns the full test accuracy, or None when the subset rules out a new best.
+    """
+    start_time = time.time()
+    accs = utils.evaluate(model, fastLoader, device, topk=topk)
+    intervals = [utils.wilson_interval(acc, len(fastLoader.dataset), args.eval_confidence) for acc in accs]
+    logger.info('Subset ({} samples) {}\tTime {:.2f}s'.format(
+        len(fastLoader.dataset), '\t'.join('Top{} {:.2f}% [{:.2f}, {:.2f}]'.format(k, acc, low, high)
+                                           for k, acc, (low, high) in zip(topk, accs, intervals)),
+        time.time() - start_time))
+    if best_acc is not None and intervals[-1][1] >= best_acc:
+        # The subset can not rule out a new best, only the full set decides
+        return test(model, loader.testLoader, topk=topk)
+    return None
+
 def main():
     start_epoch = 0
     best_acc = 0.0
@@ -329,43 +142,82 @@ def main():
     # Model
     print('==> Building model..')
     sketch_rate = utils.get_sketch_rate(args.sketch_rate)
-    if args.arch == 'resnet':
-        model = import_module(f'model.{args.arch}')\
-                        .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=args.start_conv).to(device)
-        load_resnet_sketch_model(model)
-    elif args.arch == 'googlenet':
-        model = import_module(f'model.{args.arch}').googlenet(sketch_rate).to(device)
-        load_googlenet_sketch_model(model)
-    else:
-        raise('arch not exist!')
+    channel_round = get_channel_round(args.channel_round)
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+    with manifest.phase('sketch'):
+        origin_model = load_sketch_model(model)
+    manifest.update(sketch_metadata=utils.sketch_metadata(args))
     print('==>Sketch Done!')
 
+    teacher_logits = None
+    if args.distill:
+        # The teacher only runs once, on the un-augmented training images
+        teacher_logits = LogitCache(args.job_dir, args.sketch_model, args.data_path, len(loader.centerLoader.dataset),
+                                    len(loader.centerLoader.dataset.classes))
+        teacher_logits.build(origin_model, loader.centerLoader, device)
+    del origin_model
+
     if len(args.gpus) != 1:
         model = nn.DataParallel(model, device_ids=args.gpus)
 
-    optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum, weight_decay=args.weight_decay)
-    scheduler = optim.lr_scheduler.MultiStepLR(optimizer, milestones=args.lr_decay_step, gamma=0.1)
-
+    optimizer, scheduler, schedule = get_optimizer(model, args, len(loader.trainLoader),
+                                                   time_budget=args.time_budget * 3600
+                                                   if args.time_budget is not None else None)
+    stopper = EarlyStopping(args.patience, args.plateau_tol) if args.eval_every > 0 else None
+    telemetry = None
+    if args.telemetry or args.tensorboard:
+        telemetry = Telemetry(os.path.join(args.job_dir, 'telemetry.jsonl'), device,
+                              checkpoint.run_dir if args.tensorboard else None)
+    profiler = None
+    if args.profile is not None:
+        profiler = StepProfiler(getattr(model, 'module', model), args.profile, os.path.join(args.job_dir, 'profile'),
+                                args.profile_steps, device=device, log=logger.info)
+
+    fine_tune_start = time.time()
     for epoch in range(start_epoch, args.num_epochs):
-        train(model, optimizer, loader.trainLoader, args, epoch, topk=(1, 5) if args.data_set == 'imagenet' else (1, ))
-        scheduler.step()
-        test_acc = test(model, loader.testLoader, topk=(1, 5) if args.data_set == 'imagenet' else (1, ))
+        stop = train(model, optimizer, loader.trainLoader, args, epoch, device, logger,
+                     topk=(1, 5) if args.data_set == 'imagenet' else (1, ),
+                     teacher_logits=teacher_logits, schedule=schedule, stopper=stopper, valLoader=valLoader,
+                     telemetry=telemetry, profiler=profiler)
+        if args.lr_schedule == 'step':
+            scheduler.step()
+        if args.fast_eval:
+            test_acc = fast_test(model, best_acc, topk=(1, 5) if args.data_set == 'imagenet' else (1, ))
+        else:
+            test_acc = test(model, loader.testLoader, topk=(1, 5) if args.data_set == 'imagenet' else (1, ))
 
-        is_best = best_acc < test_acc
-        best_acc = max(best_acc, test_acc)
+        # Only full test set accuracies compete for the best checkpoint
+        is_best = test_acc is not None and best_acc < test_acc
+        best_acc = max(best_acc, test_acc) if test_acc is not None else best_acc
 
         model_state_dict = model.module.state_dict() if len(args.gpus) > 1 else model.state_dict()
 
         state = {
             'state_dict': model_state_dict,
+            'sketch_metadata': utils.sketch_metadata(args),
             'best_acc': best_acc,
             'optimizer': optimizer.state_dict(),
             'scheduler': scheduler.state_dict(),
             'epoch': epoch + 1
         }
-        checkpoint.save_model(state, epoch + 1, is_best)
+        if telemetry is not None and test_acc is not None:
+            telemetry.event('test', epoch=epoch + 1, accuracy=float(test_acc))
 
+        save_time = time.time()
+        checkpoint.save_model(state, epoch + 1, is_best)
+        if telemetry is not None:
+            telemetry.event('checkpoint', epoch=epoch + 1, time=time.time() - save_time, is_best=bool(is_best))
+        manifest.update(flush=True, epochs=epoch + 1, best_acc=float(best_acc))
+        if stop:
+            break
+    manifest.record_phase('fine_tune', time.time() - fine_tune_start)
+
+    if telemetry is not None:
+        telemetry.close()
+    if profiler is not None:
+        profiler.finish()
     logger.info('Best accuracy: {:.3f}'.format(float(best_acc)))
+    manifest.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
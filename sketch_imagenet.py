@@ -3,166 +3,106 @@ import torch.nn as nn
 import torch.optim as optim
 from utils.options import args
 import utils.common as utils
+from utils.channel import get_channel_round
+import utils.sketch as sketch
+from utils.fidelity import SketchReport
+from utils.distill import distill_loss, LogitCache
+from utils.registry import get_arch
+from utils.schedule import FineTuneSchedule, EarlyStopping
+from utils.telemetry import Telemetry
+from utils.manifest import RunManifest
+from utils.profiler import StepProfiler
+from data.subset import subset_loader
 
 import os
+import resource
 import time
 from data import imagenet_dali
-from importlib import import_module
 
 device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+utils.set_threads(args.num_threads, args.interop_threads, args.cpu_cores)
 checkpoint = utils.checkpoint(args)
 logger = utils.get_logger(os.path.join(args.job_dir + 'logger.log'))
+manifest = RunManifest(os.path.join(args.job_dir, 'manifest.json'), args)
 loss_func = nn.CrossEntropyLoss()
 
 # Data
 print('==> Preparing data..')
-def get_data_set(type='train'):
+if args.eval_every > 0 and args.val_samples <= 0:
+    raise ValueError('--eval_every needs a --val_samples validation subset for early stopping!')
+def get_data_set(type='train', file_list=None):
     if type == 'train':
         return imagenet_dali.get_imagenet_iter_dali('train', args.data_path, args.train_batch_size,
-                                                   num_threads=4, crop=224, device_id=args.gpus[0], num_gpus=1)
+                                                   num_threads=4, crop=224, device_id=args.gpus[0], num_gpus=1,
+                                                   file_list=file_list)
     else:
-        return imagenet_dali.get_imagenet_iter_dali('val', args.data_path, args.eval_batch_size,
-                                                   num_threads=4, crop=224, device_id=args.gpus[0], num_gpus=1)
-trainLoader = get_data_set('train')
+        return imagenet_dali.get_imagenet_iter_dali(type, args.data_path, args.eval_batch_size,
+                                                   num_threads=4, crop=224, device_id=args.gpus[0], num_gpus=1,
+                                                   file_list=file_list)
+# With --distill DALI labels the training images with their index to look the cached teacher logits up,
+# train_targets maps the indices back to classes
+file_list = os.path.join(args.job_dir, 'train_files.txt') if args.distill else None
+train_targets = torch.tensor(imagenet_dali.indexed_file_list(args.data_path, file_list)) if args.distill else None
+trainLoader = get_data_set('train', file_list)
 testLoader = get_data_set('test')
-
-def weight_norm(weight, weight_norm_method=None):
-
-    if weight_norm_method == 'l2':
-        norm_func = lambda x: torch.sqrt(torch.sum(x.pow(2)))
-    else:
-        norm_func = lambda x: 1.0
-
-    weight /= norm_func(weight)
-
-    return weight
-
-def sketch_matrix(weight, l, dim, weight_norm_method=None):
-
-    A = weight.clone()
-    if weight.dim() == 4:  #Convolution layer
-        A = A.view(A.size(dim), -1)
-
-    B = torch.zeros(l, A.size(1))
-    ind = int(l / 2)
-    [n, _] = A.size()  # n: number of samples m: dimension
-    numNonzeroRows = torch.nonzero(torch.sum(B.mul(B), 1) > 0).size(0) # number of non - zero rows
-
-    for i in range(n):
-        if numNonzeroRows < l:
-            B[numNonzeroRows, :] = A[i, :]
-        else:
-            if n - i < l // 2:
-                break
-            u, sigma, _ = torch.svd(B.t())
-            sigmaSquare = sigma.mul(sigma)
-            sigmaSquareDiag = torch.diag(sigmaSquare)
-            theta = sigmaSquareDiag[ind]
-            sigmaSquare = sigmaSquareDiag - torch.eye(l) * torch.sum(theta)
-            sigmaHat = torch.sqrt(torch.where(sigmaSquare > 0,
-                                              sigmaSquare, torch.zeros(sigmaSquare.size())))
-            B = sigmaHat.mm(u.t())
-            numNonzeroRows = ind
-            B[numNonzeroRows, :] = A[i, :]
-
-        numNonzeroRows = numNonzeroRows + 1
-
-    if dim == 0:
-        return weight_norm(B.view(l, weight.size(1), weight.size(2), weight.size(3)), weight_norm_method)
-    elif dim == 1:
-        return weight_norm(B.view(weight.size(0), l, weight.size(2), weight.size(3)), weight_norm_method)
+arch = get_arch(args.arch, args.cfg, 'imagenet')
+# Fixed class-balanced subsets of the validation set for early stopping and fast evaluation,
+# DALI iterators have no dataset to draw them from so they go through torchvision
+valset = imagenet_dali.get_imagenet_iter_torch('val', args.data_path, args.eval_batch_size, num_threads=4,
+                                               device_id=args.gpus[0], num_gpus=1, crop=224).dataset \
+    if args.fast_eval or args.eval_every > 0 else None
+valLoader = subset_loader(valset, args.val_samples, args.eval_batch_size, num_workers=4) \
+    if args.eval_every > 0 else None
+fastLoader = subset_loader(valset, args.eval_samples, args.eval_batch_size, num_workers=4) if args.fast_eval else None
 
 def load_resnet_imagenet_sketch_model(model):
-    cfg = {'resnet18': [2, 2, 2, 2],
-           'resnet34': [3, 4, 6, 3],
-           'resnet50': [3, 4, 6, 3],
-           'resnet101': [3, 4, 23, 3],
-           'resnet152': [3, 8, 36, 3]}
-
     if args.sketch_model is None or not os.path.exists(args.sketch_model):
         raise ('Sketch model path should be exist!')
     ckpt = torch.load(args.sketch_model, map_location=device)
-    origin_model = import_module(f'model.{args.arch}_imagenet').resnet(args.cfg).to(device)
+    origin_model = arch.build().to(device)
     origin_model.load_state_dict(ckpt)
-    logger.info('==>Before Sketch')
-    test(origin_model, testLoader, topk=(1, 5))
+    # An incremental sketch starts from a model whose accuracy is known
+    if args.resketch_from is None:
+        logger.info('==>Before Sketch')
+        if args.fast_eval:
+            fast_test(origin_model)
+        else:
+            test(origin_model, testLoader, topk=(1, 5))
 
     oristate_dict = origin_model.state_dict()
-
-    state_dict = model.state_dict()
-    is_preserve = False  # Whether the previous layer retains the original weight dimension, no sketch
-
-    current_cfg = cfg[args.cfg]
-
-    all_sketch_conv_weight = []
-    all_sketch_bn_weight = []
-
-    for layer, num in enumerate(current_cfg):
-        layer_name = 'layer' + str(layer + 1) + '.'
-        for i in range(num):
-            if args.cfg == 'resnet18' or args.cfg == 'resnet34':
-                iter = 2  # the number of convolution layers in a block, except for shortcut
-            else:
-                iter = 3
-            for j in range(iter):
-                # Block the first convolution layer, only sketching the first dimension
-                # Block the last convolution layer, only Skitch on the channel dimension
-                conv_name = layer_name + str(i) + '.conv' + str(j + 1)
-                conv_weight_name = conv_name + '.weight'
-                all_sketch_conv_weight.append(conv_weight_name)  # Record the weight of the sketch
-                oriweight = oristate_dict[conv_weight_name]
-                l = state_dict[conv_weight_name].size(0)
-
-                if l < oriweight.size(1) * oriweight.size(2) * oriweight.size(3) and j != iter - 1:
-                    bn_weight_name = layer_name + str(i) + '.bn' + str(j + 1) + '.weight'
-                    all_sketch_bn_weight.append(bn_weight_name)
-
-                    sketch_filter = sketch_matrix(oriweight, l, dim=0,
-                                                  weight_norm_method=args.weight_norm_method)
-                    if is_preserve or j == 0:
-                        state_dict[conv_weight_name] = sketch_filter
-                    else:
-                        l = state_dict[conv_weight_name].size(1)
-                        sketch_channel = sketch_matrix(sketch_filter, l, dim=1,
-                                                       weight_norm_method=args.weight_norm_method)
-                        state_dict[conv_weight_name] = sketch_channel
-                    is_preserve = False
-                else:
-                    if j == iter - 1:  # Block the last volume layer only sketch the channel dimension
-                        l = state_dict[conv_weight_name].size(1)
-                        sketch_channel = sketch_matrix(oriweight, l, dim=1,
-                                                       weight_norm_method=args.weight_norm_method)
-                        state_dict[conv_weight_name] = sketch_channel
-                    else:
-                        state_dict[conv_weight_name] = oriweight
-                        is_preserve = True
-
-    for name, module in model.named_modules():
-        if isinstance(module, nn.Conv2d):
-            conv_name = name + '.weight'
-            if conv_name not in all_sketch_conv_weight:
-                state_dict[conv_name] = oristate_dict[conv_name]
-
-        elif isinstance(module, nn.BatchNorm2d):
-            bn_weight_name = name + '.weight'
-            bn_bias_name = name + '.bias'
-            bn_mean_name = name + '.running_mean'
-            bn_var_name = name + '.running_var'
-            if bn_weight_name not in all_sketch_bn_weight:
-                state_dict[bn_weight_name] = oristate_dict[bn_weight_name]
-                state_dict[bn_bias_name] = oristate_dict[bn_bias_name]
-                state_dict[bn_mean_name] = oristate_dict[bn_mean_name]
-                state_dict[bn_var_name] = oristate_dict[bn_var_name]
-
-        elif isinstance(module, nn.Linear):
-            state_dict[name + '.weight'] = oristate_dict[name + '.weight']
-            state_dict[name + '.bias'] = oristate_dict[name + '.bias']
+    report = SketchReport() if not args.no_sketch_report else None
+    dtype = torch.float64 if args.sketch_fp64 else None
+    if args.resketch_from is not None:
+        prev_ckpt = torch.load(args.resketch_from, map_location=device)
+        metadata = prev_ckpt.get('sketch_metadata')
+        utils.check_resketch(metadata, utils.sketch_metadata(args))
+        # The units whose rate changed, even when the rounded widths did not
+        changed = sketch.changed_units(arch, metadata['sketch_rate'], utils.get_sketch_rate(args.sketch_rate),
+                                       args.start_conv)
+        state_dict, resketched = sketch.resketch_state_dict(arch, model, oristate_dict, prev_ckpt['state_dict'],
+                                                            weight_norm_method=args.weight_norm_method,
+                                                            report=report, dtype=dtype, changed=changed)
+        logger.info('==>Re-sketched {} of {} units from {}: {}'.format(
+            len(resketched), len(arch.units), args.resketch_from, ' '.join(resketched)))
+    else:
+        state_dict = sketch.sketch_state_dict(arch, model, oristate_dict,
+                                              weight_norm_method=args.weight_norm_method, report=report, dtype=dtype)
+    if report is not None:
+        report.write(os.path.join(args.job_dir, 'sketch_report'))
+        logger.info(report.summary())
 
     model.load_state_dict(state_dict)
     logger.info('==>After Sketch')
-    test(model, testLoader, topk=(1, 5))
+    if args.fast_eval:
+        fast_test(model)
+    else:
+        test(model, testLoader, topk=(1, 5))
+    return origin_model
 
-def train(model, optimizer, trainLoader, args, epoch, topk=(1,)):
+def train(model, optimizer, trainLoader, args, epoch, topk=(1,), teacher_logits=None,
+          schedule=None, stopper=None, valLoader=None, telemetry=None,
+          profiler=None):
+    """Returns True when the fine-tuning budget ran out or the validation subset accuracy plateaued"""
 
     model.train()
     losses = utils.AverageMeter()
@@ -170,19 +110,49 @@ def train(model, optimizer, trainLoader, args, epoch, topk=(1,)):
     top5_accuracy = utils.AverageMeter()
     print_freq = trainLoader._size // args.train_batch_size // 10
     start_time = time.time()
+    epoch_start_time = start_time
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats(device)
+    stop = False
+    if telemetry is not None:
+        telemetry.start()
     for batch, batch_data in enumerate(trainLoader):
+        if telemetry is not None:
+            telemetry.mark('data')
 
         inputs = batch_data[0]['data'].to(device)
-        targets = batch_data[0]['label'].squeeze().long().to(device)
-
-        adjust_learning_rate(optimizer, epoch, batch, trainLoader._size // args.train_batch_size)
-
-        optimizer.zero_grad()
+        targets = batch_data[0]['label'].view(-1).long()
+        if teacher_logits is not None:
+            indices = targets.cpu()
+            targets = train_targets[indices]
+        targets = targets.to(device)
+
+        if args.lr_schedule == 'step':
+            adjust_learning_rate(optimizer, epoch, batch, trainLoader._size // args.train_batch_size)
+
+        # An optimizer step every accum_steps batches, the trailing batches of an epoch are dropped
+        if batch % args.accum_steps == 0:
+            optimizer.zero_grad()
+        stepped = (batch + 1) % args.accum_steps == 0
         output = model(inputs)
-        loss = loss_func(output, targets)
-        loss.backward()
+        if teacher_logits is not None:
+            loss = distill_loss(output, teacher_logits[indices].to(device), targets,
+                                args.distill_temperature, args.distill_alpha)
+        else:
+            loss = loss_func(output, targets)
+        (loss / args.accum_steps).backward()
         losses.update(loss.item(), inputs.size(0))
-        optimizer.step()
+        if telemetry is not None:
+            telemetry.mark('compute')
+        if stepped:
+            optimizer.step()
+            if schedule is not None:
+                schedule.step()
+        if telemetry is not None:
+            telemetry.mark('optimizer')
+            telemetry.step(inputs.size(0))
+        if profiler is not None:
+            profiler.step()
 
         prec1 = utils.accuracy(output, targets, topk=topk)
         accuracy.update(prec1[0], inputs.size(0))
@@ -202,7 +172,35 @@ def train(model, optimizer, trainLoader, args, epoch, topk=(1,)):
                 )
             )
             start_time = current_time
+            if telemetry is not None:
+                telemetry.log(epoch, loss=losses.avg, accuracy=accuracy.avg, lr=optimizer.param_groups[0]['lr'])
+
+        if stopper is not None and stepped and schedule.steps % args.eval_every == 0:
+            val_acc = utils.evaluate(model, valLoader, device)[0]
+            model.train()
+            if telemetry is not None:
+                telemetry.mark('eval')
+            logger.info('Step {}: Subset Top1 {:.2f}%\tlr {:.6f}'.format(
+                schedule.steps, val_acc, optimizer.param_groups[0]['lr']))
+            if stopper.update(val_acc):
+                logger.info('Subset accuracy plateaued, stop fine-tuning')
+                stop = True
+                break
+        if schedule is not None and schedule.finished():
+            logger.info('Fine-tuning budget exhausted, stop fine-tuning')
+            stop = True
+            break
     trainLoader.reset()
+    # Peak memory and throughput of the batch size, accumulation and checkpointing setting, on CPU the peak
+    # resident memory of the process so far (ru_maxrss is in kilobytes on Linux)
+    if torch.cuda.is_available():
+        peak_memory = 'Peak memory {:.0f}MB'.format(torch.cuda.max_memory_allocated(device) / 2 ** 20)
+    else:
+        peak_memory = 'Peak RSS {:.0f}MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+    logger.info('Epoch[{}] Throughput {:.1f} img/s\t{}\tBatch {}x{}{}'.format(
+        epoch, (batch + 1) * args.train_batch_size / (time.time() - epoch_start_time), peak_memory,
+        args.train_batch_size, args.accum_steps, ' checkpointed' if args.checkpoint_stages else ''))
+    return stop
 
 def test(model, testLoader, topk=(1,)):
     model.eval()
@@ -232,6 +230,21 @@ def test(model, testLoader, topk=(1,)):
     testLoader.reset()
     return accuracy.avg, top5_accuracy.avg
 
+def fast_test(model, best_accs=None):
+    """Top-1 and Top-5 on the validation subset, escalated to the full set when an interval reaches its best.
+
+    Returns the full set accuracies, or None when the subset rules out a new best.
+    """
+    start_time = time.time()
+    accs = utils.evaluate(model, fastLoader, device, topk=(1, 5))
+    intervals = [utils.wilson_interval(acc, len(fastLoader.dataset), args.eval_confidence) for acc in accs]
+    logger.info('Subset ({} samples) Top1 {:.2f}% [{:.2f}, {:.2f}]\tTop5 {:.2f}% [{:.2f}, {:.2f}]\tTime {:.2f}s'.format(
+        len(fastLoader.dataset), accs[0], *intervals[0], accs[1], *intervals[1], time.time() - start_time))
+    if best_accs is not None and any(high >= best for (_, high), best in zip(intervals, best_accs)):
+        # The subset can not rule out a new best, only the full set decides
+        return test(model, testLoader, topk=(1, 5))
+    return None
+
 def adjust_learning_rate(optimizer, epoch, step, len_epoch):
 
     factor = epoch // 30
@@ -239,7 +252,7 @@ def adjust_learning_rate(optimizer, epoch, step, len_epoch):
     if epoch >= 80:
         factor = factor + 1
 
-    lr = args.lr * (0.1 ** factor)
+    lr = utils.scale_lr(args.lr, args.train_batch_size, args.accum_steps, args.lr_batch_size) * (0.1 ** factor)
 
     #Warmup
     if epoch < 5:
@@ -248,6 +261,12 @@ def adjust_learning_rate(optimizer, epoch, step, len_epoch):
     for param_group in optimizer.param_groups:
         param_group['lr'] = lr
 
+def center_batches():
+    """(inputs, targets, indices) of the training images with the validation transforms, for LogitCache.build"""
+    for batch_data in get_data_set('center', file_list):
+        indices = batch_data[0]['label'].view(-1).long().cpu()
+        yield batch_data[0]['data'], train_targets[indices], indices
+
 def main():
     start_epoch = 0
     best_top1_acc = 0.0
@@ -255,37 +274,89 @@ def main():
 
     print('==> Building model..')
     sketch_rate = utils.get_sketch_rate(args.sketch_rate)
-    model = import_module(f'model.{args.arch}_imagenet')\
-                .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=args.start_conv).to(device)
-    load_resnet_imagenet_sketch_model(model)
+    channel_round = get_channel_round(args.channel_round)
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+    with manifest.phase('sketch'):
+        origin_model = load_resnet_imagenet_sketch_model(model)
+    manifest.update(sketch_metadata=utils.sketch_metadata(args))
+    teacher_logits = None
+    if args.distill:
+        # The teacher only runs once, on the center crops of the training images
+        teacher_logits = LogitCache(args.job_dir, args.sketch_model, args.data_path, len(train_targets), 1000)
+        teacher_logits.build(origin_model, center_batches(), device)
+    del origin_model
 
     print('==>Sketch Done!')
+    if args.checkpoint_stages:
+        if not hasattr(model, 'checkpoint_stages'):
+            raise ValueError('--checkpoint_stages only supports ResNet!')
+        model.checkpoint_stages = True
     if len(args.gpus) != 1:
         model = nn.DataParallel(model, device_ids=args.gpus)
 
-    optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum, weight_decay=args.weight_decay)
-
+    lr = utils.scale_lr(args.lr, args.train_batch_size, args.accum_steps, args.lr_batch_size)
+    optimizer = optim.SGD(model.parameters(), lr=lr, momentum=args.momentum, weight_decay=args.weight_decay)
+    schedule = FineTuneSchedule(optimizer, args.lr_schedule, lr,
+                                args.num_epochs * (trainLoader._size // args.train_batch_size // args.accum_steps),
+                                args.time_budget * 3600 if args.time_budget is not None else None)
+    stopper = EarlyStopping(args.patience, args.plateau_tol) if args.eval_every > 0 else None
+    telemetry = None
+    if args.telemetry or args.tensorboard:
+        telemetry = Telemetry(os.path.join(args.job_dir, 'telemetry.jsonl'), device,
+                              checkpoint.run_dir if args.tensorboard else None)
+    profiler = None
+    if args.profile is not None:
+        profiler = StepProfiler(getattr(model, 'module', model), args.profile, os.path.join(args.job_dir, 'profile'),
+                                args.profile_steps, device=device, log=logger.info)
+
+    fine_tune_start = time.time()
     for epoch in range(start_epoch, args.num_epochs):
-        train(model, optimizer, trainLoader, args, epoch, topk=(1, 5))
+        stop = train(model, optimizer, trainLoader, args, epoch, topk=(1, 5), teacher_logits=teacher_logits,
+                     schedule=schedule, stopper=stopper, valLoader=valLoader, telemetry=telemetry,
+                     profiler=profiler)
 
-        test_top1_acc, test_top5_acc = test(model, testLoader, topk=(1, 5))
+        if args.fast_eval:
+            test_accs = fast_test(model, (best_top1_acc, best_top5_acc))
+        else:
+            test_accs = test(model, testLoader, topk=(1, 5))
 
-        is_best = best_top5_acc < test_top5_acc
-        best_top1_acc = max(best_top1_acc, test_top1_acc)
-        best_top5_acc = max(best_top5_acc, test_top5_acc)
+        # Only full validation set accuracies compete for the best checkpoint
+        is_best = False
+        if test_accs is not None:
+            test_top1_acc, test_top5_acc = test_accs
+            is_best = best_top5_acc < test_top5_acc
+            best_top1_acc = max(best_top1_acc, test_top1_acc)
+            best_top5_acc = max(best_top5_acc, test_top5_acc)
 
         model_state_dict = model.module.state_dict() if len(args.gpus) > 1 else model.state_dict()
 
         state = {
             'state_dict': model_state_dict,
+            'sketch_metadata': utils.sketch_metadata(args),
             'best_top1_acc': best_top1_acc,
             'best_top5_acc': best_top5_acc,
             'optimizer': optimizer.state_dict(),
             'epoch': epoch + 1
         }
-        checkpoint.save_model(state, epoch + 1, is_best)
+        if telemetry is not None and test_accs is not None:
+            telemetry.event('test', epoch=epoch + 1, top1=float(test_top1_acc), top5=float(test_top5_acc))
 
+        save_time = time.time()
+        checkpoint.save_model(state, epoch + 1, is_best)
+        if telemetry is not None:
+            telemetry.event('checkpoint', epoch=epoch + 1, time=time.time() - save_time, is_best=bool(is_best))
+        manifest.update(flush=True, epochs=epoch + 1, best_top1_acc=float(best_top1_acc),
+                        best_top5_acc=float(best_top5_acc))
+        if stop:
+            break
+    manifest.record_phase('fine_tune', time.time() - fine_tune_start)
+
+    if telemetry is not None:
+        telemetry.close()
+    if profiler is not None:
+        profiler.finish()
     logger.info('Best Top-1 accuracy: {:.3f} Top-5 accuracy: {:.3f}'.format(float(best_top1_acc), float(best_top5_acc)))
+    manifest.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
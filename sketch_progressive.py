@@ -0,0 +1,159 @@
+import torch
+import argparse
+import copy
+import json
+import os
+import time
+
+import utils.common as utils
+from utils.channel import get_channel_round
+import utils.cost as cost
+import utils.sketch as sketch
+from utils.finetune import fine_tune
+from utils.options import base_parser, train_parser, sketch_parser
+from utils.registry import get_arch
+from data import cifar10
+
+parser = argparse.ArgumentParser(description='Reach a sketch rate over several sketch and fine-tune stages on CIFAR-10',
+                                 parents=[base_parser, train_parser, sketch_parser])
+
+parser.add_argument(
+    '--sketch_rate',
+    type=str,
+    default=None,
+    help='The sketch rate of the last stage. default:None'
+)
+
+parser.add_argument(
+    '--stage_rates',
+    type=str,
+    nargs='+',
+    default=None,
+    help='The sketch rates of the stages before the last one, --sketch_rate is the last one, e.g. [0.7]*27 [0.4]*27. default:None')
+
+parser.add_argument(
+    '--num_stages',
+    type=int,
+    default=3,
+    help='Without --stage_rates, the number of stages with rates shrinking geometrically to --sketch_rate. default:3')
+
+parser.add_argument(
+    '--stage_epochs',
+    type=int,
+    nargs='+',
+    default=[10],
+    help='The num of epochs to fine-tune each stage before the last one, one value for all of them. default:10')
+
+# Every stage anneals from --lr, the last one is fine-tuned for --num_epochs
+parser.set_defaults(num_epochs=60, lr_schedule='cosine')
+
+args = parser.parse_args()
+
+device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+utils.set_threads(args.num_threads, args.interop_threads, args.cpu_cores)
+arch = get_arch(args.arch, args.cfg, 'cifar10')
+channel_round = get_channel_round(args.channel_round)
+if not os.path.exists(args.job_dir):
+    os.makedirs(args.job_dir)
+logger = utils.get_logger(os.path.join(args.job_dir, 'logger.log'))
+
+def get_stages():
+    """(sketch rate, epochs) of each stage, the widths may only shrink from one stage to the next"""
+    if args.sketch_rate is None:
+        raise ValueError('--sketch_rate is required!')
+    sketch_rate = utils.get_sketch_rate(args.sketch_rate)
+    if args.stage_rates is not None:
+        rates = [utils.get_sketch_rate(rate) for rate in args.stage_rates] + [sketch_rate]
+    else:
+        rates = utils.progressive_sketch_rates(sketch_rate, args.num_stages)
+    epochs = args.stage_epochs * (len(rates) - 1) if len(args.stage_epochs) == 1 else list(args.stage_epochs)
+    if len(epochs) != len(rates) - 1:
+        raise ValueError('--stage_epochs has {} values for {} stages before the last one'.format(
+            len(epochs), len(rates) - 1))
+
+    num_rates = arch.num_rates(args.start_conv)
+    for index, rate in enumerate(rates):
+        if len(rate) != num_rates:
+            raise ValueError('Stage {} has {} rates, {} expects {}'.format(index, len(rate), args.cfg, num_rates))
+        if index > 0 and any(r > p for r, p in zip(rate, rates[index - 1])):
+            raise ValueError('Stage {} widens some layers of stage {}, the rates may only shrink'.format(
+                index, index - 1))
+    return list(zip(rates, epochs + [args.num_epochs]))
+
+def main():
+    if args.sketch_model is None or not os.path.exists(args.sketch_model):
+        raise ValueError('Sketch model path should be exist!')
+    stages = get_stages()
+
+    print('==> Preparing data..')
+    loader = cifar10.Data(args)
+
+    print('==> Building model..')
+    ckpt = torch.load(args.sketch_model, map_location=device)
+    origin_model = arch.build().to(device)
+    origin_model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    origin_acc = utils.evaluate(origin_model, loader.testLoader, device)[0]
+    logger.info('Origin Accuracy {:.2f}%'.format(origin_acc))
+    state_dict = origin_model.state_dict()
+    del origin_model
+
+    flops, params = cost.profile(arch, None, args.start_conv)
+    dtype = torch.float64 if args.sketch_fp64 else None
+    rows = []
+    start_time = time.time()
+    for index, (sketch_rate, num_epochs) in enumerate(stages):
+        sketch_rate_str = utils.format_sketch_rate(sketch_rate)
+        stage_dir = os.path.join(args.job_dir, 'stage_{}'.format(index))
+        if not os.path.exists(stage_dir):
+            os.makedirs(stage_dir)
+        logger.info('==> Stage {}/{}: sketch rate {}, {} epochs'.format(
+            index + 1, len(stages), sketch_rate_str, num_epochs))
+
+        model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+        if index == 0:
+            model.load_state_dict(sketch.sketch_state_dict(arch, model, state_dict,
+                                                           weight_norm_method=args.weight_norm_method, dtype=dtype))
+        else:
+            # Only the units narrowed by this stage are sketched, from the fine-tuned weights of the previous one
+            stage_state_dict, resketched = sketch.resketch_state_dict(arch, model, state_dict, state_dict,
+                                                                      weight_norm_method=args.weight_norm_method,
+                                                                      dtype=dtype)
+            model.load_state_dict(stage_state_dict)
+            logger.info('Re-sketched {} of {} units'.format(len(resketched), len(arch.units)))
+        sketch_acc = utils.evaluate(model, loader.testLoader, device)[0]
+        logger.info('After Sketch Accuracy {:.2f}%'.format(sketch_acc))
+
+        stage_time = time.time()
+        best = {'state_dict': copy.deepcopy(model.state_dict())}
+        best_acc = fine_tune(model, loader.trainLoader, loader.testLoader, args, device, logger, num_epochs,
+                             save=lambda state_dict, acc, epoch: best.update(state_dict=copy.deepcopy(state_dict)))
+        state_dict = best['state_dict']
+        path = os.path.join(stage_dir, 'model_best.pt')
+        torch.save({'state_dict': state_dict, 'sketch_metadata': utils.sketch_metadata(args, sketch_rate_str),
+                    'best_acc': best_acc, 'epoch': num_epochs}, path)
+
+        stage_flops, stage_params = cost.profile(arch, sketch_rate, args.start_conv, channel_round)
+        rows.append({'stage': index, 'sketch_rate': sketch_rate_str, 'epochs': num_epochs,
+                     'flops_ratio': stage_flops / flops, 'params_ratio': stage_params / params,
+                     'sketch_acc': sketch_acc, 'best_acc': best_acc, 'time': time.time() - stage_time,
+                     'model': path})
+        logger.info('Stage {} Best Accuracy {:.2f}%\tFLOPs {:.2f}%\tParams {:.2f}%'.format(
+            index, best_acc, 100. * rows[-1]['flops_ratio'], 100. * rows[-1]['params_ratio']))
+
+    total_epochs = sum(row['epochs'] for row in rows)
+    with open(os.path.join(args.job_dir, 'progressive.json'), 'w') as f:
+        json.dump({'origin_acc': origin_acc, 'total_epochs': total_epochs, 'time': time.time() - start_time,
+                   'stages': rows}, f, indent=2)
+
+    logger.info('%-32s %8s %10s %10s %10s %10s' % ('Sketch Rate', 'Epochs', 'FLOPs', 'Params', 'Sketch', 'Best'))
+    for row in rows:
+        logger.info('%-32s %8d %9.2f%% %9.2f%% %9.2f%% %9.2f%%' % (
+            row['sketch_rate'], row['epochs'], 100. * row['flops_ratio'], 100. * row['params_ratio'],
+            row['sketch_acc'], row['best_acc']))
+    logger.info('{} epochs in total, best accuracy: {:.3f}'.format(total_epochs, rows[-1]['best_acc']))
+    # Every stage is a model of its own, e.g. to serve them all as tiers of serve.py
+    logger.info('Tiers: ' + ' '.join('--tier stage_{} "{}" {}'.format(row['stage'], row['sketch_rate'], row['model'])
+                                     for row in rows))
+
+if __name__ == '__main__':
+    main()
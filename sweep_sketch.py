@@ -0,0 +1,186 @@
+import torch
+import torch.multiprocessing as mp
+import argparse
+import csv
+import json
+import os
+import queue
+import time
+
+import torchvision.datasets as datasets
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+import utils.common as utils
+from utils.channel import get_channel_round
+import utils.cost as cost
+import utils.sketch as sketch
+from utils.finetune import fine_tune
+from utils.options import base_parser, train_parser, sketch_parser
+from utils.registry import get_arch
+
+parser = argparse.ArgumentParser(description='Sketch and fine-tune a list of sketch rates on CIFAR-10',
+                                 parents=[base_parser, train_parser, sketch_parser])
+
+parser.add_argument(
+    '--workers',
+    type=int,
+    default=2,
+    help='The number of CPU worker processes when no GPU is available. default:2')
+
+parser.add_argument(
+    '--sketch_rates',
+    type=str,
+    nargs='+',
+    required=True,
+    help='The sketch rates to sweep, one config each, e.g. [0.6]*27 [0.5]*27')
+
+args = parser.parse_args()
+
+arch = get_arch(args.arch, args.cfg, 'cifar10')
+channel_round = get_channel_round(args.channel_round)
+
+def get_data_set():
+    transform_train = transforms.Compose([
+        transforms.RandomCrop(32, padding=4),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+    ])
+    transform_test = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
+    ])
+    trainset = datasets.CIFAR10(root=args.data_path, train=True, download=True, transform=transform_train)
+    testset = datasets.CIFAR10(root=args.data_path, train=False, download=False, transform=transform_test)
+    return trainset, testset
+
+def run_job(index, sketch_rate_str, device, oristate_dict, trainLoader, testLoader):
+    name = 'config_{}'.format(index)
+    job_dir = os.path.join(args.job_dir, name)
+    if not os.path.exists(job_dir):
+        os.makedirs(job_dir)
+    # A logger of its own for each config, workers run several configs in one process
+    logger = utils.get_logger(os.path.join(job_dir, 'logger.log'), name, '%(asctime)s | ' + name + ' | %(message)s')
+    start_time = time.time()
+
+    sketch_rate = utils.get_sketch_rate(sketch_rate_str)
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
+    state_dict = sketch.sketch_state_dict(arch, model, oristate_dict, weight_norm_method=args.weight_norm_method,
+                                          dtype=torch.float64 if args.sketch_fp64 else None)
+    model.load_state_dict(state_dict)
+    sketch_acc = utils.evaluate(model, testLoader, device)[0]
+    logger.info('After Sketch Accuracy {:.2f}%'.format(sketch_acc))
+
+    def save(state_dict, best_acc, epoch):
+        torch.save({'state_dict': state_dict, 'best_acc': best_acc, 'epoch': epoch},
+                   os.path.join(job_dir, 'model_best.pt'))
+
+    best_acc = fine_tune(model, trainLoader, testLoader, args, device, logger, save=save)
+
+    flops, params = cost.profile(arch, sketch_rate, args.start_conv, channel_round)
+    logger.info('Best accuracy: {:.3f}'.format(best_acc))
+    utils.close_logger(name)
+    return {'index': index, 'sketch_rate': sketch_rate_str, 'flops': flops, 'params': params,
+            'sketch_acc': sketch_acc, 'best_acc': best_acc, 'time': time.time() - start_time, 'job_dir': job_dir}
+
+def worker(device, cores, oristate_dict, trainset, testset, jobs, results):
+    if device == 'cpu':
+        # The CPU worker processes are pinned to disjoint cores instead of each oversubscribing all of them
+        utils.set_threads(args.num_threads, args.interop_threads, cores)
+    else:
+        utils.set_threads(args.num_threads, args.interop_threads)
+        torch.cuda.set_device(device)
+    oristate_dict = {k: v.to(device) for k, v in oristate_dict.items()}
+    trainLoader = DataLoader(trainset, batch_size=args.train_batch_size, shuffle=True, num_workers=2,
+                             pin_memory=device != 'cpu')
+    testLoader = DataLoader(testset, batch_size=args.eval_batch_size, shuffle=False, num_workers=2,
+                            pin_memory=device != 'cpu')
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        results.put(run_job(*job, device, oristate_dict, trainLoader, testLoader))
+
+def main():
+    if args.sketch_model is None or not os.path.exists(args.sketch_model):
+        raise ValueError('Sketch model path should be exist!')
+    for sketch_rate in args.sketch_rates:
+        num_rates = len(utils.get_sketch_rate(sketch_rate))
+        if num_rates != arch.num_rates(args.start_conv):
+            raise ValueError('Sketch rate {} has {} rates, {} expects {}'.format(
+                sketch_rate, num_rates, args.cfg, arch.num_rates(args.start_conv)))
+    if not os.path.exists(args.job_dir):
+        os.makedirs(args.job_dir)
+
+    # The checkpoint, the dataset and the original accuracy are shared by all configs
+    print('==> Preparing data..')
+    trainset, testset = get_data_set()
+    devices = ['cuda:{}'.format(gpu) for gpu in args.gpus] if torch.cuda.is_available() else ['cpu'] * args.workers
+
+    print('==> Building model..')
+    ckpt = torch.load(args.sketch_model, map_location='cpu')
+    origin_model = arch.build().to(devices[0])
+    origin_model.load_state_dict(ckpt['state_dict'] if 'state_dict' in ckpt else ckpt)
+    testLoader = DataLoader(testset, batch_size=args.eval_batch_size, shuffle=False, num_workers=2)
+    origin_acc = utils.evaluate(origin_model, testLoader, devices[0])[0]
+    print('Origin Accuracy {:.2f}%'.format(origin_acc))
+    oristate_dict = {k: v.cpu() for k, v in origin_model.state_dict().items()}
+    del origin_model
+
+    context = mp.get_context('spawn')
+    jobs, results = context.Queue(), context.Queue()
+    for index, sketch_rate in enumerate(args.sketch_rates):
+        jobs.put((index, sketch_rate))
+    devices = devices[:len(args.sketch_rates)]
+    cores = [None] * len(devices)
+    if devices[0] == 'cpu':
+        cores = utils.split_cores(len(devices), utils.parse_cores(args.cpu_cores) if args.cpu_cores else None)
+        print('==> CPU workers pinned to cores {}'.format(' | '.join(
+            ','.join(str(core) for core in block) for block in cores)))
+    processes = []
+    for device, device_cores in zip(devices, cores):
+        jobs.put(None)
+        process = context.Process(target=worker, args=(device, device_cores, oristate_dict, trainset, testset,
+                                                       jobs, results))
+        process.start()
+        processes.append(process)
+
+    rows = []
+    while len(rows) < len(args.sketch_rates):
+        try:
+            row = results.get(timeout=60)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                raise RuntimeError('All sweep workers exited with {} configs left'.format(
+                    len(args.sketch_rates) - len(rows)))
+            continue
+        rows.append(row)
+        print('==> Done {} ({}/{}): Best Accuracy {:.2f}%'.format(
+            row['sketch_rate'], len(rows), len(args.sketch_rates), row['best_acc']))
+    for process in processes:
+        process.join()
+
+    rows.sort(key=lambda row: row['index'])
+    flops, params = cost.profile(arch, None, args.start_conv)
+    fields = ['sketch_rate', 'flops', 'flops_ratio', 'params', 'params_ratio', 'sketch_acc', 'best_acc', 'time',
+              'job_dir']
+    for row in rows:
+        row['flops_ratio'] = row['flops'] / flops
+        row['params_ratio'] = row['params'] / params
+    with open(os.path.join(args.job_dir, 'sweep.json'), 'w') as f:
+        json.dump({'origin_acc': origin_acc, 'flops': flops, 'params': params,
+                   'results': [{k: row[k] for k in fields} for row in rows]}, f, indent=2)
+    with open(os.path.join(args.job_dir, 'sweep.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print('%-32s %10s %10s %10s %10s' % ('Sketch Rate', 'FLOPs', 'Params', 'Sketch', 'Best'))
+    print('%-32s %10s %10s %10s %9.2f%%' % ('origin', '100.00%', '100.00%', '-', origin_acc))
+    for row in rows:
+        print('%-32s %9.2f%% %9.2f%% %9.2f%% %9.2f%%' % (
+            row['sketch_rate'], 100. * row['flops_ratio'], 100. * row['params_ratio'],
+            row['sketch_acc'], row['best_acc']))
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,17 @@ import torch
 import torch.nn as nn
 from utils.options import args
 import utils.common as utils
+from utils.channel import get_channel_round
+import utils.shrink as shrink
+from utils.registry import get_arch
+from utils.profiler import StepProfiler
 
+import os
 import time
 from data import cifar10, imagenet_dali, imagenet
-from importlib import import_module
 
 device = torch.device(f"cuda:{args.gpus[0]}") if torch.cuda.is_available() else 'cpu'
+utils.set_threads(args.num_threads, args.interop_threads, args.cpu_cores)
 loss_func = nn.CrossEntropyLoss()
 
 # Data
@@ -21,7 +26,7 @@ else: #imagenet
     else:
         testLoader = imagenet.Data(args).testLoader
 
-def test(model, topk=(1,)):
+def test(model, topk=(1,), profiler=None):
     model.eval()
 
     losses = utils.AverageMeter()
@@ -39,6 +44,8 @@ def test(model, topk=(1,)):
                 targets = batch_data[1]
                 inputs, targets = inputs.to(device), targets.to(device)
             outputs = model(inputs)
+            if profiler is not None:
+                profiler.step()
             loss = loss_func(outputs, targets)
 
             losses.update(loss.item(), inputs.size(0))
@@ -65,21 +72,21 @@ def main():
     # Model
     print('==> Building model..')
     sketch_rate = utils.get_sketch_rate(args.sketch_rate)
-    if args.arch == 'resnet':
-        if args.data_set == 'cifar10':
-            model = import_module(f'model.{args.arch}')\
-                            .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=args.start_conv).to(device)
-        else:
-            model = import_module(f'model.{args.arch}_imagenet') \
-                .resnet(args.cfg, sketch_rate=sketch_rate, start_conv=args.start_conv).to(device)
-    elif args.arch == 'googlenet':
-        model = import_module(f'model.{args.arch}').googlenet(sketch_rate).to(device)
-    else:
-        raise('arch not exist!')
+    channel_round = get_channel_round(args.channel_round)
+    arch = get_arch(args.arch, args.cfg, args.data_set)
+    model = arch.build(sketch_rate, start_conv=args.start_conv, channel_round=channel_round).to(device)
     ckpt = torch.load(args.sketch_model, map_location=device)
+    if 'widths' in ckpt:
+        shrink.resize(arch, model, ckpt['widths'])
     model.load_state_dict(ckpt['state_dict'])
 
-    test(model, topk=(1, 5) if args.data_set == 'imagenet' else (1, ))
+    profiler = None
+    if args.profile is not None:
+        profiler = StepProfiler(model, args.profile, os.path.join(args.job_dir, 'profile'), args.profile_steps,
+                                device=device)
+    test(model, topk=(1, 5) if args.data_set == 'imagenet' else (1, ), profiler=profiler)
+    if profiler is not None:
+        profiler.finish()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('torch')
+
+import utils.common as utils
+
+
+def test_parse_cores():
+    assert utils.parse_cores('0-3,8') == [0, 1, 2, 3, 8]
+    assert utils.parse_cores('5') == [5]
+    assert utils.parse_cores('2-2,4-5,') == [2, 4, 5]
+
+def test_split_cores():
+    assert utils.split_cores(3, list(range(8))) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert utils.split_cores(2, utils.parse_cores('0-1,8-9')) == [[0, 1], [8, 9]]
+    assert utils.split_cores(1, [3, 7]) == [[3, 7]]
+
+def test_split_cores_needs_a_core_per_job():
+    with pytest.raises(ValueError):
+        utils.split_cores(3, [0, 1])
+
+def test_get_logger_does_not_duplicate_lines(tmp_path):
+    path = str(tmp_path / 'logger.log')
+    for _ in range(3):
+        logger = utils.get_logger(path, 'test_common')
+    logger.info('once')
+    other_path = str(tmp_path / 'other.log')
+    utils.get_logger(other_path, 'test_common').info('moved')
+    utils.close_logger('test_common')
+    with open(path) as f:
+        assert [line.split(' | ', 1)[1] for line in f.read().splitlines()] == ['once']
+    with open(other_path) as f:
+        assert [line.split(' | ', 1)[1] for line in f.read().splitlines()] == ['moved']
@@ -0,0 +1,38 @@
+import pytest
+
+from utils import cost
+from utils.registry import get_arch
+
+
+def resnet56_cost(rate):
+    """FLOPs and params of ResNet-56 on CIFAR-10 counted by hand, one conv at a time"""
+    flops = 32 * 32 * 16 * 3 * 9
+    params = 16 * 3 * 9 + 2 * 16
+    inplanes, size = 16, 32
+    for stage, planes in enumerate([16, 32, 64]):
+        for i in range(9):
+            if stage > 0 and i == 0:
+                size //= 2
+            middle = int(planes * rate)
+            conv_params = middle * inplanes * 9 + planes * middle * 9
+            flops += size * size * conv_params
+            params += conv_params + 2 * middle + 2 * planes
+            inplanes = planes
+    flops += 64 * 10 + 10
+    params += 64 * 10 + 10
+    return flops, params
+
+@pytest.mark.parametrize('rate', [1.0, 0.5, 0.3])
+def test_resnet56_cost_matches_hand_count(rate):
+    arch = get_arch('resnet', 'resnet56', 'cifar10')
+    assert cost.profile(arch, [rate] * arch.num_rates(1)) == resnet56_cost(rate)
+
+def test_resnet56_cost_matches_paper():
+    flops, params = cost.profile(get_arch('resnet', 'resnet56', 'cifar10'))
+    assert round(flops / 1e6, 2) == 125.49
+    assert round(params / 1e6, 2) == 0.85
+
+def test_cost_model_matches_profile():
+    arch = get_arch('resnet', 'resnet56', 'cifar10')
+    sketch_rate = [0.7] * 9 + [0.5] * 9 + [0.3] * 9
+    assert cost.CostModel(arch)(sketch_rate)[:2] == cost.profile(arch, sketch_rate)
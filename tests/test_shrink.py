@@ -0,0 +1,61 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+import torch.nn as nn
+
+import utils.shrink as shrink
+from utils.registry import Arch, SketchLayer, Unit
+
+
+class Toy(nn.Module):
+    def __init__(self):
+        super(Toy, self).__init__()
+        self.conv1 = nn.Conv2d(3, 8, 3, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(8)
+        self.conv2 = nn.Conv2d(8, 4, 3, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(4)
+
+    def forward(self, x):
+        return self.bn2(self.conv2(torch.relu(self.bn1(self.conv1(x)))))
+
+arch = Arch('toy', lambda *args, **kwargs: Toy(),
+            [Unit('block', [SketchLayer('conv1', 'bn1', True, False), SketchLayer('conv2', 'bn2', False, True)])],
+            None, 8)
+
+def toy_model():
+    torch.manual_seed(0)
+    model = Toy()
+    with torch.no_grad():
+        for bn in (model.bn1, model.bn2):
+            bn.running_mean.uniform_(-1, 1)
+            bn.running_var.uniform_(0.5, 2)
+            bn.weight.uniform_(0.5, 2)
+            bn.bias.uniform_(-1, 1)
+        # Filters 1 and 5 are zero with a negative constant output, the next conv does not use channel 3
+        model.conv1.weight[[1, 5]] = 0
+        model.bn1.running_mean[[1, 5]] = 0
+        model.bn1.bias[[1, 5]] = -1
+        model.conv2.weight[:, 3] = 0
+    return model.eval()
+
+def test_removing_zero_filters_keeps_outputs():
+    model = toy_model()
+    inputs = torch.randn(4, 3, 8, 8)
+    with torch.no_grad():
+        outputs = model(inputs)
+    keep = shrink.removable_channels(arch, model)
+    assert keep == {'conv1': [0, 2, 4, 6, 7]}
+    shrink.remove_channels(arch, model, keep)
+    assert model.conv1.out_channels == model.bn1.num_features == model.conv2.in_channels == 5
+    with torch.no_grad():
+        assert torch.allclose(model(inputs), outputs, atol=1e-6)
+
+def test_resize_loads_shrunk_state_dict():
+    model = toy_model()
+    keep = shrink.removable_channels(arch, model)
+    shrink.remove_channels(arch, model, keep)
+    resized = shrink.resize(arch, Toy(), shrink.channel_widths(model, keep)).eval()
+    resized.load_state_dict(model.state_dict())
+    inputs = torch.randn(4, 3, 8, 8)
+    with torch.no_grad():
+        assert torch.equal(resized(inputs), model(inputs))
@@ -0,0 +1,46 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import utils.sketch as sketch
+from utils.fidelity import sketch_fidelity
+
+
+def sketch_error(weight, l, dim):
+    B = sketch.sketch_matrix(weight, l, dim)
+    assert B.size() == weight.size()[:dim] + (l,) + weight.size()[dim + 1:]
+    A = weight.transpose(0, dim).reshape(weight.size(dim), -1)
+    return sketch_fidelity(A, B.transpose(0, dim).reshape(l, -1))[0]
+
+@pytest.mark.parametrize('dim, l', [(0, 16), (0, 8), (1, 16), (1, 8)])
+def test_covariance_guarantee(dim, l):
+    # ||A^T A - B^T B||_2 <= 2 ||A||_F^2 / l, for the filters and the channels of an out x in x k x k weight
+    weight = torch.randn(64, 32, 3, 3, generator=torch.Generator().manual_seed(0))
+    assert sketch_error(weight, l, dim) <= 2.0 / l
+
+def test_channel_sketch_keeping_all_channels_is_exact():
+    weight = torch.randn(64, 32, 3, 3, generator=torch.Generator().manual_seed(0))
+    assert torch.allclose(sketch.sketch_matrix(weight, 32, 1), weight)
+
+@pytest.mark.parametrize('chunk_rows', [1, 7, 64, 1000])
+def test_chunked_sketch_matches_in_memory(tmp_path, chunk_rows):
+    np = pytest.importorskip('numpy')
+    A = torch.randn(300, 48, generator=torch.Generator().manual_seed(0))
+    B = sketch.frequent_directions([A], 16, 48, 300)
+    path = str(tmp_path / 'A.bin')
+    A.numpy().astype(np.float32).tofile(path)
+    assert torch.allclose(sketch.sketch_stream(sketch.memmap_chunks(path, (300, 48), chunk_rows=chunk_rows),
+                                               16, 48, 300), B, atol=1e-5)
+    assert torch.allclose(sketch.frequent_directions((A[i:i + chunk_rows] for i in range(0, 300, chunk_rows)),
+                                                     16, 48, 300), B, atol=1e-5)
+
+@pytest.mark.parametrize('m', [16, 200])
+def test_fidelity_matches_dense_covariance(m):
+    # m = 16 uses the m x m Gram matrices, m = 200 the row space of the 40 stacked rows
+    generator = torch.Generator().manual_seed(0)
+    A = torch.randn(32, m, generator=generator, dtype=torch.float64)
+    B = torch.randn(8, m, generator=generator, dtype=torch.float64)
+    norm = A.pow(2).sum()
+    cov_error = torch.linalg.matrix_norm(A.t().mm(A) - B.t().mm(B), 2) / norm
+    energy = A.mm(torch.linalg.pinv(B).mm(B)).pow(2).sum() / norm
+    assert sketch_fidelity(A, B) == pytest.approx((cov_error.item(), energy.item()), rel=1e-9)
@@ -0,0 +1,35 @@
+import json
+
+
+def get_channel_round(channel_round):
+    """Parse a --channel_round policy.
+
+    None keeps the exact int(channels * rate) widths, an integer such as '8'
+    rounds them to the nearest multiple, and 'lut:<path>' picks the fastest
+    nearby width from a latency lookup table written by get_latency.py.
+    """
+    if channel_round is None or channel_round == 'none':
+        return None
+    if channel_round.startswith('lut:'):
+        with open(channel_round[len('lut:'):]) as f:
+            return json.load(f)
+    return int(channel_round)
+
+def pruned_width(channels, rate, channel_round=None):
+    """The width of a sketched layer of the given original width"""
+    width = int(channels * rate)
+    if channel_round is None or width == channels:
+        return width
+
+    if isinstance(channel_round, dict):
+        # Among the measured widths within 1/8 of the target, take the fastest, the nearest on ties
+        latency = channel_round.get(str(channels), {})
+        tolerance = max(1, width // 8)
+        candidates = [(t, abs(int(w) - width), int(w)) for w, t in latency.items()
+                      if abs(int(w) - width) <= tolerance]
+        return min(candidates)[2] if candidates else width
+
+    if channels <= channel_round:  # no smaller multiple exists
+        return width
+    rounded = max(channel_round, int(width / channel_round + 0.5) * channel_round)
+    return min(rounded, channels)
@@ -1,11 +1,18 @@
 from __future__ import absolute_import
+import atexit
 import datetime
+import functools
+import hashlib
+import math
 import shutil
 from pathlib import Path
 import os
+import queue
+from statistics import NormalDist
 
 import torch
 import logging
+import logging.handlers
 
 
 class AverageMeter(object):
@@ -44,8 +51,9 @@ class checkpoint():
         _make_dir(self.ckpt_dir)
         _make_dir(self.run_dir)
 
+        # Every launch in job_dir is appended, resumed runs keep the config of the first one
         config_dir = self.job_dir / 'config.txt'
-        with open(config_dir, 'w') as f:
+        with open(config_dir, 'a') as f:
             f.write(now + '\n\n')
             for arg in vars(args):
                 f.write('{}: {}\n'.format(arg, getattr(args, arg)))
@@ -58,22 +66,61 @@ class checkpoint():
             shutil.copyfile(save_path, f'{self.ckpt_dir}/model_best.pt')
 
 
-def get_logger(file_path):
-    logger = logging.getLogger('gal')
-    log_format = '%(asctime)s | %(message)s'
+_listeners = {}
+
+
+def get_logger(file_path, name='gal', log_format='%(asctime)s | %(message)s'):
+    """The logger name writing to file_path and the console.
+
+    The training loop only puts records on a queue, a QueueListener thread
+    formats and writes them. Calling it again with the same file_path returns
+    the same logger without adding handlers, with another file_path the
+    logger is moved to it.
+    """
+    logger = logging.getLogger(name)
+    file_path = os.path.abspath(file_path)
+    if name in _listeners:
+        if _listeners[name][0] == file_path:
+            return logger
+        close_logger(name)
+
     formatter = logging.Formatter(log_format, datefmt='%m/%d %I:%M:%S %p')
     file_handler = logging.FileHandler(file_path)
     file_handler.setFormatter(formatter)
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    _listeners[name] = (file_path, listener)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
     logger.setLevel(logging.INFO)
+    logger.propagate = False
 
     return logger
 
 
+def close_logger(name='gal'):
+    """Flush the records of a logger from get_logger and close its file"""
+    if name not in _listeners:
+        return
+    _, listener = _listeners.pop(name)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+
+
+@atexit.register
+def _close_loggers():
+    for name in list(_listeners):
+        close_logger(name)
+
+
 def accuracy(output, target, topk=(1,)):
     """Computes the precision@k for the specified values of k"""
     with torch.no_grad():
@@ -90,6 +137,36 @@ def accuracy(output, target, topk=(1,)):
             res.append(correct_k.mul_(100.0 / batch_size))
         return res
 
+
+def evaluate(model, loader, device, topk=(1,)):
+    """Top-k accuracies of a model on a loader of (inputs, targets) batches"""
+    model.eval()
+    meters = [AverageMeter() for _ in topk]
+    with torch.no_grad():
+        for inputs, targets in loader:
+            inputs, targets = inputs.to(device), targets.to(device)
+            for meter, acc in zip(meters, accuracy(model(inputs), targets, topk=topk)):
+                meter.update(acc.item(), inputs.size(0))
+    return [meter.avg for meter in meters]
+
+
+def wilson_interval(acc, total, confidence=0.95):
+    """Wilson score interval of an accuracy in percent measured on total samples"""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = acc / 100.
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return 100. * max(center - half, 0.), 100. * min(center + half, 1.)
+
+
+def scale_lr(lr, batch_size, accum_steps=1, lr_batch_size=None):
+    """Linear scaling rule, lr is given for lr_batch_size images and an optimizer step sees batch_size * accum_steps"""
+    if lr_batch_size is None:
+        return lr
+    return lr * batch_size * accum_steps / lr_batch_size
+
+
 def get_sketch_rate(sketch_rate):
     import re
 
@@ -108,4 +185,117 @@ def get_sketch_rate(sketch_rate):
         assert len(find_cprate) == 1
         cprate += [float(find_cprate[0])] * num
 
-    return cprate
\ No newline at end of file
+    return cprate
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(path, mtime, size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    """SHA-1 of the content of a file, computed once per version of the file"""
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def sketch_metadata(args, sketch_rate=None):
+    """What a model was sketched with, saved next to its state_dict for incremental re-sketching"""
+    return {'arch': args.arch, 'cfg': args.cfg, 'sketch_model': os.path.abspath(args.sketch_model),
+            'sketch_model_hash': file_hash(args.sketch_model),
+            'sketch_rate': get_sketch_rate(sketch_rate if sketch_rate is not None else args.sketch_rate),
+            'start_conv': args.start_conv,
+            'channel_round': args.channel_round, 'weight_norm_method': args.weight_norm_method,
+            'sketch_fp64': args.sketch_fp64}
+
+
+def check_resketch(metadata, current):
+    """Raise if a checkpoint with metadata can not warm start a sketch with the current metadata.
+
+    Both must be sketched from the same pretrained model (by content) with the same settings, only the
+    sketch rates may differ.
+    """
+    if metadata is None:
+        raise ValueError('The checkpoint has no sketch metadata to re-sketch from!')
+    for key in ('arch', 'cfg', 'sketch_model_hash', 'start_conv', 'channel_round', 'weight_norm_method',
+                'sketch_fp64'):
+        if metadata.get(key) != current[key]:
+            raise ValueError('Can not re-sketch incrementally, {} was {} and is {}!'.format(
+                key, metadata.get(key), current[key]))
+
+
+def format_sketch_rate(sketch_rate):
+    """Inverse of get_sketch_rate, e.g. [0.9, 0.9, 0.4] -> '[0.9]*2+[0.4]'"""
+    segments = []
+    for rate in sketch_rate:
+        rate = float(rate)
+        if segments and segments[-1][0] == rate:
+            segments[-1][1] += 1
+        else:
+            segments.append([rate, 1])
+    return '+'.join('[{}]*{}'.format(rate, num) if num > 1 else '[{}]'.format(rate)
+                    for rate, num in segments)
+
+
+def progressive_sketch_rates(sketch_rate, num_stages):
+    """Sketch rates of num_stages stages shrinking geometrically to sketch_rate, the last one is sketch_rate"""
+    stages = []
+    for stage in range(1, num_stages):
+        stages.append([round(float(rate) ** (stage / num_stages), 2) for rate in sketch_rate])
+    return stages + [list(sketch_rate)]
+
+
+def parse_cores(cores):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    result = []
+    for part in cores.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            result += list(range(int(start), int(end) + 1))
+        elif part:
+            result.append(int(part))
+    return result
+
+
+def available_cores():
+    """The cores this process may run on"""
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+
+
+def split_cores(num_jobs, cores=None):
+    """Disjoint blocks of the cores for num_jobs jobs sharing a host, the first blocks one core larger"""
+    cores = cores if cores is not None else available_cores()
+    if num_jobs > len(cores):
+        raise ValueError('Can not split {} cores among {} jobs'.format(len(cores), num_jobs))
+    size, extra = divmod(len(cores), num_jobs)
+    blocks, start = [], 0
+    for job in range(num_jobs):
+        end = start + size + (1 if job < extra else 0)
+        blocks.append(cores[start:end])
+        start = end
+    return blocks
+
+
+def set_threads(num_threads=None, interop_threads=None, cores=None):
+    """Pin the process to cores and set the torch intra-op and inter-op threads.
+
+    With cores and no num_threads, one intra-op thread runs per core. Must be
+    called before the first parallel torch op, inter-op threads can not be
+    changed afterwards.
+    """
+    if isinstance(cores, str):
+        cores = parse_cores(cores)
+    if cores:
+        if not hasattr(os, 'sched_setaffinity'):
+            raise ValueError('Pinning to CPU cores is not supported on this platform!')
+        os.sched_setaffinity(0, cores)
+        num_threads = num_threads or len(cores)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if interop_threads is not None:
+        torch.set_interop_threads(interop_threads)
+    return torch.get_num_threads()
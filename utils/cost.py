@@ -0,0 +1,89 @@
+from collections import namedtuple
+
+# One weighted layer of a model. out_size is the number of output pixels of a
+# convolution (1 for a linear layer).
+Layer = namedtuple('Layer', ['name', 'type', 'in_channels', 'out_channels', 'kernel_size',
+                             'groups', 'out_size', 'bias'])
+
+def conv_out(size, kernel_size, stride, padding):
+    return (size + 2 * padding - kernel_size) // stride + 1
+
+def conv(name, in_channels, out_channels, kernel_size, size, bias=False, groups=1):
+    return Layer(name, 'conv', in_channels, out_channels, kernel_size, groups, size * size, bias)
+
+def bn(name, channels, size):
+    return Layer(name, 'bn', channels, channels, 1, channels, size * size, True)
+
+def linear(name, in_features, out_features):
+    return Layer(name, 'linear', in_features, out_features, 1, 1, 1, True)
+
+def layer_cost(layer, bytes_per_element=4):
+    """FLOPs, params and output activation bytes of one layer for a single image.
+
+    FLOPs count the multiply-accumulates of convolution and linear layers (plus
+    the bias add), which is what thop reports for them. BN and pooling are not
+    counted as FLOPs, BN folds into the preceding convolution at inference.
+    """
+    params = layer.out_channels * (layer.in_channels // layer.groups) * layer.kernel_size * layer.kernel_size
+    if layer.type == 'bn':
+        params = 2 * layer.out_channels
+        flops = 0
+    else:
+        flops = layer.out_size * (params + (layer.out_channels if layer.bias else 0))
+        params += layer.out_channels if layer.bias else 0
+    activation = layer.out_size * layer.out_channels * bytes_per_element
+    return flops, params, activation
+
+def get_cost(layers):
+    """Total FLOPs, params and activation bytes of a list of layers"""
+    flops, params, activation = 0, 0, 0
+    for layer in layers:
+        f, p, a = layer_cost(layer)
+        flops += f
+        params += p
+        activation += a
+    return flops, params, activation
+
+def profile(arch, sketch_rate=None, start_conv=1, channel_round=None, input_size=None):
+    """Analytic replacement of thop.profile for a registered architecture, returns (flops, params)"""
+    flops, params, _ = get_cost(arch.get_layers(sketch_rate, start_conv, channel_round, input_size))
+    return flops, params
+
+class CostModel():
+    """Cost of many rate vectors of one model, e.g. for a sketch rate search.
+
+    The widths of a unit only depend on its own rate, so for an additive
+    architecture the cost of a rate vector is the unsketched cost plus the
+    change of each unit at its rate. These changes are computed once per
+    (unit, rate) and then looked up.
+    """
+
+    def __init__(self, arch, start_conv=1, channel_round=None):
+        self.arch = arch
+        self.start_conv = start_conv
+        self.channel_round = channel_round
+        self.num_rates = arch.num_rates(start_conv)
+        self.base = get_cost(arch.get_layers([1.0] * self.num_rates, start_conv, channel_round))
+        self.delta = {}
+
+    def unit_delta(self, i, rate):
+        key = (i, rate)
+        if key not in self.delta:
+            sketch_rate = [1.0] * self.num_rates
+            sketch_rate[i] = rate
+            cost = get_cost(self.arch.get_layers(sketch_rate, self.start_conv, self.channel_round))
+            self.delta[key] = tuple(c - b for c, b in zip(cost, self.base))
+        return self.delta[key]
+
+    def __call__(self, sketch_rate):
+        """(flops, params, activation bytes) of a rate vector"""
+        if not self.arch.additive:
+            return get_cost(self.arch.get_layers(sketch_rate, self.start_conv, self.channel_round))
+        flops, params, activation = self.base
+        for i, rate in enumerate(sketch_rate):
+            if rate != 1.0:
+                f, p, a = self.unit_delta(i, rate)
+                flops += f
+                params += p
+                activation += a
+        return flops, params, activation
@@ -0,0 +1,50 @@
+import hashlib
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def distill_loss(outputs, teacher_outputs, targets, temperature=4.0, alpha=0.9):
+    """Hinton's knowledge distillation loss, softened KL to the teacher plus cross-entropy to the labels"""
+    kd = F.kl_div(F.log_softmax(outputs / temperature, dim=1), F.softmax(teacher_outputs / temperature, dim=1),
+                  reduction='batchmean') * temperature * temperature
+    return alpha * kd + (1. - alpha) * F.cross_entropy(outputs, targets)
+
+class LogitCache():
+    """Teacher logits of every training sample, in an fp16 memory-mapped .npy file.
+
+    The teacher sees the un-augmented view of each sample once, the student
+    then looks the logits up by sample index at every epoch. The cache is keyed
+    by the teacher checkpoint, the dataset path and the number of samples, so
+    a job_dir reused with another teacher or dataset builds a new one.
+    """
+
+    def __init__(self, cache_dir, teacher_model_path, data_path, num_samples, num_classes):
+        stat = os.stat(teacher_model_path)
+        key = '{}|{}|{}|{}|{}'.format(os.path.abspath(teacher_model_path), stat.st_mtime, os.path.abspath(data_path),
+                                      num_samples, num_classes)
+        self.path = os.path.join(cache_dir, 'teacher_logits_{}.npy'.format(hashlib.md5(key.encode()).hexdigest()))
+        self.shape = (num_samples, num_classes)
+        self.logits = None
+        if os.path.exists(self.path):
+            self.logits = np.load(self.path, mmap_mode='r')
+
+    def build(self, teacher, loader, device):
+        """loader yields (inputs, targets, indices) of the un-augmented training set"""
+        if self.logits is not None:
+            return
+        logits = np.lib.format.open_memmap(self.path + '.tmp', mode='w+', dtype=np.float16, shape=self.shape)
+        teacher.eval()
+        with torch.no_grad():
+            for inputs, _, indices in loader:
+                outputs = teacher(inputs.to(device))
+                logits[indices.numpy()] = outputs.half().cpu().numpy()
+        logits.flush()
+        del logits
+        # Only a complete cache gets its final name
+        os.replace(self.path + '.tmp', self.path)
+        self.logits = np.load(self.path, mmap_mode='r')
+
+    def __getitem__(self, indices):
+        return torch.from_numpy(self.logits[indices.numpy()].astype(np.float32))
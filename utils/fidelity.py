@@ -0,0 +1,66 @@
+import csv
+import json
+import torch
+
+
+def sketch_fidelity(A, B):
+    """Covariance error ||A^T A - B^T B||_2 / ||A||_F^2 and retained energy ||A P_B||_F^2 / ||A||_F^2.
+
+    Both come from one symmetric matrix, of size m x m or, in the basis of the
+    row space of the stacked rows, (n + l) x (n + l), whichever is smaller.
+    """
+    A = A.double()
+    B = B.double()
+    n, m = A.size()
+    if m <= n + B.size(0):
+        gram_A = A.t().mm(A)
+        gram_B = B.t().mm(B)
+        norm = gram_A.trace()
+        cov_error = torch.linalg.eigvalsh(gram_A - gram_B).abs().max()
+        # trace(A^T A P_B), P_B = B^T (B B^T)^+ B projects onto the row space of B
+        energy = (torch.linalg.pinv(B).mm(B) * gram_A).sum()
+    else:
+        # [A; B]^T = Q R, so A = R_A^T Q^T, B = R_B^T Q^T and A^T A - B^T B = Q (R_A R_A^T - R_B R_B^T) Q^T
+        R = torch.linalg.qr(torch.cat([A, B], 0).t(), mode='r')[1]
+        R_A, R_B = R[:, :n], R[:, n:]
+        norm = (R_A * R_A).sum()
+        cov_error = torch.linalg.eigvalsh(R_A.mm(R_A.t()) - R_B.mm(R_B.t())).abs().max()
+        gram_AB, gram_B = R_A.t().mm(R_B), R_B.t().mm(R_B)
+        energy = (gram_AB.mm(torch.linalg.pinv(gram_B)) * gram_AB).sum()
+    norm = max(norm.item(), 1e-12)
+    return cov_error.item() / norm, energy.item() / norm
+
+class SketchReport():
+    """Fidelity, wall time and memory of every sketched matrix, see sketch.sketch_unit"""
+
+    fields = ['layer', 'dim', 'n', 'm', 'l', 'cov_error', 'cov_bound', 'retained_energy', 'time', 'peak_memory',
+              'memory_estimate']
+
+    def __init__(self):
+        self.rows = []
+
+    def record(self, layer, dim, A, B, elapsed, peak_memory, memory_estimate):
+        cov_error, energy = sketch_fidelity(A, B)
+        self.rows.append({'layer': layer, 'dim': 'filter' if dim == 0 else 'channel',
+                          'n': A.size(0), 'm': A.size(1), 'l': B.size(0),
+                          # Frequent Directions shrinking at l/2 guarantees an error of at most 2/l
+                          'cov_error': cov_error, 'cov_bound': 2.0 / B.size(0),
+                          'retained_energy': energy, 'time': elapsed,
+                          # Measured on CUDA when the sketch raises the peak, the estimate is computed from the sizes
+                          'peak_memory': peak_memory, 'memory_estimate': memory_estimate})
+
+    def summary(self):
+        if not self.rows:
+            return 'No layer sketched'
+        return 'Sketched {} matrices in {:.2f}s, max cov error {:.4f}, mean retained energy {:.2f}%'.format(
+            len(self.rows), sum(row['time'] for row in self.rows), max(row['cov_error'] for row in self.rows),
+            100. * sum(row['retained_energy'] for row in self.rows) / len(self.rows))
+
+    def write(self, path):
+        """Write path.json and path.csv"""
+        with open(path + '.json', 'w') as f:
+            json.dump(self.rows, f, indent=2)
+        with open(path + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            writer.writerows(self.rows)
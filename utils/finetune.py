@@ -0,0 +1,130 @@
+import time
+
+import torch.nn as nn
+import torch.optim as optim
+
+from utils.common import AverageMeter, accuracy, evaluate
+from utils.distill import distill_loss
+from utils.schedule import FineTuneSchedule
+
+
+def get_optimizer(model, args, steps_per_epoch, num_epochs=None, time_budget=None):
+    """The SGD optimizer of sketch_cifar.py with its step scheduler and per-step FineTuneSchedule"""
+    num_epochs = args.num_epochs if num_epochs is None else num_epochs
+    optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum, weight_decay=args.weight_decay)
+    scheduler = optim.lr_scheduler.MultiStepLR(optimizer, milestones=args.lr_decay_step, gamma=0.1)
+    schedule = FineTuneSchedule(optimizer, args.lr_schedule, args.lr, num_epochs * steps_per_epoch, time_budget)
+    return optimizer, scheduler, schedule
+
+
+def train(model, optimizer, trainLoader, args, epoch, device, logger, topk=(1,), teacher_logits=None,
+          schedule=None, stopper=None, valLoader=None, telemetry=None,
+          profiler=None, loss_func=nn.CrossEntropyLoss()):
+    """One epoch of the fine-tuning loop of sketch_cifar.py, sweep_sketch.py and sketch_progressive.py.
+
+    Returns True when the fine-tuning budget ran out or the validation subset accuracy plateaued.
+    """
+
+    model.train()
+    losses = AverageMeter()
+    top1_accuracy = AverageMeter()
+    top5_accuracy = AverageMeter()
+    print_freq = max(1, len(trainLoader.dataset) // args.train_batch_size // 10)
+    start_time = time.time()
+    if telemetry is not None:
+        telemetry.start()
+    for batch, batch_data in enumerate(trainLoader):
+        if telemetry is not None:
+            telemetry.mark('data')
+
+        inputs, targets = batch_data[0].to(device), batch_data[1].to(device)
+        optimizer.zero_grad()
+        output = model(inputs)
+        if teacher_logits is not None:
+            loss = distill_loss(output, teacher_logits[batch_data[2]].to(device), targets,
+                                args.distill_temperature, args.distill_alpha)
+        else:
+            loss = loss_func(output, targets)
+        loss.backward()
+        losses.update(loss.item(), inputs.size(0))
+        if telemetry is not None:
+            telemetry.mark('compute')
+        optimizer.step()
+        if schedule is not None:
+            schedule.step()
+        if telemetry is not None:
+            telemetry.mark('optimizer')
+            telemetry.step(inputs.size(0))
+        if profiler is not None:
+            profiler.step()
+
+        prec1 = accuracy(output, targets, topk=topk)
+        top1_accuracy.update(prec1[0], inputs.size(0))
+        if len(topk) == 2:
+            top5_accuracy.update(prec1[1], inputs.size(0))
+
+        if batch % print_freq == 0 and batch != 0:
+            current_time = time.time()
+            cost_time = current_time - start_time
+            if len(topk) == 1:
+                logger.info(
+                    'Epoch[{}] ({}/{}):\t'
+                    'Loss {:.4f}\t'
+                    'Accuracy {:.2f}%\t\t'
+                    'Time {:.2f}s'.format(
+                        epoch, batch * args.train_batch_size, len(trainLoader.dataset),
+                        float(losses.avg), float(top1_accuracy.avg), cost_time
+                    )
+                )
+            else:
+                logger.info(
+                    'Epoch[{}] ({}/{}):\t'
+                    'Loss {:.4f}\t'
+                    'Top1 {:.2f}%\t'
+                    'Top5 {:.2f}%\t'
+                    'Time {:.2f}s'.format(
+                        epoch, batch * args.train_batch_size, len(trainLoader.dataset),
+                        float(losses.avg), float(top1_accuracy.avg), float(top5_accuracy.avg), cost_time
+                    )
+                )
+            start_time = current_time
+            if telemetry is not None:
+                telemetry.log(epoch, loss=losses.avg, accuracy=top1_accuracy.avg, lr=optimizer.param_groups[0]['lr'])
+
+        if stopper is not None and schedule.steps % args.eval_every == 0:
+            val_acc = evaluate(model, valLoader, device)[0]
+            model.train()
+            if telemetry is not None:
+                telemetry.mark('eval')
+            logger.info('Step {}: Subset accuracy {:.2f}%\tlr {:.6f}'.format(
+                schedule.steps, val_acc, optimizer.param_groups[0]['lr']))
+            if stopper.update(val_acc):
+                logger.info('Subset accuracy plateaued, stop fine-tuning')
+                return True
+        if schedule is not None and schedule.finished():
+            logger.info('Fine-tuning budget exhausted, stop fine-tuning')
+            return True
+    return False
+
+
+def fine_tune(model, trainLoader, testLoader, args, device, logger, num_epochs=None, save=None):
+    """Fine-tune for num_epochs (args.num_epochs by default) and test every epoch, returns the best test accuracy.
+
+    save(state_dict, best_acc, epoch) is called on every new best.
+    """
+    num_epochs = args.num_epochs if num_epochs is None else num_epochs
+    optimizer, scheduler, schedule = get_optimizer(model, args, len(trainLoader), num_epochs)
+    best_acc = 0.0
+    for epoch in range(num_epochs):
+        train(model, optimizer, trainLoader, args, epoch, device, logger, schedule=schedule)
+        if args.lr_schedule == 'step':
+            scheduler.step()
+
+        test_acc = evaluate(model, testLoader, device)[0]
+        logger.info('Epoch[{}] Test Accuracy {:.2f}%\tlr {:.6f}'.format(
+            epoch, test_acc, optimizer.param_groups[0]['lr']))
+        if test_acc > best_acc:
+            best_acc = test_acc
+            if save is not None:
+                save(model.state_dict(), best_acc, epoch + 1)
+    return best_acc
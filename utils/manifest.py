@@ -0,0 +1,87 @@
+import atexit
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import torch
+
+
+def git_revision(path=None):
+    """Commit hash of the repository at path and whether its tree has local changes, None outside git"""
+    path = path or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path, stderr=subprocess.DEVNULL)
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path,
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {'commit': commit.decode().strip(), 'dirty': bool(status.strip())}
+
+class RunManifest():
+    """One JSON file per job_dir recording every run in it: args, git revision, environment, metadata and timing.
+
+    Updates are kept in memory and the file is only rewritten (atomically) at
+    the end of a phase, on update(..., flush=True) once per epoch or on
+    write(), never per step. Each launch appends a run to the existing
+    manifest, a run not closed when the process exits is recorded as
+    interrupted.
+    """
+
+    def __init__(self, path, args=None):
+        self.path = path
+        self.runs = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.runs = json.load(f).get('runs', [])
+        self.start_time = time.time()
+        self.run = {'start': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'command': [sys.executable] + sys.argv,
+                    'args': vars(args) if args is not None else {},
+                    'git': git_revision(),
+                    'environment': {'host': platform.node(), 'python': platform.python_version(),
+                                    'torch': torch.__version__,
+                                    'cuda': torch.version.cuda if torch.cuda.is_available() else None},
+                    'status': 'running', 'phases': {}}
+        self.runs.append(self.run)
+        self.closed = False
+        atexit.register(self.close, 'interrupted')
+        self.write()
+
+    def update(self, flush=False, **fields):
+        """Record fields of the run, e.g. sketch_metadata or best_acc, and write the file with flush"""
+        self.run.update(fields)
+        if flush:
+            self.write()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the run, e.g. sketch or fine_tune"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.time() - start_time)
+
+    def record_phase(self, name, seconds):
+        self.run['phases'][name] = self.run['phases'].get(name, 0.0) + seconds
+        self.write()
+
+    def write(self):
+        self.run['elapsed'] = time.time() - self.start_time
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'runs': self.runs}, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+    def close(self, status='finished'):
+        if self.closed:
+            return
+        self.closed = True
+        self.run['status'] = status
+        self.run['end'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self.write()
@@ -1,8 +1,9 @@
 import argparse
 
-parser = argparse.ArgumentParser(description='Filter Sketch')
+# The options shared with sweep_sketch.py and sketch_progressive.py, as parents of their parsers
+base_parser = argparse.ArgumentParser(add_help=False)
 
-parser.add_argument(
+base_parser.add_argument(
     '--gpus',
     type=int,
     nargs='+',
@@ -10,72 +11,85 @@ parser.add_argument(
     help='Select gpu_id to use. default:[0]',
 )
 
-parser.add_argument(
-    '--data_set',
+base_parser.add_argument(
+    '--num_threads',
+    type=int,
+    default=None,
+    help='The number of intra-op CPU threads, one per pinned core with --cpu_cores. default:None (torch default)')
+
+base_parser.add_argument(
+    '--interop_threads',
+    type=int,
+    default=None,
+    help='The number of inter-op CPU threads. default:None (torch default)')
+
+base_parser.add_argument(
+    '--cpu_cores',
     type=str,
-    default='cifar10',
-    help='Select dataset to train. default:cifar10',
-)
+    default=None,
+    help='Pin the process to these CPU cores, split among the CPU workers of sweep_sketch.py, e.g. 0-7,16-23. default:None')
 
-parser.add_argument(
+base_parser.add_argument(
     '--data_path',
     type=str,
     default='/home/lishaojie/data/cifar10/',
     help='The dictionary where the input is stored. default:/home/lishaojie/data/cifar10/',
 )
 
-parser.add_argument(
+base_parser.add_argument(
     '--job_dir',
     type=str,
     default='experiments/',
     help='The directory where the summaries will be stored. default:./experiments')
 
-## Training
-parser.add_argument(
+base_parser.add_argument(
     '--arch',
     type=str,
     default='resnet',
     help='Architecture of model. default:resnet')
 
-parser.add_argument(
+base_parser.add_argument(
     '--cfg',
     type=str,
     default='resnet56',
     help='Detail architecuture of model. default:resnet56'
 )
 
-parser.add_argument(
+## Training
+train_parser = argparse.ArgumentParser(add_help=False)
+
+train_parser.add_argument(
     '--num_epochs',
     type=int,
     default=150,
     help='The num of epochs to train. default:150')
 
-parser.add_argument(
+train_parser.add_argument(
     '--train_batch_size',
     type=int,
     default=128,
     help='Batch size for training. default:128')
 
-parser.add_argument(
+train_parser.add_argument(
     '--eval_batch_size',
     type=int,
     default=100,
     help='Batch size for validation. default:100')
 
-parser.add_argument(
+train_parser.add_argument(
     '--momentum',
     type=float,
     default=0.9,
     help='Momentum for MomentumOptimizer. default:0.9')
 
-parser.add_argument(
+train_parser.add_argument(
     '--lr',
     type=float,
     default=1e-2,
     help='Learning rate for train. default:1e-2'
 )
 
-parser.add_argument(
+train_parser.add_argument(
     '--lr_decay_step',
     type=int,
     nargs='+',
@@ -83,39 +97,199 @@ parser.add_argument(
     help='the iterval of learn rate. default:50, 100'
 )
 
-parser.add_argument(
+train_parser.add_argument(
+    '--lr_schedule',
+    type=str,
+    default='step',
+    choices=('step', 'cosine', 'onecycle'),
+    help='The learning rate schedule of fine-tuning, cosine and onecycle are sized to num_epochs and time_budget. default:step')
+
+train_parser.add_argument(
     '--weight_decay',
     type=float,
     default=5e-4,
     help='The weight decay of loss. default:5e-4')
 
 ## Sketch
-parser.add_argument(
+sketch_parser = argparse.ArgumentParser(add_help=False)
+
+sketch_parser.add_argument(
     '--start_conv',
     type=int,
     default=1,
     help='The index of Conv to start sketch, index starts from 0. default:1'
 )
 
+sketch_parser.add_argument(
+    '--sketch_model',
+    type=str,
+    default=None,
+    help='Path to the model wait for sketch/test. default:None'
+)
+
+sketch_parser.add_argument(
+    '--channel_round',
+    type=str,
+    default=None,
+    help='Round the sketched widths to hardware-friendly sizes. default:None Optional:8, 16, 32, lut:<path>'
+)
+
+sketch_parser.add_argument(
+    '--weight_norm_method',
+    type=str,
+    default=None,
+    help='Select the weight norm method. default:None Optional:l2'
+)
+
+sketch_parser.add_argument(
+    '--sketch_fp64',
+    action='store_true',
+    help='Accumulate the sketch in float64 for numerical stability.'
+)
+
+parser = argparse.ArgumentParser(description='Filter Sketch', parents=[base_parser, train_parser, sketch_parser])
+
 parser.add_argument(
-    '--sketch_rate',
+    '--data_set',
     type=str,
+    default='cifar10',
+    help='Select dataset to train. default:cifar10',
+)
+
+## Training
+parser.add_argument(
+    '--accum_steps',
+    type=int,
+    default=1,
+    help='Accumulate the gradients of this many batches per optimizer step (sketch_imagenet.py). default:1')
+
+parser.add_argument(
+    '--lr_batch_size',
+    type=int,
     default=None,
-    help='The proportion of each layer reserved after sketching convolution layer sketch. default:None'
+    help='The batch size lr is given for, lr is scaled linearly to train_batch_size * accum_steps. default:None (no scaling)')
+
+parser.add_argument(
+    '--checkpoint_stages',
+    action='store_true',
+    help='Recompute the activations of layer1-layer4 of ResNet in the backward pass to save memory (sketch_imagenet.py).')
+
+parser.add_argument(
+    '--time_budget',
+    type=float,
+    default=None,
+    help='The wall-clock budget of fine-tuning in hours, training stops when it runs out. default:None')
+
+parser.add_argument(
+    '--eval_every',
+    type=int,
+    default=0,
+    help='Evaluate on a validation subset every this many steps and stop early on a plateau, 0 to disable. default:0')
+
+parser.add_argument(
+    '--val_samples',
+    type=int,
+    default=0,
+    help='The number of samples of the stratified validation subset of --eval_every, held out of training on CIFAR-10. default:0')
+
+parser.add_argument(
+    '--fast_eval',
+    action='store_true',
+    help='Evaluate on a subset of the test set with a confidence interval, the full set only when it may hold a new best.')
+
+parser.add_argument(
+    '--eval_samples',
+    type=int,
+    default=2000,
+    help='The number of samples of the stratified test subset of --fast_eval. default:2000')
+
+parser.add_argument(
+    '--eval_confidence',
+    type=float,
+    default=0.95,
+    help='The confidence level of the subset accuracy interval. default:0.95')
+
+parser.add_argument(
+    '--telemetry',
+    action='store_true',
+    help='Write throughput, data-wait/compute/optimizer time and memory of the training loop to job_dir/telemetry.jsonl.')
+
+parser.add_argument(
+    '--tensorboard',
+    action='store_true',
+    help='Also write the telemetry to TensorBoard in job_dir/run, implies --telemetry.')
+
+parser.add_argument(
+    '--profile',
+    type=str,
+    default=None,
+    choices=('hooks', 'torch'),
+    help='Profile a window of steps with per-module hooks or torch.profiler, written to job_dir/profile.*. default:None')
+
+parser.add_argument(
+    '--profile_steps',
+    type=int,
+    default=20,
+    help='The number of steps profiled, after 2 warmup steps. default:20')
+
+parser.add_argument(
+    '--patience',
+    type=int,
+    default=5,
+    help='Stop after this many subset evaluations without improvement. default:5')
+
+parser.add_argument(
+    '--plateau_tol',
+    type=float,
+    default=0.1,
+    help='An improvement of the subset accuracy below this many points counts as a plateau. default:0.1')
+
+parser.add_argument(
+    '--distill',
+    action='store_true',
+    help='Fine-tune with knowledge distillation from the unpruned model.'
 )
 
 parser.add_argument(
-    '--sketch_model',
+    '--distill_temperature',
+    type=float,
+    default=4.0,
+    help='The softmax temperature of distillation. default:4.0')
+
+parser.add_argument(
+    '--distill_alpha',
+    type=float,
+    default=0.9,
+    help='The weight of the distillation loss, the cross-entropy loss takes the rest. default:0.9')
+
+## Sketch
+parser.add_argument(
+    '--sketch_rate',
     type=str,
     default=None,
-    help='Path to the model wait for sketch/test. default:None'
+    help='The proportion of each layer reserved after sketching convolution layer sketch. default:None'
 )
 
 parser.add_argument(
-    '--weight_norm_method',
+    '--resketch_from',
     type=str,
     default=None,
-    help='Select the weight norm method. default:None Optional:l2'
+    help='A checkpoint sketched before, only the units whose rates changed are sketched again and the rest starts from it. default:None'
 )
 
-args = parser.parse_args()
\ No newline at end of file
+parser.add_argument(
+    '--no_sketch_report',
+    action='store_true',
+    help='Do not write the per-layer sketch fidelity report (sketch_report.json/.csv in job_dir).'
+)
+
+
+def __getattr__(name):
+    # The command line is only parsed when args is first imported, so that
+    # sweep_sketch.py and sketch_progressive.py can import the parent parsers
+    # without parsing it
+    if name == 'args':
+        global args
+        args = parser.parse_args()
+        return args
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
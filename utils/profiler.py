@@ -0,0 +1,257 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+
+import torch
+import torch.nn as nn
+
+
+class LayerTimer():
+    """Accumulates the forward wall time of each layer of a model through hooks"""
+
+    def __init__(self, model, types=(nn.Conv2d, nn.Linear)):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.start_time = {}
+        self.handles = []
+        for name, module in model.named_modules():
+            if isinstance(module, types):
+                self.handles.append(module.register_forward_pre_hook(self._start(name)))
+                self.handles.append(module.register_forward_hook(self._stop(name)))
+
+    def _start(self, name):
+        def hook(module, input):
+            self.start_time[name] = time.perf_counter()
+        return hook
+
+    def _stop(self, name):
+        def hook(module, input, output):
+            self.times[name] += time.perf_counter() - self.start_time[name]
+            self.calls[name] += 1
+        return hook
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+    def average(self):
+        """Average wall time per call of each layer, in seconds"""
+        return {name: self.times[name] / self.calls[name] for name in self.times}
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+def tensors(value):
+    if isinstance(value, torch.Tensor):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [t for v in value for t in tensors(v)]
+    if isinstance(value, dict):
+        return [t for v in value.values() for t in tensors(v)]
+    return []
+
+class ModuleProfiler():
+    """Forward/backward wall time, call counts and output activation bytes of every module of a model.
+
+    Forward spans run from the pre-hook to the hook of a module. Modules that
+    modify their outputs in place (ReLU(inplace=True), out += shortcut) rule
+    out module backward hooks, so a backward span starts when the gradient
+    reaches the autograd node that produced the output of the module and ends
+    when it reaches a node of its inputs, or at the end of the backward pass
+    for modules whose inputs need no gradient. Times of nested modules
+    include their children. With sync, each hook synchronizes the GPU.
+    Nothing is registered until the profiler is created, remove() detaches it.
+    """
+
+    fields = ['module', 'type', 'calls', 'forward', 'backward_calls', 'backward', 'activation_bytes']
+
+    def __init__(self, model, sync=False):
+        self.sync = sync
+        self.types = {}
+        self.stats = defaultdict(lambda: defaultdict(float))
+        self.events = []
+        self.stack = defaultdict(list)
+        self.open_spans = []
+        self.callback_queued = False
+        self.origin = time.perf_counter()
+        self.handles = []
+        for name, module in model.named_modules():
+            name = name or 'model'
+            self.types[name] = type(module).__name__
+            self.handles.append(module.register_forward_pre_hook(self._forward_start(name)))
+            self.handles.append(module.register_forward_hook(self._forward_stop(name)))
+
+    def now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _forward_start(self, name):
+        def hook(module, input):
+            # The nodes are taken before the forward, in place modules replace the grad_fn of their input
+            nodes = {t.grad_fn for t in tensors(input) if t.requires_grad and t.grad_fn is not None}
+            self.stack[name].append((self.now(), nodes))
+        return hook
+
+    def _forward_stop(self, name):
+        def hook(module, input, output):
+            end = self.now()
+            start, input_nodes = self.stack[name].pop()
+            outputs = tensors(output)
+            stats = self.stats[name]
+            stats['calls'] += 1
+            stats['forward'] += end - start
+            stats['activation_bytes'] += sum(t.numel() * t.element_size() for t in outputs)
+            self.events.append((name, 'forward', start, end))
+            if torch.is_grad_enabled():
+                self._watch_backward(name, outputs, input_nodes)
+        return hook
+
+    def _watch_backward(self, name, outputs, input_nodes):
+        output_nodes = {t.grad_fn for t in outputs if t.requires_grad and t.grad_fn is not None}
+        if not output_nodes:
+            return
+        span = {'name': name, 'start': None, 'open': False}
+
+        def begin(grad_outputs):
+            if span['start'] is None:
+                span['start'] = self.now()
+                span['open'] = True
+                self.open_spans.append(span)
+                if not self.callback_queued:
+                    # Closes the spans still open, e.g. of modules whose inputs need no gradient
+                    torch.autograd.Variable._execution_engine.queue_callback(self._finish_backward)
+                    self.callback_queued = True
+
+        def end(grad_outputs):
+            if span['open']:
+                self._close(span, self.now())
+
+        for node in output_nodes:
+            node.register_prehook(begin)
+        for node in input_nodes - output_nodes:
+            node.register_prehook(end)
+
+    def _close(self, span, end):
+        span['open'] = False
+        stats = self.stats[span['name']]
+        stats['backward_calls'] += 1
+        stats['backward'] += end - span['start']
+        self.events.append((span['name'], 'backward', span['start'], end))
+
+    def _finish_backward(self):
+        end = self.now()
+        for span in self.open_spans:
+            if span['open']:
+                self._close(span, end)
+        self.open_spans = []
+        self.callback_queued = False
+
+    def reset(self):
+        """Start a new window"""
+        self.stats.clear()
+        self.events = []
+
+    def rows(self):
+        return [dict({'module': name, 'type': self.types[name]},
+                     **{k: stats[k] for k in self.fields[2:]}) for name, stats in self.stats.items()]
+
+    def summary(self, top=20):
+        """The modules with the largest forward + backward time, skipping the model itself"""
+        rows = sorted((row for row in self.rows() if row['module'] != 'model'),
+                      key=lambda row: row['forward'] + row['backward'], reverse=True)[:top]
+        lines = ['%-40s %-18s %8s %12s %12s %12s' % ('Module', 'Type', 'Calls', 'Forward', 'Backward', 'Activation')]
+        for row in rows:
+            lines.append('%-40s %-18s %8d %10.3fms %10.3fms %10.2fMB' % (
+                row['module'], row['type'], row['calls'], 1000 * row['forward'] / max(row['calls'], 1),
+                1000 * row['backward'] / max(row['backward_calls'], 1),
+                row['activation_bytes'] / max(row['calls'], 1) / 2 ** 20))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """Per-module totals in path.csv and the spans of the window as a Chrome trace in path.json"""
+        with open(path + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            writer.writerows(self.rows())
+        # One row per direction and nesting shows up as stacked slices in chrome://tracing or Perfetto
+        events = [{'name': name, 'cat': phase, 'ph': 'X', 'pid': 0, 'tid': 0 if phase == 'forward' else 1,
+                   'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': {'type': self.types[name]}}
+                  for name, phase, start, end in self.events]
+        with open(path + '.json', 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+class StepProfiler():
+    """Profiles a window of steps of a loop, then writes the results and detaches.
+
+    mode 'hooks' uses ModuleProfiler, 'torch' torch.profiler. The loop calls
+    step() once per iteration, the first warmup steps are not recorded.
+    Results go to path.csv/path.json ('hooks') or path.json and path.txt
+    ('torch'), both Chrome traces.
+    """
+
+    def __init__(self, model, mode, path, steps=20, warmup=2, device='cpu', log=print):
+        self.model = model
+        self.mode = mode
+        self.path = path
+        self.steps = steps
+        self.warmup = warmup
+        self.cuda = torch.device(device).type == 'cuda'
+        self.log = log
+        self.count = 0
+        self.profiler = None
+        self.done = False
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if mode == 'hooks':
+            self.profiler = ModuleProfiler(model, sync=self.cuda)
+        elif mode == 'torch':
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(
+                activities=activities, record_shapes=True, profile_memory=True,
+                schedule=torch.profiler.schedule(wait=0, warmup=warmup, active=steps, repeat=1))
+            self.profiler.start()
+        else:
+            raise ValueError('Unknown profile mode {}'.format(mode))
+
+    def step(self):
+        if self.done:
+            return
+        self.count += 1
+        if self.mode == 'torch':
+            self.profiler.step()
+        elif self.count == self.warmup:
+            self.profiler.reset()
+        if self.count >= self.warmup + self.steps:
+            self.finish()
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        if self.mode == 'hooks':
+            self.profiler.remove()
+            self.profiler.write(self.path)
+            self.log('Module profile of {} steps\n{}'.format(self.count - self.warmup, self.profiler.summary()))
+        else:
+            self.profiler.stop()
+            self.profiler.export_chrome_trace(self.path + '.json')
+            sort_by = 'self_cuda_time_total' if self.cuda else 'self_cpu_time_total'
+            table = self.profiler.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=30)
+            with open(self.path + '.txt', 'w') as f:
+                f.write(table)
+            self.log('torch.profiler of {} steps\n{}'.format(self.count - self.warmup, table))
+        self.log('Profile written to {}.*'.format(self.path))
@@ -0,0 +1,354 @@
+from collections import namedtuple
+from importlib import import_module
+
+from utils.channel import pruned_width
+from utils.cost import conv, bn, linear, conv_out
+
+# A sketched convolution and the BN that follows it (None if there is none).
+# filter: its output filters are sketched to the pruned width (dim 0). channel:
+# its input channels are sketched to follow the filters of the previous
+# convolution (dim 1). coupled: a SketchLayer whose filters follow these one to
+# one, e.g. a depthwise convolution, sketched jointly with them.
+SketchLayer = namedtuple('SketchLayer', ['conv', 'bn', 'filter', 'channel', 'coupled'], defaults=(None,))
+
+# The sketched layers controlled by one entry of the sketch_rate vector
+Unit = namedtuple('Unit', ['name', 'layers'])
+
+
+class Arch():
+    """An architecture: its constructor, its sketch units and the shapes of its layers.
+
+    build(sketch_rate, start_conv, channel_round) returns the model and
+    layers(rates, channel_round, input_size) the list of utils.cost layers
+    given the rate of each unit, both following the same width rule. additive is False when
+    the cost of a layer depends on the rates of two units, e.g. a plain chain
+    of convolutions.
+    """
+
+    def __init__(self, name, build, units, layers, input_size, use_start_conv=True, additive=True):
+        self.name = name
+        self.build = build
+        self.units = units
+        self.layers = layers
+        self.input_size = input_size
+        self.use_start_conv = use_start_conv
+        self.additive = additive
+
+    def num_rates(self, start_conv=1):
+        """Length of the sketch_rate vector"""
+        return len(self.units) - self.rate_offset(start_conv)
+
+    def rate_offset(self, start_conv=1):
+        # Units before start_conv are kept at rate 1.0 and have no entry in the sketch_rate vector
+        return start_conv - 1 if self.use_start_conv else 0
+
+    def unit_rates(self, sketch_rate, start_conv=1):
+        """The rate of each unit"""
+        offset = self.rate_offset(start_conv)
+        return [sketch_rate[k - offset] if sketch_rate is not None and k >= offset else 1.0
+                for k in range(len(self.units))]
+
+    def get_layers(self, sketch_rate=None, start_conv=1, channel_round=None, input_size=None):
+        """The utils.cost layers at an input_size x input_size input, the size the model is trained at by default"""
+        input_size = self.input_size if input_size is None else input_size
+        return self.layers(self.unit_rates(sketch_rate, start_conv), channel_round, input_size)
+
+
+registry = {}
+
+def register(arch, data_set, cfg, spec):
+    registry[(arch, data_set, cfg)] = spec
+
+def get_arch(arch, cfg=None, data_set='cifar10'):
+    data_set = 'imagenet' if data_set == 'imagenet' else 'cifar10'
+    if (arch, data_set, cfg) in registry:
+        return registry[(arch, data_set, cfg)]
+    if (arch, data_set, None) in registry:  # architectures without cfg variants
+        return registry[(arch, data_set, None)]
+    raise ValueError('arch not exist!')
+
+
+def resnet_units(num_blocks, bottleneck):
+    # Block the first convolution layer, only sketching the first dimension
+    # Block the last convolution layer, only sketching on the channel dimension
+    units = []
+    for layer, num in enumerate(num_blocks):
+        for i in range(num):
+            block = 'layer{}.{}'.format(layer + 1, i)
+            if bottleneck:
+                layers = [SketchLayer(block + '.conv1', block + '.bn1', True, False),
+                          SketchLayer(block + '.conv2', block + '.bn2', True, True),
+                          SketchLayer(block + '.conv3', block + '.bn3', False, True)]
+            else:
+                layers = [SketchLayer(block + '.conv1', block + '.bn1', True, False),
+                          SketchLayer(block + '.conv2', block + '.bn2', False, True)]
+            units.append(Unit(block, layers))
+    return units
+
+def resnet_cifar_layers(n, rates, channel_round=None, input_size=32, num_classes=10):
+    """Layers of model/resnet.py"""
+    size = input_size
+    layers = [conv('conv1', 3, 16, 3, size), bn('bn1', 16, size)]
+    inplanes = 16
+    rates = iter(rates)
+    for stage, planes in enumerate([16, 32, 64]):
+        for i in range(n):
+            stride = 2 if stage > 0 and i == 0 else 1
+            size = conv_out(size, 3, stride, 1)
+            middle_planes = pruned_width(planes, next(rates), channel_round)
+            name = 'layer{}.{}.'.format(stage + 1, i)
+            layers += [conv(name + 'conv1', inplanes, middle_planes, 3, size),
+                       bn(name + 'bn1', middle_planes, size),
+                       conv(name + 'conv2', middle_planes, planes, 3, size),
+                       bn(name + 'bn2', planes, size)]
+            inplanes = planes
+    layers.append(linear('fc', 64, num_classes))
+    return layers
+
+def resnet_imagenet_layers(bottleneck, num_blocks, rates, channel_round=None, input_size=224, num_classes=1000):
+    """Layers of model/resnet_imagenet.py"""
+    expansion = 4 if bottleneck else 1
+    size = conv_out(input_size, 7, 2, 3)
+    layers = [conv('conv1', 3, 64, 7, size), bn('bn1', 64, size)]
+    size = conv_out(size, 3, 2, 1)  # maxpool
+    in_planes = 64
+    rates = iter(rates)
+    for stage, planes in enumerate([64, 128, 256, 512]):
+        for i in range(num_blocks[stage]):
+            stride = 2 if stage > 0 and i == 0 else 1
+            in_size = size
+            size = conv_out(size, 3, stride, 1)
+            middle_planes = pruned_width(planes, next(rates), channel_round)
+            name = 'layer{}.{}.'.format(stage + 1, i)
+            if not bottleneck:
+                layers += [conv(name + 'conv1', in_planes, middle_planes, 3, size),
+                           bn(name + 'bn1', middle_planes, size),
+                           conv(name + 'conv2', middle_planes, planes, 3, size),
+                           bn(name + 'bn2', planes, size)]
+            else:
+                layers += [conv(name + 'conv1', in_planes, middle_planes, 1, in_size),
+                           bn(name + 'bn1', middle_planes, in_size),
+                           conv(name + 'conv2', middle_planes, middle_planes, 3, size),
+                           bn(name + 'bn2', middle_planes, size),
+                           conv(name + 'conv3', middle_planes, expansion * planes, 1, size),
+                           bn(name + 'bn3', expansion * planes, size)]
+            if stride != 1 or in_planes != expansion * planes:
+                layers += [conv(name + 'downsample.0', in_planes, expansion * planes, 1, size),
+                           bn(name + 'downsample.1', expansion * planes, size)]
+            in_planes = planes * expansion
+    layers.append(linear('fc', 512 * expansion, num_classes))
+    return layers
+
+
+googlenet_cfg = [
+    # name, in_planes, n1x1, n3x3red, n3x3, n5x5red, n5x5, pool_planes, input size
+    ('inception_a3', 192, 64, 96, 128, 16, 32, 32, 32),
+    ('inception_b3', 256, 128, 128, 192, 32, 96, 64, 32),
+    ('inception_a4', 480, 192, 96, 208, 16, 48, 64, 16),
+    ('inception_b4', 512, 160, 112, 224, 24, 64, 64, 16),
+    ('inception_c4', 512, 128, 128, 256, 24, 64, 64, 16),
+    ('inception_d4', 512, 112, 144, 288, 32, 64, 64, 16),
+    ('inception_e4', 528, 256, 160, 320, 32, 128, 128, 16),
+    ('inception_a5', 832, 256, 160, 320, 32, 128, 128, 8),
+    ('inception_b5', 832, 384, 192, 384, 48, 128, 128, 8),
+]
+
+def googlenet_units():
+    units = []
+    for name in (cfg[0] for cfg in googlenet_cfg):
+        units.append(Unit(name, [SketchLayer(name + '.branch3x3.0', name + '.branch3x3.1', True, False),
+                                 SketchLayer(name + '.branch3x3.3', name + '.branch3x3.4', False, True),
+                                 SketchLayer(name + '.branch5x5.0', name + '.branch5x5.1', True, False),
+                                 SketchLayer(name + '.branch5x5.3', name + '.branch5x5.4', True, True),
+                                 SketchLayer(name + '.branch5x5.6', name + '.branch5x5.7', False, True)]))
+    return units
+
+def googlenet_layers(rates, channel_round=None, input_size=32, num_classes=10):
+    """Layers of model/googlenet.py"""
+    layers = [conv('pre_layers.0', 3, 192, 3, input_size, bias=True), bn('pre_layers.1', 192, input_size)]
+    for i, (name, in_planes, n1x1, n3x3red, n3x3, n5x5red, n5x5, pool_planes, size) in enumerate(googlenet_cfg):
+        size = size * input_size // 32
+        rate = rates[i]
+        n3x3red_sketch = pruned_width(n3x3red, rate, channel_round)
+        n5x5red_sketch = pruned_width(n5x5red, rate, channel_round)
+        n5x5_sketch = pruned_width(n5x5, rate, channel_round)
+        layers += [conv(name + '.branch1x1.0', in_planes, n1x1, 1, size, bias=True),
+                   bn(name + '.branch1x1.1', n1x1, size),
+                   conv(name + '.branch3x3.0', in_planes, n3x3red_sketch, 1, size, bias=True),
+                   bn(name + '.branch3x3.1', n3x3red_sketch, size),
+                   conv(name + '.branch3x3.3', n3x3red_sketch, n3x3, 3, size, bias=True),
+                   bn(name + '.branch3x3.4', n3x3, size),
+                   conv(name + '.branch5x5.0', in_planes, n5x5red_sketch, 1, size, bias=True),
+                   bn(name + '.branch5x5.1', n5x5red_sketch, size),
+                   conv(name + '.branch5x5.3', n5x5red_sketch, n5x5_sketch, 3, size, bias=True),
+                   bn(name + '.branch5x5.4', n5x5_sketch, size),
+                   conv(name + '.branch5x5.6', n5x5_sketch, n5x5, 3, size, bias=True),
+                   bn(name + '.branch5x5.7', n5x5, size),
+                   conv(name + '.branch_pool.1', in_planes, pool_planes, 1, size, bias=True),
+                   bn(name + '.branch_pool.2', pool_planes, size)]
+    layers.append(linear('linear', 1024, num_classes))
+    return layers
+
+
+for cfg, n in [('resnet56', 9), ('resnet110', 18)]:
+    register('resnet', 'cifar10', cfg, Arch(
+        cfg,
+        build=lambda sketch_rate=None, start_conv=1, channel_round=None, cfg=cfg:
+            import_module('model.resnet').resnet(cfg, sketch_rate=sketch_rate, start_conv=start_conv,
+                                                 channel_round=channel_round),
+        units=resnet_units([n] * 3, bottleneck=False),
+        layers=lambda rates, channel_round=None, input_size=32, n=n:
+            resnet_cifar_layers(n, rates, channel_round, input_size),
+        input_size=32))
+
+resnet_imagenet_cfg = {'resnet18': (False, [2, 2, 2, 2]),
+                       'resnet34': (False, [3, 4, 6, 3]),
+                       'resnet50': (True, [3, 4, 6, 3]),
+                       'resnet101': (True, [3, 4, 23, 3]),
+                       'resnet152': (True, [3, 8, 36, 3])}
+for cfg, (bottleneck, num_blocks) in resnet_imagenet_cfg.items():
+    register('resnet', 'imagenet', cfg, Arch(
+        cfg,
+        build=lambda sketch_rate=None, start_conv=1, channel_round=None, cfg=cfg:
+            import_module('model.resnet_imagenet').resnet(cfg, sketch_rate=sketch_rate, start_conv=start_conv,
+                                                          channel_round=channel_round),
+        units=resnet_units(num_blocks, bottleneck),
+        layers=lambda rates, channel_round=None, input_size=224, bottleneck=bottleneck, num_blocks=num_blocks:
+            resnet_imagenet_layers(bottleneck, num_blocks, rates, channel_round, input_size),
+        input_size=224))
+
+register('googlenet', 'cifar10', None, Arch(
+    'googlenet',
+    build=lambda sketch_rate=None, start_conv=1, channel_round=None:
+        import_module('model.googlenet').googlenet(sketch_rate, channel_round=channel_round),
+    units=googlenet_units(),
+    layers=googlenet_layers,
+    input_size=32,
+    use_start_conv=False))
+
+
+def vgg_units(cfg, batch_norm):
+    """One unit per convolution but the last, which only follows the sketched channels"""
+    names = []
+    index = 0
+    for v in cfg:
+        if v == 'M':
+            index += 1
+            continue
+        names.append(('features.{}'.format(index), 'features.{}'.format(index + 1) if batch_norm else None))
+        index += 3 if batch_norm else 2
+    units = []
+    for i, (conv_name, bn_name) in enumerate(names[:-1]):
+        layers = [SketchLayer(conv_name, bn_name, True, i > 0)]
+        if i == len(names) - 2:
+            layers.append(SketchLayer(names[-1][0], names[-1][1], False, True))
+        units.append(Unit(conv_name, layers))
+    return units
+
+def vgg_layers(cfg, batch_norm, rates, channel_round=None, imagenet=True, num_classes=None, input_size=None):
+    """Layers of model/vgg.py"""
+    size = input_size or (224 if imagenet else 32)
+    num_convs = len([v for v in cfg if v != 'M'])
+    layers = []
+    in_channels = 3
+    index = 0
+    k = 0
+    for v in cfg:
+        if v == 'M':
+            size = size // 2
+            index += 1
+            continue
+        if k < num_convs - 1:
+            v = pruned_width(v, rates[k], channel_round)
+        layers.append(conv('features.{}'.format(index), in_channels, v, 3, size, bias=True))
+        if batch_norm:
+            layers.append(bn('features.{}'.format(index + 1), v, size))
+        index += 3 if batch_norm else 2
+        in_channels = v
+        k += 1
+    if imagenet:
+        layers += [linear('classifier.0', in_channels * 7 * 7, 4096),
+                   linear('classifier.3', 4096, 4096),
+                   linear('classifier.6', 4096, num_classes or 1000)]
+    else:
+        layers += [linear('classifier.0', in_channels, 512),
+                   linear('classifier.2', 512, num_classes or 10)]
+    return layers
+
+vgg_cfg = {'vgg16': [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 'M', 512, 512, 512, 'M', 512, 512, 512, 'M']}
+for cfg, batch_norm in [('vgg16', False), ('vgg16_bn', True)]:
+    for data_set, imagenet in [('cifar10', False), ('imagenet', True)]:
+        register('vgg', data_set, cfg, Arch(
+            cfg,
+            build=lambda sketch_rate=None, start_conv=1, channel_round=None, cfg=cfg, imagenet=imagenet:
+                import_module('model.vgg').vgg(cfg, sketch_rate=sketch_rate, start_conv=start_conv,
+                                               imagenet=imagenet, channel_round=channel_round),
+            units=vgg_units(vgg_cfg['vgg16'], batch_norm),
+            layers=lambda rates, channel_round=None, input_size=None, batch_norm=batch_norm, imagenet=imagenet:
+                vgg_layers(vgg_cfg['vgg16'], batch_norm, rates, channel_round, imagenet, input_size=input_size),
+            input_size=224 if imagenet else 32,
+            additive=False))
+
+
+mobilenet_v2_cfg = [
+    # t, c, n, s
+    [1, 16, 1, 1],
+    [6, 24, 2, 2],
+    [6, 32, 3, 2],
+    [6, 64, 4, 2],
+    [6, 96, 3, 1],
+    [6, 160, 3, 2],
+    [6, 320, 1, 1],
+]
+
+def mobilenet_v2_units():
+    """One unit per expanding block: the expansion and its depthwise convolution, then the projection"""
+    units = []
+    index = 1
+    for t, c, n, s in mobilenet_v2_cfg:
+        for i in range(n):
+            block = 'features.{}.conv'.format(index)
+            if t != 1:
+                depthwise = SketchLayer(block + '.1.0', block + '.1.1', True, False)
+                units.append(Unit('features.{}'.format(index),
+                                  [SketchLayer(block + '.0.0', block + '.0.1', True, False, depthwise),
+                                   SketchLayer(block + '.2', block + '.3', False, True)]))
+            index += 1
+    return units
+
+def mobilenet_v2_layers(rates, channel_round=None, input_size=224, num_classes=1000):
+    """Layers of model/mobilenetv2.py"""
+    size = conv_out(input_size, 3, 2, 1)
+    layers = [conv('features.0.0', 3, 32, 3, size), bn('features.0.1', 32, size)]
+    in_planes = 32
+    index = 1
+    rates = iter(rates)
+    for t, c, n, s in mobilenet_v2_cfg:
+        for i in range(n):
+            stride = s if i == 0 else 1
+            block = 'features.{}.conv.'.format(index)
+            hidden = in_planes * t
+            if t != 1:
+                hidden = pruned_width(hidden, next(rates), channel_round)
+                layers += [conv(block + '0.0', in_planes, hidden, 1, size), bn(block + '0.1', hidden, size)]
+                dw, project, project_bn = block + '1.', block + '2', block + '3'
+            else:
+                dw, project, project_bn = block + '0.', block + '1', block + '2'
+            size = conv_out(size, 3, stride, 1)
+            layers += [conv(dw + '0', hidden, hidden, 3, size, groups=hidden), bn(dw + '1', hidden, size),
+                       conv(project, hidden, c, 1, size), bn(project_bn, c, size)]
+            in_planes = c
+            index += 1
+    layers += [conv('features.{}.0'.format(index), in_planes, 1280, 1, size),
+               bn('features.{}.1'.format(index), 1280, size),
+               linear('classifier.1', 1280, num_classes)]
+    return layers
+
+register('mobilenet_v2', 'imagenet', None, Arch(
+    'mobilenet_v2',
+    build=lambda sketch_rate=None, start_conv=1, channel_round=None:
+        import_module('model.mobilenetv2').mobilenet_v2(sketch_rate, start_conv=start_conv,
+                                                         channel_round=channel_round),
+    units=mobilenet_v2_units(),
+    layers=mobilenet_v2_layers,
+    input_size=224))
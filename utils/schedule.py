@@ -0,0 +1,73 @@
+import math
+import time
+
+
+class FineTuneSchedule():
+    """Per-step learning rate of a fine-tuning run sized to an epoch and/or wall-clock budget.
+
+    The progress of the run is the larger of the share of steps and the share of
+    time_budget (seconds) spent, so the schedule completes whichever runs out
+    first. 'cosine' anneals from lr to 0, 'onecycle' warms up from lr/25 over the
+    first 30% and anneals to lr/1e4. With 'step' the learning rate is left to
+    the script and only the budget is tracked.
+    """
+
+    def __init__(self, optimizer, schedule, lr, total_steps, time_budget=None):
+        self.optimizer = optimizer
+        self.schedule = schedule
+        self.lr = lr
+        self.total_steps = total_steps
+        self.time_budget = time_budget
+        self.steps = 0
+        self.start_time = time.time()
+        self.set_lr()
+
+    def progress(self):
+        progress = self.steps / self.total_steps
+        if self.time_budget is not None:
+            progress = max(progress, (time.time() - self.start_time) / self.time_budget)
+        return min(progress, 1.0)
+
+    def get_lr(self):
+        progress = self.progress()
+        if self.schedule == 'cosine':
+            return self.lr * 0.5 * (1 + math.cos(math.pi * progress))
+        elif self.schedule == 'onecycle':
+            pct_start, initial_lr, final_lr = 0.3, self.lr / 25., self.lr / 1e4
+            if progress < pct_start:
+                return initial_lr + (self.lr - initial_lr) * progress / pct_start
+            progress = (progress - pct_start) / (1 - pct_start)
+            return final_lr + (self.lr - final_lr) * 0.5 * (1 + math.cos(math.pi * progress))
+        return None
+
+    def set_lr(self):
+        lr = self.get_lr()
+        if lr is not None:
+            for param_group in self.optimizer.param_groups:
+                param_group['lr'] = lr
+
+    def step(self):
+        self.steps += 1
+        self.set_lr()
+
+    def finished(self):
+        return self.progress() >= 1.0
+
+class EarlyStopping():
+    """Stop once patience evaluations in a row did not beat the best accuracy by more than tolerance"""
+
+    def __init__(self, patience=5, tolerance=0.1):
+        self.patience = patience
+        self.tolerance = tolerance
+        self.best = None
+        self.num_bad = 0
+
+    def update(self, acc):
+        """Record an evaluation, returns True to stop"""
+        if self.best is None or acc > self.best + self.tolerance:
+            self.best = acc
+            self.num_bad = 0
+        else:
+            self.best = max(self.best, acc)
+            self.num_bad += 1
+        return self.num_bad >= self.patience
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def optimize_for_inference(model, input_size, device, fuse=False, jit=False):
+    """Eval model, with Conv+BN pairs folded (fuse) and/or traced and frozen with TorchScript (jit)"""
+    model = model.eval().to(device)
+    if fuse:
+        from torch.fx.experimental.optimization import fuse as fuse_conv_bn
+        model = fuse_conv_bn(model)
+    if jit:
+        with torch.no_grad():
+            model = torch.jit.freeze(torch.jit.trace(model, torch.randn(1, 3, input_size, input_size, device=device)))
+    return model
+
+def tensor_key(tensor):
+    """Content hash of a tensor, with its dtype and shape"""
+    tensor = tensor.detach().cpu().contiguous()
+    digest = hashlib.sha1('{}|{}'.format(tensor.dtype, tuple(tensor.size())).encode())
+    digest.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def share_state_dicts(state_dicts, device='cpu', path=None, alignment=64):
+    """Copies of state_dicts where identical tensors are one and the same tensor.
+
+    Load them with load_state_dict(..., assign=True) so that the models keep
+    the shared tensors instead of copying them. On CPU with a path, the
+    distinct tensors are written to that file and mapped back copy-on-write,
+    so processes serving the same file also share the pages. Returns the
+    state dicts and the total and distinct bytes.
+    """
+    keys = [{name: tensor_key(tensor) for name, tensor in state_dict.items()} for state_dict in state_dicts]
+    unique = {}
+    total_bytes = 0
+    for state_dict, state_keys in zip(state_dicts, keys):
+        for name, tensor in state_dict.items():
+            total_bytes += tensor.numel() * tensor.element_size()
+            unique.setdefault(state_keys[name], tensor.detach())
+
+    if path is not None and torch.device(device).type == 'cpu':
+        offsets = {}
+        nbytes = 0
+        with open(path, 'wb') as f:
+            for key, tensor in unique.items():
+                # Offsets aligned for every element size
+                padding = -nbytes % alignment
+                f.write(b'\0' * padding)
+                nbytes += padding
+                offsets[key] = nbytes
+                data = tensor.cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+                f.write(data)
+                nbytes += len(data)
+        storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=nbytes)
+        for key, tensor in unique.items():
+            view = torch.empty(0, dtype=tensor.dtype)
+            view.set_(storage, offsets[key] // tensor.element_size(), tensor.size())
+            unique[key] = view
+    else:
+        unique = {key: tensor.to(device).contiguous() for key, tensor in unique.items()}
+
+    shared = [{name: unique[state_keys[name]] for name in state_keys} for state_keys in keys]
+    unique_bytes = sum(tensor.numel() * tensor.element_size() for tensor in unique.values())
+    return shared, total_bytes, unique_bytes
+
+class LatencyStats():
+    """Latency percentiles and throughput over the last window requests"""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.finish_times = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self.start_time = time.perf_counter()
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def record(self, latency):
+        self.requests += 1
+        self.latencies.append(latency)
+        self.finish_times.append(time.perf_counter())
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q / 100. * len(latencies)))]
+
+    def summary(self):
+        elapsed = self.finish_times[-1] - self.finish_times[0] if len(self.finish_times) > 1 else 0.0
+        return {'requests': self.requests, 'batches': self.batches,
+                'p50_ms': 1000 * self.percentile(50), 'p99_ms': 1000 * self.percentile(99),
+                'throughput': (len(self.finish_times) - 1) / elapsed if elapsed > 0 else 0.0,
+                'mean_batch_size': sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+                'uptime': time.perf_counter() - self.start_time}
+
+class DynamicBatcher():
+    """Groups concurrent requests into batches of at most max_batch_size, waiting at most max_wait seconds.
+
+    A batch is closed as soon as it is full or max_wait after its first
+    request arrived, then runs on a pool of workers threads (torch releases
+    the GIL in its kernels) while the next batch is being collected.
+    """
+
+    def __init__(self, model, device, max_batch_size=32, max_wait=0.005, workers=1):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = asyncio.Semaphore(workers)
+        self.queue = asyncio.Queue()
+        self.stats = LatencyStats()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def predict(self, input):
+        """Logits of one input of shape (3, H, W)"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((input, future, time.perf_counter()))
+        return await future
+
+    def _run(self, inputs):
+        with torch.no_grad():
+            return self.model(torch.stack(inputs).to(self.device)).float().cpu()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._run, [input for input, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+        self.stats.record_batch(len(batch))
+        now = time.perf_counter()
+        for (_, future, arrival), output in zip(batch, outputs):
+            self.stats.record(now - arrival)
+            if not future.done():
+                future.set_result(output)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,127 @@
+import torch
+import torch.nn as nn
+
+from utils.cost import Layer
+
+
+def channel_pairs(arch):
+    """(producer, consumer) SketchLayers of an architecture.
+
+    The filters of each filter-sketched producer are the input channels of the
+    next channel-sketched layer, e.g. conv1 and conv2 of a ResNet block or two
+    consecutive convolutions of VGG.
+    """
+    layers = [layer for unit in arch.units for layer in unit.layers]
+    pairs = []
+    for i, layer in enumerate(layers):
+        if not layer.filter:
+            continue
+        consumer = next((l for l in layers[i + 1:] if l.channel), None)
+        if consumer is not None:
+            pairs.append((layer, consumer))
+    return pairs
+
+def output_terms(modules, layer):
+    """Per-filter input-dependent scale and constant of a conv and its BN in eval mode, conv(x) -> s * (w/|w|)x + c"""
+    conv = modules[layer.conv]
+    scale = conv.weight.detach().flatten(1).norm(dim=1)
+    shift = conv.bias.detach().clone() if conv.bias is not None else torch.zeros_like(scale)
+    if layer.bn is not None:
+        bn = modules[layer.bn]
+        factor = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+        scale = scale * factor.abs()
+        shift = factor * (shift - bn.running_mean) + bn.bias.detach()
+    return scale, shift
+
+def removable_channels(arch, model, tol=1e-3):
+    """The filters to keep of each producer conv, for the producers with filters that can be removed.
+
+    A filter can be removed when its activation is zero, i.e. its
+    input-dependent scale is at most tol times the largest one of its layer
+    and its constant output is at most tol after the ReLU (and so is that of
+    its coupled depthwise filter), or when the consumer does not use it, i.e.
+    the norm of the consumer weights on that channel is at most tol times the
+    largest one. At least one filter is kept.
+    """
+    modules = dict(model.named_modules())
+    keep = {}
+    for producer, consumer in channel_pairs(arch):
+        scale, shift = output_terms(modules, producer)
+        dead = (scale <= tol * scale.max()) & (shift <= tol)
+        if producer.coupled is not None:
+            _, coupled_shift = output_terms(modules, producer.coupled)
+            dead &= coupled_shift <= tol
+        usage = modules[consumer.conv].weight.detach().transpose(0, 1).flatten(1).norm(dim=1)
+        removable = dead | (usage <= tol * usage.max())
+        if removable.all():
+            removable[torch.argmax(usage * scale)] = False
+        if removable.any():
+            keep[producer.conv] = torch.nonzero(~removable).flatten().tolist()
+    return keep
+
+def slice_conv(conv, keep, dim):
+    index = torch.tensor(keep, dtype=torch.long, device=conv.weight.device)
+    conv.weight = nn.Parameter(conv.weight.detach().index_select(dim, index).clone())
+    if dim == 0:
+        if conv.bias is not None:
+            conv.bias = nn.Parameter(conv.bias.detach()[index].clone())
+        conv.out_channels = len(keep)
+    else:
+        conv.in_channels = len(keep)
+
+def slice_bn(bn, keep):
+    index = torch.tensor(keep, dtype=torch.long, device=bn.weight.device)
+    bn.weight = nn.Parameter(bn.weight.detach()[index].clone())
+    bn.bias = nn.Parameter(bn.bias.detach()[index].clone())
+    bn.running_mean = bn.running_mean[index].clone()
+    bn.running_var = bn.running_var[index].clone()
+    bn.num_features = len(keep)
+
+def remove_channels(arch, model, keep):
+    """Keep only the given filters of each producer conv in place, with its BN, coupled layer and consumer channels"""
+    modules = dict(model.named_modules())
+    for producer, consumer in channel_pairs(arch):
+        if producer.conv not in keep:
+            continue
+        filters = list(keep[producer.conv])
+        slice_conv(modules[producer.conv], filters, 0)
+        if producer.bn is not None:
+            slice_bn(modules[producer.bn], filters)
+        if producer.coupled is not None:
+            depthwise = modules[producer.coupled.conv]
+            slice_conv(depthwise, filters, 0)
+            depthwise.in_channels = depthwise.groups = len(filters)
+            if producer.coupled.bn is not None:
+                slice_bn(modules[producer.coupled.bn], filters)
+        slice_conv(modules[consumer.conv], filters, 1)
+    return model
+
+def resize(arch, model, widths):
+    """Give a freshly built model the widths of a shrunk checkpoint, so that its state_dict loads"""
+    return remove_channels(arch, model, {name: range(width) for name, width in widths.items()})
+
+def channel_widths(model, keep):
+    """The model definition of a shrunk model, the width of each shrunk producer conv"""
+    modules = dict(model.named_modules())
+    return {name: modules[name].out_channels for name in keep}
+
+def shrunk_layers(arch, layers, widths):
+    """The utils.cost layers of an architecture after resize"""
+    out_widths, in_widths = {}, {}
+    for producer, consumer in channel_pairs(arch):
+        if producer.conv in widths:
+            width = widths[producer.conv]
+            for name in (producer.conv, producer.bn):
+                out_widths[name] = width
+            if producer.coupled is not None:
+                for name in (producer.coupled.conv, producer.coupled.bn):
+                    out_widths[name] = in_widths[name] = width
+            in_widths[consumer.conv] = width
+    shrunk = []
+    for layer in layers:
+        out_channels = out_widths.get(layer.name, layer.out_channels)
+        in_channels = in_widths.get(layer.name, out_channels if layer.type == 'bn' else layer.in_channels)
+        groups = out_channels if layer.groups == layer.out_channels and layer.groups > 1 else layer.groups
+        shrunk.append(Layer(layer.name, layer.type, in_channels, out_channels, layer.kernel_size, groups,
+                            layer.out_size, layer.bias))
+    return shrunk
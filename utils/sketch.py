@@ -0,0 +1,239 @@
+import time
+from functools import partial
+
+import torch
+
+
+def weight_norm(weight, weight_norm_method=None):
+
+    if weight_norm_method == 'l2':
+        norm_func = lambda x: torch.sqrt(torch.sum(x.pow(2)))
+    else:
+        norm_func = lambda x: 1.0
+
+    weight /= norm_func(weight)
+
+    return weight
+
+def frequent_directions(chunks, l, m, n=None, dtype=torch.float32, device=None):
+    """Frequent Directions sketch of a stream of row chunks of width m into l rows.
+
+    Only the l x m sketch and the current chunk are held in memory, so the
+    rows may come from a generator or a memory-mapped file of any length n.
+    If n is known, the last shrink is skipped once fewer than l/2 rows remain.
+    The sketch is accumulated in dtype on device, rows are moved there as they come.
+    """
+    B = torch.zeros(l, m, dtype=dtype, device=device)
+    ind = int(l / 2)
+    numNonzeroRows = 0  # number of non - zero rows
+    i = 0  # number of rows consumed
+
+    for chunk in chunks:
+        chunk = torch.as_tensor(chunk)  # rows of any shape with m elements, possibly strided
+        pos = 0
+        while pos < chunk.size(0):
+            if numNonzeroRows == l:
+                if n is not None and n - i < l // 2:
+                    return B
+                u, sigma, _ = torch.svd(B.t())
+                sigmaSquare = sigma.mul(sigma)
+                sigmaSquareDiag = torch.diag(sigmaSquare)
+                theta = sigmaSquareDiag[ind]
+                sigmaSquare = sigmaSquareDiag - torch.eye(l, dtype=B.dtype, device=B.device) * torch.sum(theta)
+                sigmaHat = torch.sqrt(torch.where(sigmaSquare > 0, sigmaSquare, torch.zeros_like(sigmaSquare)))
+                B = sigmaHat.mm(u.t())
+                numNonzeroRows = ind
+            # Rows are copied in bulk until the sketch is full
+            k = min(l - numNonzeroRows, chunk.size(0) - pos)
+            B[numNonzeroRows:numNonzeroRows + k, :] = chunk[pos:pos + k].reshape(k, m)
+            numNonzeroRows += k
+            pos += k
+            i += k
+
+    return B
+
+def memmap_chunks(path, shape, dtype='float32', chunk_rows=1024):
+    """Row chunks of a matrix stored in a raw binary file, read through a memory map"""
+    import numpy as np
+    A = np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape))
+    for start in range(0, A.shape[0], chunk_rows):
+        yield torch.from_numpy(np.array(A[start:start + chunk_rows]))
+
+def sketch_stream(chunks, l, m, n=None, weight_norm_method=None, dtype=torch.float32, device=None):
+    """Sketch a matrix that does not fit in memory, e.g. sketch_stream(memmap_chunks(path, (n, m)), l, m, n)"""
+    return weight_norm(frequent_directions(chunks, l, m, n, dtype, device), weight_norm_method)
+
+def sketch_matrix(weight, l, dim, weight_norm_method=None, report=None, dtype=None):
+    """Sketch on the device of weight, accumulating in dtype (default: the dtype of weight, at least fp32).
+
+    report(dim, A, B, time, peak_memory, memory_estimate) is called with the sketched matrix and its
+    sketch if given. peak_memory is the peak CUDA allocation of the sketch above the memory allocated
+    before it, known when the sketch raises the peak of the process and None otherwise or on CPU.
+    memory_estimate is the working memory of the sketch, the SVD factors and the copied rows computed
+    from l and m.
+    """
+
+    start_time = time.perf_counter()
+    if report is not None and weight.is_cuda:
+        # The global peak counter is left alone, it may be watched by the caller (e.g. telemetry)
+        base_peak = torch.cuda.max_memory_allocated(weight.device)
+        base_memory = torch.cuda.memory_allocated(weight.device)
+
+    # The rows are the filters (dim 0) or the channels (dim 1), the transpose is a strided view, not a copy
+    A = weight.transpose(0, dim)
+    n, m = A.size(0), A[0].numel()
+
+    if dtype is None:
+        dtype = weight.dtype if weight.dtype in (torch.float32, torch.float64) else torch.float32
+    B = frequent_directions([A], l, m, n, dtype, weight.device)
+
+    if report is not None:
+        elapsed = time.perf_counter() - start_time
+        peak_memory = None
+        if weight.is_cuda:
+            peak = torch.cuda.max_memory_allocated(weight.device)
+            # Below an earlier peak of the process, the peak of the sketch is not observable
+            peak_memory = peak - base_memory if peak > base_peak else None
+        memory_estimate = (3 * B.numel() + l * l) * B.element_size()
+        report(dim, A.reshape(n, m), B, elapsed, peak_memory, memory_estimate)
+
+    B = B.view((l,) + tuple(A.size()[1:])).transpose(0, dim).contiguous()
+    return weight_norm(B, weight_norm_method).to(weight.dtype)
+
+def sketch_filters(weights, l, weight_norm_method=None, report=None, dtype=None):
+    """Sketch the filters of one or more convolutions jointly to l filters.
+
+    The i-th filters of all weights are concatenated into one row, so that
+    coupled layers (e.g. a depthwise convolution following the filters of a
+    pointwise one) are sketched with the same directions.
+    """
+    rows = torch.cat([weight.view(weight.size(0), -1) for weight in weights], 1)
+    if l >= rows.size(1):
+        # Frequent Directions needs fewer rows than columns, keep the leading original filters
+        return [weight[:l] for weight in weights]
+    B = sketch_matrix(rows.view(rows.size(0), rows.size(1), 1, 1), l, dim=0, weight_norm_method=weight_norm_method,
+                      report=report, dtype=dtype)
+    B = B.view(l, -1)
+    sketched, start = [], 0
+    for weight in weights:
+        end = start + weight[0].numel()
+        sketched.append(B[:, start:end].contiguous().view(l, *weight.size()[1:]))
+        start = end
+    return sketched
+
+def sketch_unit(unit, oristate_dict, state_dict, weight_norm_method=None, report=None, dtype=None):
+    """Sketch the convolutions of one registry unit from oristate_dict into state_dict.
+
+    Returns the sketched tensors, keyed by state_dict name. The BN and bias
+    following a sketched filter dimension are left at their fresh initialization.
+    Each sketch is recorded in report (a utils.fidelity.SketchReport) if given,
+    dtype is the accumulation dtype of sketch_matrix.
+    """
+    sketched = {}
+    for layer in unit.layers:
+        conv_weight_name = layer.conv + '.weight'
+        weight = oristate_dict[conv_weight_name]
+        size = state_dict[conv_weight_name].size()
+        coupled = [layer.coupled] if layer.coupled is not None else []
+        record = partial(report.record, layer.conv) if report is not None else None
+
+        weights = [weight] + [oristate_dict[c.conv + '.weight'] for c in coupled]
+        # A filter dimension not smaller than the filter size and not pruned retains the original weight
+        if layer.filter and (size[0] < sum(w[0].numel() for w in weights) or size[0] < weight.size(0)):
+            weights = sketch_filters(weights, size[0], weight_norm_method=weight_norm_method, report=record,
+                                     dtype=dtype)
+            weight = weights[0]
+            for c, coupled_weight in zip(coupled, weights[1:]):
+                sketched[c.conv + '.weight'] = coupled_weight
+            for name in [layer.bn] + [c.bn for c in coupled]:
+                if name is not None:
+                    for suffix in ('.weight', '.bias', '.running_mean', '.running_var'):
+                        sketched[name + suffix] = state_dict[name + suffix]
+            for name in [layer.conv] + [c.conv for c in coupled]:
+                if name + '.bias' in state_dict:
+                    sketched[name + '.bias'] = state_dict[name + '.bias']
+        if layer.channel and size[1] < weight.size(1):
+            weight = sketch_matrix(weight, size[1], dim=1, weight_norm_method=weight_norm_method, report=record,
+                                   dtype=dtype)
+            if layer.conv + '.bias' in state_dict:
+                sketched[layer.conv + '.bias'] = state_dict[layer.conv + '.bias']
+
+        sketched[conv_weight_name] = weight
+
+    state_dict.update(sketched)
+    return sketched
+
+def sketch_state_dict(arch, model, oristate_dict, weight_norm_method=None, report=None, dtype=None):
+    """Sketch every unit of a registered architecture into the state_dict of the pruned model.
+
+    Weights that are not touched by the sketch are copied from oristate_dict.
+    """
+    state_dict = model.state_dict()
+    sketched = {}
+    for unit in arch.units:
+        sketched.update(sketch_unit(unit, oristate_dict, state_dict, weight_norm_method, report, dtype))
+    copy_unsketched(state_dict, oristate_dict, sketched)
+    return state_dict
+
+def unit_names(unit, state_dict):
+    """Names in state_dict of the convolutions and BN of a unit, coupled layers included"""
+    prefixes = []
+    for layer in unit.layers:
+        for l in [layer] + ([layer.coupled] if layer.coupled is not None else []):
+            prefixes += [l.conv + '.'] + ([l.bn + '.'] if l.bn is not None else [])
+    return [name for name in state_dict if name.startswith(tuple(prefixes))]
+
+def changed_units(arch, prev_sketch_rate, sketch_rate, start_conv=1):
+    """Indices of the units whose rate differs between two sketch_rate vectors"""
+    prev_rates = arch.unit_rates(prev_sketch_rate, start_conv)
+    rates = arch.unit_rates(sketch_rate, start_conv)
+    return {k for k, (prev_rate, rate) in enumerate(zip(prev_rates, rates)) if prev_rate != rate}
+
+def resketch_state_dict(arch, model, oristate_dict, prev_state_dict, weight_norm_method=None, report=None,
+                        dtype=None, changed=None):
+    """Like sketch_state_dict, but only the changed units are sketched.
+
+    prev_state_dict is a previously sketched (and fine-tuned) model. A unit
+    changed if its index is in changed, e.g. from changed_units, or if its
+    widths differ from prev_state_dict. The weights of prev_state_dict are
+    kept for the unchanged units and for every weight outside the units that
+    kept its shape. In a plain chain (not arch.additive) the unit after a
+    changed one is sketched again too, since its channels were fine-tuned
+    against the old filters. Returns the state dict and the names of the
+    sketched units.
+    """
+    state_dict = model.state_dict()
+    changed = changed if changed is not None else set()
+    sketched = {}
+    resketched = []
+    previous_changed = False
+    for index, unit in enumerate(arch.units):
+        names = unit_names(unit, state_dict)
+        changed_unit = index in changed or any(
+            name not in prev_state_dict or prev_state_dict[name].size() != state_dict[name].size() for name in names)
+        if changed_unit or (previous_changed and not arch.additive):
+            unit_sketched = sketch_unit(unit, oristate_dict, state_dict, weight_norm_method, report, dtype)
+            # The rest of the unit, e.g. the BN after a channel-only sketch, restarts from the original model
+            copy_unsketched(state_dict, oristate_dict, unit_sketched, names)
+            sketched.update({name: state_dict[name] for name in names})
+            resketched.append(unit.name)
+        else:
+            reused = {name: prev_state_dict[name] for name in names}
+            state_dict.update(reused)
+            sketched.update(reused)
+        previous_changed = changed_unit
+
+    for name in state_dict:
+        if name in sketched:
+            continue
+        if name in prev_state_dict and prev_state_dict[name].size() == state_dict[name].size():
+            state_dict[name] = prev_state_dict[name]
+        elif name in oristate_dict:
+            state_dict[name] = oristate_dict[name]
+    return state_dict, resketched
+
+def copy_unsketched(state_dict, oristate_dict, sketched, names=None):
+    """Reassign non sketch weights to the new network, only those in names if given"""
+    for name in state_dict if names is None else names:
+        if name not in sketched and name in oristate_dict:
+            state_dict[name] = oristate_dict[name]
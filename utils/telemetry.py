@@ -0,0 +1,90 @@
+import json
+import resource
+import time
+from collections import defaultdict
+
+import torch
+
+
+class Telemetry():
+    """Per-interval throughput, time split and memory high-water marks of a training loop.
+
+    The loop calls mark(phase) at the end of each phase, the time since the
+    previous mark is charged to that phase: 'data' at the top of the loop body
+    is the time spent waiting on the loader. On GPU each mark synchronizes the
+    device so that asynchronous kernels are charged to the phase that queued
+    them. Records are appended to path as JSON lines, and to TensorBoard under
+    tensorboard_dir if given.
+
+    The global CUDA peak is never reset here, gpu_max_allocated_mb is the peak
+    since the script last reset it (every epoch in sketch_imagenet.py), and the
+    peak of the interval is sampled at the marks as gpu_interval_allocated_mb.
+    """
+
+    def __init__(self, path, device='cpu', tensorboard_dir=None):
+        self.file = open(path, 'a')
+        self.cuda = torch.device(device).type == 'cuda'
+        self.device = device
+        self.writer = None
+        if tensorboard_dir is not None:
+            from torch.utils.tensorboard import SummaryWriter
+            self.writer = SummaryWriter(str(tensorboard_dir))
+        self.global_step = 0
+        self.start()
+
+    def start(self):
+        """Start a new interval, e.g. at the beginning of an epoch"""
+        self.times = defaultdict(float)
+        self.images = 0
+        self.steps = 0
+        self.interval_start = self.last_mark = time.perf_counter()
+        self.interval_allocated = 0
+
+    def mark(self, phase):
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+            self.interval_allocated = max(self.interval_allocated, torch.cuda.memory_allocated(self.device))
+        now = time.perf_counter()
+        self.times[phase] += now - self.last_mark
+        self.last_mark = now
+
+    def step(self, batch_size):
+        self.images += batch_size
+        self.steps += 1
+        self.global_step += 1
+
+    def log(self, epoch, **metrics):
+        """Write the record of the interval since the last log and start the next one"""
+        elapsed = time.perf_counter() - self.interval_start
+        record = {'event': 'train', 'epoch': epoch, 'step': self.global_step, 'steps': self.steps,
+                  'images': self.images, 'images_per_sec': self.images / max(elapsed, 1e-12), 'time': elapsed}
+        for phase, phase_time in self.times.items():
+            record[phase + '_time'] = phase_time
+        # ru_maxrss is in kilobytes on Linux
+        record['cpu_max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        if self.cuda:
+            record['gpu_max_allocated_mb'] = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+            record['gpu_interval_allocated_mb'] = self.interval_allocated / 2 ** 20
+        record.update({k: float(v) for k, v in metrics.items()})
+        self.write(record)
+        self.start()
+
+    def event(self, event, **values):
+        """A one-off record such as a checkpoint write or an evaluation"""
+        record = {'event': event, 'step': self.global_step}
+        record.update(values)
+        self.write(record)
+
+    def write(self, record):
+        record['timestamp'] = time.time()
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        if self.writer is not None:
+            for k, v in record.items():
+                if k not in ('event', 'step', 'timestamp', 'epoch') and isinstance(v, (int, float)):
+                    self.writer.add_scalar('{}/{}'.format(record['event'], k), v, self.global_step)
+
+    def close(self):
+        self.file.close()
+        if self.writer is not None:
+            self.writer.close()